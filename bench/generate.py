@@ -0,0 +1,116 @@
+"""Seeded generator of realistic todo.txt and done.txt files
+
+    python bench/generate.py DIRECTORY --lines 100000 [--seed 1]
+
+writes todo.txt, done.txt, someday.txt, waiting.txt and the notes they
+reference into DIRECTORY. The same seed always produces the same files.
+"""
+
+import argparse
+import os
+import random
+from datetime import date, timedelta
+
+CONTEXTS = ["home", "office", "phone", "errands", "computer", "email", "online", "car", "garden", "store"]
+PROJECTS = ["website", "taxes", "garden", "alpha", "beta", "moving", "wedding", "book", "hiring", "budget"]
+VERBS = ["Call", "Email", "Review", "Write", "Fix", "Plan", "Buy", "Schedule", "Clean", "Prepare", "Update"]
+OBJECTS = [
+    "the quarterly report",
+    "mom",
+    "the dentist",
+    "groceries",
+    "the landlord",
+    "slides for Monday",
+    "the bike",
+    "insurance papers",
+    "a birthday gift",
+    "the release notes",
+    "the garage",
+    "travel plans",
+]
+
+NOTE_COUNT = 50
+
+
+def _zipf_choice(rng, items):
+    """Pick items with a long tail, the first ones being the most frequent"""
+    index = int(len(items) * rng.random() ** 2.5)
+    return items[min(index, len(items) - 1)]
+
+
+def generate_task(rng, number, today, completed=False):
+    """Return one todo.txt line"""
+    parts = []
+    created = today - timedelta(days=rng.randint(0, 400))
+
+    if completed:
+        done = created + timedelta(days=rng.randint(0, 60))
+        parts.append("x {0}".format(min(done, today).isoformat()))
+    if rng.random() < 0.35:
+        parts.append("({0})".format(_zipf_choice(rng, "ABCDEFZ")))
+    if rng.random() < 0.7:
+        parts.append(created.isoformat())
+
+    parts.append("{0} {1}".format(rng.choice(VERBS), rng.choice(OBJECTS)))
+    if rng.random() < 0.2:
+        parts.append("#{0}".format(number))
+
+    for _ in range(rng.choice((0, 1, 1, 1, 2))):
+        parts.append("@" + _zipf_choice(rng, CONTEXTS))
+    for _ in range(rng.choice((0, 1, 1, 2))):
+        parts.append("+" + _zipf_choice(rng, PROJECTS))
+
+    if rng.random() < 0.3:
+        due = today + timedelta(days=rng.randint(-30, 90))
+        parts.append("due:" + due.isoformat())
+    if rng.random() < 0.05:
+        parts.append("note:notes/note{0}.md".format(rng.randint(1, NOTE_COUNT * 2)))
+    return " ".join(parts)
+
+
+def generate_lines(count, seed=1, completed_ratio=0.2, today=None):
+    """Return count todo.txt lines, about completed_ratio of them completed"""
+    rng = random.Random(seed)
+    today = today or date.today()
+    return [generate_task(rng, number, today, rng.random() < completed_ratio) for number in range(count)]
+
+
+def generate_text(count, seed=1, completed_ratio=0.2, today=None):
+    """Return count todo.txt lines joined into a file's content"""
+    return "\n".join(generate_lines(count, seed, completed_ratio, today)) + "\n"
+
+
+def write_files(directory, lines, seed=1):
+    """Write a todo directory with lines tasks in todo.txt and 4x as many in done.txt
+
+    Half of the notes referenced by the tasks exist, so both note
+    highlights are exercised.
+    """
+    os.makedirs(os.path.join(directory, "notes"), exist_ok=True)
+    files = {
+        "todo.txt": generate_text(lines, seed),
+        "done.txt": generate_text(lines * 4, seed + 1, completed_ratio=1.0),
+        "someday.txt": generate_text(max(lines // 10, 1), seed + 2, completed_ratio=0.0),
+        "waiting.txt": generate_text(max(lines // 20, 1), seed + 3, completed_ratio=0.0),
+    }
+    for name, content in files.items():
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(content)
+
+    rng = random.Random(seed)
+    for number in range(1, NOTE_COUNT + 1):
+        with open(os.path.join(directory, "notes", "note{0}.md".format(number)), "w", encoding="utf-8") as f:
+            f.write("\n".join("Note {0} line {1}".format(number, i) for i in range(rng.randint(0, 400))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    write_files(args.directory, args.lines, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+"""Headless benchmarks of the plugin's hot paths
+
+    python bench/run.py [--sizes 1000 10000 100000] [--only sort highlight]
+                        [--repeat 3] [--save] [--tolerance 1.0]
+
+The plugin is loaded against the stub sublime and sublime_plugin modules in
+bench/stubs, every scenario runs on generated files of each size and the
+best of --repeat runs is compared with bench/baselines.json. --save stores
+the results as the new baselines. Exits with status 1 when a scenario is
+slower than its baseline by more than --tolerance (1.0 = 100%) and by more
+than NOISE_FLOOR seconds.
+
+Timings include the overhead of the stub view, which keeps its text in a
+plain string, so they are only comparable with baselines recorded on the
+same machine.
+"""
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+BASELINES_FILE = os.path.join(BENCH_DIR, "baselines.json")
+
+sys.path.insert(0, os.path.join(BENCH_DIR, "stubs"))
+sys.path.insert(0, BENCH_DIR)
+
+import sublime  # noqa: E402
+import sublime_plugin  # noqa: E402
+from generate import write_files  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Slowdowns smaller than this are timer noise, whatever the ratio
+NOISE_FLOOR = 0.002
+
+# Lines selected for the commands working on the selection
+SELECTED_LINES = 1000
+
+
+def load_plugin():
+    """Import every plugin module as the TodoTxt package, like Sublime does"""
+    package = types.ModuleType("TodoTxt")
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules["TodoTxt"] = package
+
+    modules = {}
+    for name in sorted(os.listdir(PACKAGE_DIR)):
+        if name.startswith("todotxt_") and name.endswith(".py"):
+            modules[name[:-3]] = importlib.import_module("TodoTxt." + name[:-3])
+    return modules
+
+
+def fire(modules, event, *args):
+    """Call the event handler of every event listener of the plugin, like Sublime does"""
+    for module in modules.values():
+        for listener in vars(module).values():
+            if (
+                isinstance(listener, type)
+                and issubclass(listener, sublime_plugin.EventListener)
+                and listener.__module__ == module.__name__
+                and hasattr(listener, event)
+            ):
+                getattr(listener(), event)(*args)
+
+
+def wait_for(condition, timeout=60):
+    """Run queued callbacks until condition() holds, for work done on threads"""
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if not sublime.run_timeouts() and time.perf_counter() > deadline:
+            raise RuntimeError("Timed out waiting for background work")
+        time.sleep(0.0005)
+    sublime.run_timeouts()
+
+
+class Workspace(object):
+    """Generated todo files of one size, copied fresh for every run
+
+    Views of the previous run are closed, releasing their task indexes,
+    before the next run starts.
+    """
+
+    def __init__(self, lines, close_view):
+        self.lines = lines
+        self.template = tempfile.mkdtemp(prefix="todotxt-bench-{0}-".format(lines))
+        write_files(self.template, lines)
+        self.directory = None
+        self.window = sublime.Window()
+        self.close_view = close_view
+
+    def fresh(self):
+        for view in self.window.views():
+            self.close_view(view)
+        self.window.close_views()
+        if self.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+        self.directory = tempfile.mkdtemp(prefix="todotxt-run-")
+        shutil.copytree(self.template, self.directory, dirs_exist_ok=True)
+        return self.directory
+
+    def view(self, name="todo.txt"):
+        path = os.path.join(self.fresh(), name)
+        with open(path, "r", encoding="utf-8") as f:
+            return sublime.View(f.read(), path, window=self.window)
+
+    def cleanup(self):
+        self.fresh()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(self.template, ignore_errors=True)
+
+
+def select_lines(view, count):
+    """Select the first count lines of view"""
+    end = view.text_point(min(count, view.rowcol(view.size())[0]), 0)
+    view.sel()[:] = [sublime.Region(0, max(end - 1, 0))]
+
+
+def note_point(view):
+    """Return a point inside the first note reference of view"""
+    return view.substr(sublime.Region(0, view.size())).index("note:") + 2
+
+
+class Scenarios(object):
+    """Each scenario takes a Workspace, sets up untimed state and returns the timed callable"""
+
+    def __init__(self, modules):
+        self.m = modules
+
+    def parse(self, workspace):
+        view = workspace.view()
+        get_index = self.m["todotxt_index"].get_index
+        return lambda: get_index(view).refresh()
+
+    def highlight_due_dates(self, workspace):
+        view = workspace.view()
+        highlighter = self.m["todotxt_due_dates"].TodoTxtDueDateHighlighter()
+        return lambda: (highlighter.highlight_due_dates(view), sublime.run_timeouts())
+
+    def highlight_notes(self, workspace):
+        view = workspace.view()
+        highlighter = self.m["todotxt_notes"].TodoTxtNoteHighlighter()
+        return lambda: (highlighter.highlight_notes(view), sublime.run_timeouts())
+
+    def autocomplete(self, workspace):
+        view = workspace.view()
+        task = "Call @"
+        view.run_command("todo_txt_insert_task", {"task": task, "position": 0})
+        autocomplete = self.m["todotxt_autocomplete"]
+        listener = autocomplete.TodoTxtAutocomplete()
+        # Completions only read the sibling tags refreshed on activation
+        listener.on_activated_async(view)
+        paths = autocomplete.sibling_paths(view)
+        wait_for(lambda: self.m["todotxt_tag_cache"].sibling_tags.tags(paths, "@"))
+        # The task is inserted as row 1, complete right after its sigil
+        location = view.text_point(1, len(task))
+        return lambda: listener.on_query_completions(view, "", [location])
+
+    def hover(self, workspace):
+        view = workspace.view()
+        navigator = self.m["todotxt_notes"].TodoTxtNoteNavigator()
+        point = note_point(view)
+
+        def run():
+            navigator.on_hover(view, point, sublime.HOVER_TEXT)
+            wait_for(lambda: "Loading preview" not in (view.popup or ""))
+
+        return run
+
+    def _text_command(self, name, args=None, selected=SELECTED_LINES):
+        def scenario(workspace):
+            view = workspace.view()
+            if selected:
+                select_lines(view, selected)
+            return lambda: view.run_command(name, args)
+
+        return scenario
+
+    def toggle_completion(self, workspace):
+        return self._text_command("todo_txt_toggle_task_completion")(workspace)
+
+    def increase_priority(self, workspace):
+        return self._text_command("todo_txt_increase_priority")(workspace)
+
+    def decrease_priority(self, workspace):
+        return self._text_command("todo_txt_decrease_priority")(workspace)
+
+    def remove_priority(self, workspace):
+        return self._text_command("todo_txt_remove_priority")(workspace)
+
+    def sort(self, workspace):
+        return self._text_command("todo_txt_sort", {"keys": ["status", "priority", "due"]}, 0)(workspace)
+
+    def insert_task(self, workspace):
+        view = workspace.view()
+        position = view.size() // 2
+        return lambda: view.run_command("todo_txt_insert_task", {"task": "(A) Benchmark @office", "position": position})
+
+    def add_new_task(self, workspace):
+        view = workspace.view()
+        view.sel()[:] = [sublime.Region(view.size() // 2)]
+
+        def run():
+            view.run_command("todo_txt_add_new_task")
+            view.window().input_panel("(A) Benchmark @office")
+
+        return run
+
+    def set_large_file_mode(self, workspace):
+        view = workspace.view()
+
+        def run():
+            view.run_command("todo_txt_set_large_file_mode", {"mode": "large"})
+            sublime.run_timeouts()
+
+        return run
+
+    def open_note(self, workspace):
+        view = workspace.view()
+        note_cache = self.m["todotxt_note_cache"].note_cache
+        # Creating a missing note re-reads its directory
+        note_cache.exists(os.path.join(workspace.directory, "notes", "benchmark.md"))
+        return lambda: view.run_command("todo_txt_open_note", {"file_path": "notes/benchmark.md"})
+
+    def refresh_notes(self, workspace):
+        view = workspace.view()
+        highlighter = self.m["todotxt_notes"].TodoTxtNoteHighlighter()
+        highlighter.highlight_notes(view)
+        sublime.run_timeouts()
+        return lambda: (view.run_command("todo_txt_refresh_notes"), sublime.run_timeouts())
+
+    def _move(self, name, selected, file_name="todo.txt"):
+        def scenario(workspace):
+            view = workspace.view(file_name)
+            if selected:
+                select_lines(view, selected)
+            key = self.m["todotxt_commands"].PENDING_MOVE_KEY
+
+            def run():
+                view.run_command(name, {"flush": True})
+                wait_for(lambda: not [k for k in view.region_keys() if k.startswith(key.format(""))])
+
+            return run
+
+        return scenario
+
+    def archive_completed(self, workspace):
+        return self._move("todo_txt_archive_completed", 0)(workspace)
+
+    def move_to_someday(self, workspace):
+        return self._move("todo_txt_move_to_someday", 100)(workspace)
+
+    def move_to_waiting(self, workspace):
+        return self._move("todo_txt_move_to_waiting", 100)(workspace)
+
+    def move_to_todo(self, workspace):
+        return self._move("todo_txt_move_to_todo", 100, "someday.txt")(workspace)
+
+    def search_cold(self, workspace):
+        directory = workspace.fresh()
+        search = self.m["todotxt_search"]
+        shutil.rmtree(os.path.join(sublime.cache_path(), "TodoTxt", search.SEARCH_DIR), ignore_errors=True)
+        return lambda: search.SearchIndex(directory).search("call mom")
+
+    def search_warm(self, workspace):
+        directory = workspace.fresh()
+        index = self.m["todotxt_search"].SearchIndex(directory)
+        index.search("warm")
+        return lambda: index.search("call mom")
+
+    def search_tasks(self, workspace):
+        view = workspace.view()
+        window = view.window()
+        window.quick_panel = None
+
+        def run():
+            view.run_command("todo_txt_search_tasks", {"query": "call mom"})
+            wait_for(lambda: window.quick_panel is not None)
+
+        return run
+
+    def filter(self, workspace):
+        view = workspace.view()
+        filtering = self.m["todotxt_filter"]
+        index = self.m["todotxt_index"].get_index(view)
+        index.refresh()
+        terms = filtering.parse_query("pri:A-C @office due<=+7d -done")
+        return lambda: filtering.filter_tasks(index, terms)
+
+    def filter_view(self, workspace):
+        view = workspace.view()
+        window = view.window()
+        self.m["todotxt_index"].get_index(view).refresh()
+
+        def run():
+            view.run_command("todo_txt_filter", {"query": "pri:A-C @office due<=+7d -done"})
+            sublime.run_timeouts()
+            # The untitled filter view is highlighted like any todo view
+            filter_view = window.views()[-1]
+            fire(self.m, "on_activated_async", filter_view)
+            fire(self.m, "on_selection_modified_async", filter_view)
+            text = filter_view.substr(sublime.Region(0, filter_view.size()))
+            fire(self.m, "on_hover", filter_view, text.find("note:") + 2, sublime.HOVER_TEXT)
+            # Stops the viewport poll started by the activation
+            fire(self.m, "on_deactivated_async", filter_view)
+            sublime.run_timeouts()
+
+        return run
+
+    def statistics(self, workspace):
+        view = workspace.view()
+        return lambda: (view.run_command("todo_txt_statistics"), sublime.run_timeouts())
+
+    def find_duplicates(self, workspace):
+        view = workspace.view()
+        return lambda: (view.run_command("todo_txt_find_duplicates"), sublime.run_timeouts())
+
+    def show_performance_stats(self, workspace):
+        view = workspace.view()
+        perf = self.m["todotxt_perf"].perf
+        perf.reset()
+        # One full sample window for each of a hundred operations
+        for operation in range(100):
+            for sample in range(self.m["todotxt_perf"].SAMPLE_SIZE):
+                perf.record("operation{0}".format(operation), sample / 1e6)
+        return lambda: view.run_command("todo_txt_show_performance_stats")
+
+    def names(self):
+        return [
+            name
+            for name in dir(self)
+            if not name.startswith("_") and name not in ("names", "m") and callable(getattr(self, name))
+        ]
+
+
+def run_benchmarks(sizes, only, repeat):
+    modules = load_plugin()
+    sublime.load_settings("TodoTxt.sublime-settings").update(
+        {
+            "move_save_delay": 0,
+            "highlight_delay": 0,
+            # Time the full features at every size
+            "large_file_lines": 0,
+            "large_file_size": 0,
+            "huge_file_lines": 0,
+            "huge_file_size": 0,
+        }
+    )
+    scenarios = Scenarios(modules)
+    names = [name for name in scenarios.names() if not only or any(word in name for word in only)]
+
+    def close_view(view):
+        for event in ("on_pre_close", "on_close"):
+            fire(modules, event, view)
+
+    for size in sizes:
+        workspace = Workspace(size, close_view)
+        try:
+            for name in names:
+                timings = []
+                for _ in range(repeat):
+                    timed = getattr(scenarios, name)(workspace)
+                    sublime.run_timeouts()
+                    # Like timeit, keep collections out of the timings
+                    gc.collect()
+                    gc.disable()
+                    try:
+                        start = time.perf_counter()
+                        timed()
+                        timings.append(time.perf_counter() - start)
+                    finally:
+                        gc.enable()
+                yield name, size, min(timings)
+        finally:
+            workspace.cleanup()
+
+
+def load_baselines():
+    try:
+        with open(BASELINES_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)["results"]
+    except (OSError, ValueError, KeyError):
+        return {}
+
+
+def save_baselines(results):
+    stored = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(BASELINES_FILE, "w", encoding="utf-8") as f:
+        json.dump(stored, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--only", nargs="+", help="run only scenarios whose name contains one of these words")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    args = parser.parse_args()
+
+    baselines = load_baselines()
+    results = {}
+    regressions = 0
+
+    print("{0:<22} {1:>9} {2:>11} {3:>14} {4:>10}".format("scenario", "lines", "ms", "lines/s", "baseline"))
+    for name, size, seconds in run_benchmarks(args.sizes, args.only, args.repeat):
+        results.setdefault(name, {})[str(size)] = seconds
+        baseline = baselines.get(name, {}).get(str(size))
+        comparison = ""
+        if baseline:
+            ratio = seconds / baseline
+            comparison = "{0:+.0%}".format(ratio - 1)
+            if ratio > 1 + args.tolerance and seconds - baseline > NOISE_FLOOR:
+                comparison += " REGRESSION"
+                regressions += 1
+        print(
+            "{0:<22} {1:>9} {2:>11.2f} {3:>14,.0f} {4:>10}".format(
+                name, size, seconds * 1000, size / seconds if seconds else 0, comparison
+            )
+        )
+
+    if args.save:
+        for name, sizes in results.items():
+            baselines.setdefault(name, {}).update(sizes)
+        save_baselines(baselines)
+        print("Baselines saved to {0}".format(os.path.relpath(BASELINES_FILE)))
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
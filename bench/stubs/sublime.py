@@ -0,0 +1,553 @@
+"""Minimal in-process stand-in for Sublime Text's sublime module
+
+Only what the plugin uses is implemented. Callbacks passed to set_timeout()
+and set_timeout_async() are queued and run by run_timeouts(), views keep
+their text in a plain string and notify attached TextChangeListeners of
+every edit.
+"""
+
+import os
+import re
+import tempfile
+import threading
+from bisect import bisect_right
+from itertools import accumulate
+
+DRAW_NO_FILL = 32
+DRAW_NO_OUTLINE = 256
+DRAW_SOLID_UNDERLINE = 512
+HIDDEN = 128
+HIDE_ON_MOUSE_MOVE_AWAY = 2
+HOVER_TEXT = 1
+INHIBIT_WORD_COMPLETIONS = 8
+INHIBIT_EXPLICIT_COMPLETIONS = 16
+INHIBIT_REORDER = 128
+ENCODED_POSITION = 1
+TRANSIENT = 4
+
+_timeouts = []
+_timeouts_lock = threading.Lock()
+_settings = {}
+_cache_path = tempfile.mkdtemp(prefix="todotxt-bench-")
+
+status_messages = []
+
+
+def set_timeout(callback, delay=0):
+    with _timeouts_lock:
+        _timeouts.append(callback)
+
+
+set_timeout_async = set_timeout
+
+
+def run_timeouts(limit=1000000):
+    """Run queued callbacks, including the ones they queue, return how many ran"""
+    ran = 0
+    while ran < limit:
+        with _timeouts_lock:
+            if not _timeouts:
+                break
+            callback = _timeouts.pop(0)
+        callback()
+        ran += 1
+    return ran
+
+
+def status_message(message):
+    status_messages.append(message)
+
+
+def cache_path():
+    return _cache_path
+
+
+def set_cache_path(path):
+    global _cache_path
+    os.makedirs(path, exist_ok=True)
+    _cache_path = path
+
+
+def load_settings(name):
+    return _settings.setdefault(name, Settings())
+
+
+def windows():
+    return list(Window.instances)
+
+
+def active_window():
+    return Window.instances[0] if Window.instances else Window()
+
+
+class Settings(dict):
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._on_change = {}
+
+    def get(self, key, default=None):
+        return dict.get(self, key, default)
+
+    def set(self, key, value):
+        self[key] = value
+        self._changed()
+
+    def erase(self, key):
+        self.pop(key, None)
+        self._changed()
+
+    def update(self, *args, **kwargs):
+        """Not part of the API, sets several values at once"""
+        dict.update(self, *args, **kwargs)
+        self._changed()
+
+    def add_on_change(self, tag, callback):
+        self._on_change[tag] = callback
+
+    def clear_on_change(self, tag):
+        self._on_change.pop(tag, None)
+
+    def _changed(self):
+        for callback in list(self._on_change.values()):
+            callback()
+
+
+class Region(object):
+    __slots__ = ("a", "b")
+
+    def __init__(self, a, b=None):
+        self.a = a
+        self.b = a if b is None else b
+
+    def begin(self):
+        return min(self.a, self.b)
+
+    def end(self):
+        return max(self.a, self.b)
+
+    def size(self):
+        return abs(self.b - self.a)
+
+    def empty(self):
+        return self.a == self.b
+
+    def contains(self, x):
+        if isinstance(x, Region):
+            return self.begin() <= x.begin() and x.end() <= self.end()
+        return self.begin() <= x <= self.end()
+
+    def intersects(self, other):
+        return self.begin() < other.end() and other.begin() < self.end()
+
+    def __len__(self):
+        return self.size()
+
+    def __eq__(self, other):
+        return isinstance(other, Region) and (self.a, self.b) == (other.a, other.b)
+
+    def __lt__(self, other):
+        return (self.begin(), self.end()) < (other.begin(), other.end())
+
+    def __hash__(self):
+        return hash((self.a, self.b))
+
+    def __repr__(self):
+        return "Region({0}, {1})".format(self.a, self.b)
+
+
+class Selection(list):
+    def add(self, region):
+        if not isinstance(region, Region):
+            region = Region(region)
+        self.append(region)
+        self.sort()
+
+
+class HistoricPosition(object):
+    def __init__(self, pt, row, col):
+        self.pt = pt
+        self.row = row
+        self.col = col
+
+
+class TextChange(object):
+    def __init__(self, a, b, text):
+        self.a = a
+        self.b = b
+        self.str = text
+
+
+class Buffer(object):
+    _next_id = 0
+
+    def __init__(self, view):
+        Buffer._next_id += 1
+        self._id = Buffer._next_id
+        self._view = view
+        self.listeners = []
+
+    def id(self):
+        return self._id
+
+    def primary_view(self):
+        return self._view
+
+    def file_name(self):
+        return self._view.file_name()
+
+
+class Window(object):
+    instances = []
+
+    def __init__(self):
+        self._views = []
+        self.opened_files = []
+        self.quick_panel = None
+        self.input_panel = None
+        Window.instances.append(self)
+
+    def views(self):
+        return list(self._views)
+
+    def active_view(self):
+        return self._views[0] if self._views else None
+
+    def new_file(self):
+        return View("", window=self)
+
+    def close_views(self):
+        for view in self._views:
+            view._valid = False
+        self._views = []
+
+    def open_file(self, path, flags=0):
+        self.opened_files.append(path)
+
+    def show_input_panel(self, caption, initial_text, on_done, on_change, on_cancel):
+        self.input_panel = on_done
+
+    def show_quick_panel(self, items, on_select, *args, **kwargs):
+        self.quick_panel = items
+
+    def run_command(self, name, args=None):
+        pass
+
+
+class _Lines(object):
+    """Text of a view kept as lines in blocks, so edits cost one block
+
+    Every line but the last ends with a newline, the last one may be empty.
+    """
+
+    BLOCK_LINES = 256
+
+    def __init__(self, text):
+        pieces = text.split("\n")
+        self._set_blocks([piece + "\n" for piece in pieces[:-1]] + [pieces[-1]])
+
+    def _set_blocks(self, lines):
+        size = self.BLOCK_LINES
+        self.blocks = [lines[i : i + size] for i in range(0, len(lines), size)] or [[""]]
+        self.sizes = [sum(map(len, block)) for block in self.blocks]
+        self.size = sum(self.sizes)
+        self._text = None
+        self._points = self._rows = None
+
+    def text(self):
+        if self._text is None:
+            self._text = "".join("".join(block) for block in self.blocks)
+        return self._text
+
+    def _offsets(self):
+        """Return the points and rows where each block starts"""
+        if self._points is None:
+            self._points = [0] + list(accumulate(self.sizes))[:-1]
+            self._rows = [0] + list(accumulate(map(len, self.blocks)))[:-1]
+        return self._points, self._rows
+
+    def _locate(self, point):
+        """Return (block index, line index in the block, row, point of the line)"""
+        point = max(0, min(point, self.size))
+        points, rows = self._offsets()
+        index = bisect_right(points, point) - 1
+        block = self.blocks[index]
+        line_points = [0] + list(accumulate(map(len, block)))
+        line_index = min(bisect_right(line_points, point - points[index]) - 1, len(block) - 1)
+        return index, line_index, rows[index] + line_index, points[index] + line_points[line_index]
+
+    def rowcol(self, point):
+        _, _, row, begin = self._locate(point)
+        return row, max(0, min(point, self.size)) - begin
+
+    def line(self, row):
+        _, rows = self._offsets()
+        index = bisect_right(rows, row) - 1
+        block = self.blocks[index]
+        return block[row - rows[index]] if row - rows[index] < len(block) else self.blocks[-1][-1]
+
+    def text_point(self, row, col):
+        points, rows = self._offsets()
+        index = bisect_right(rows, row) - 1
+        block = self.blocks[index]
+        if row - rows[index] >= len(block):
+            return self.size
+        return points[index] + sum(map(len, block[: row - rows[index]])) + col
+
+    def substr(self, a, b):
+        a, b = max(0, a), min(b, self.size)
+        if a >= b:
+            return ""
+        index, line_index, _, begin = self._locate(a)
+        parts = []
+        length = b - begin
+        while length > 0 and index < len(self.blocks):
+            block = self.blocks[index]
+            for line in block[line_index:]:
+                parts.append(line)
+                length -= len(line)
+                if length <= 0:
+                    break
+            index += 1
+            line_index = 0
+        return "".join(parts)[a - begin : b - begin]
+
+    def replace(self, a, b, text):
+        first, first_line, _, begin = self._locate(a)
+        last, last_line, _, _ = self._locate(b)
+        is_end = last == len(self.blocks) - 1 and last_line == len(self.blocks[last]) - 1
+
+        # Whole lines touched by the edit, rebuilt and split again
+        lines = [line for block in self.blocks[first : last + 1] for line in block]
+        touched = first_line
+        end = sum(len(block) for block in self.blocks[first:last]) + last_line + 1
+        old = "".join(lines[touched:end])
+        new = old[: a - begin] + text + old[b - begin :]
+        pieces = new.split("\n")
+        new_lines = [piece + "\n" for piece in pieces[:-1]]
+        if is_end:
+            new_lines.append(pieces[-1])
+
+        lines[touched:end] = new_lines
+        size = self.BLOCK_LINES
+        blocks = [lines[i : i + size] for i in range(0, len(lines), size)] or [[""]]
+        self.blocks[first : last + 1] = blocks
+        self.sizes[first : last + 1] = [sum(map(len, block)) for block in blocks]
+        self.size += len(text) - (b - a)
+        self._text = None
+        self._points = self._rows = None
+
+
+class View(object):
+    _next_id = 0
+
+    def __init__(self, text="", file_name=None, window=None):
+        View._next_id += 1
+        self._id = View._next_id
+        self._lines = _Lines(text)
+        self._file_name = file_name
+        self._window = window
+        self._buffer = Buffer(self)
+        self._selection = Selection([Region(0)])
+        self._settings = Settings({"syntax": "Packages/TodoTxt/TodoTxt.sublime-syntax"})
+        self._regions = {}
+        self._change_count = 0
+        self._visible = None
+        self._valid = True
+        self.popup = None
+        self.status = {}
+        self.name = ""
+        if window is not None:
+            window._views.append(self)
+
+    # Identity
+
+    def id(self):
+        return self._id
+
+    def buffer(self):
+        return self._buffer
+
+    def buffer_id(self):
+        return self._buffer.id()
+
+    def window(self):
+        return self._window
+
+    def file_name(self):
+        return self._file_name
+
+    def settings(self):
+        return self._settings
+
+    def is_valid(self):
+        return self._valid
+
+    def is_loading(self):
+        return False
+
+    def is_dirty(self):
+        return False
+
+    def clones(self):
+        return []
+
+    def element(self):
+        return None
+
+    def change_count(self):
+        return self._change_count
+
+    def match_selector(self, point, selector):
+        return selector.startswith("text.todo")
+
+    # Text
+
+    def size(self):
+        return self._lines.size
+
+    def substr(self, x):
+        if isinstance(x, Region):
+            return self._lines.substr(x.begin(), x.end())
+        return self._lines.substr(x, x + 1)
+
+    def rowcol(self, point):
+        return self._lines.rowcol(point)
+
+    def text_point(self, row, col):
+        return self._lines.text_point(row, col)
+
+    def line(self, x):
+        if isinstance(x, Region):
+            return Region(self.line(x.begin()).begin(), self.line(x.end()).end())
+        row, col = self._lines.rowcol(x)
+        begin = x - col
+        return Region(begin, begin + len(self._lines.line(row).rstrip("\n")))
+
+    def full_line(self, x):
+        if isinstance(x, Region):
+            return Region(self.line(x.begin()).begin(), self.full_line(x.end()).end())
+        row, col = self._lines.rowcol(x)
+        begin = x - col
+        return Region(begin, begin + len(self._lines.line(row)))
+
+    def lines(self, region):
+        first, col = self._lines.rowcol(region.begin())
+        last = self._lines.rowcol(region.end())[0]
+        regions = []
+        begin = region.begin() - col
+        for row in range(first, last + 1):
+            line = self._lines.line(row)
+            regions.append(Region(begin, begin + len(line.rstrip("\n"))))
+            begin += len(line)
+        return regions
+
+    def split_by_newlines(self, region):
+        return self.lines(region)
+
+    def find_all(self, pattern, flags=0):
+        return [Region(match.start(), match.end()) for match in re.finditer(pattern, self._lines.text(), re.M)]
+
+    def visible_region(self):
+        if self._visible is None:
+            return Region(0, min(self.size(), 6000))
+        return self._visible
+
+    def set_viewport(self, region):
+        self._visible = region
+
+    def sel(self):
+        return self._selection
+
+    # Editing
+
+    def _edit(self, a, b, text):
+        a_row, a_col = self.rowcol(a)
+        b_row, b_col = self.rowcol(b)
+        self._lines.replace(a, b, text)
+        self._change_count += 1
+
+        delta = len(text) - (b - a)
+
+        def shift(point):
+            if point >= b:
+                return point + delta
+            return min(point, a)
+
+        # Regions are sorted, only the ones reaching past a move
+        for regions, scope, flags in self._regions.values():
+            index = len(regions) - 1
+            while index >= 0 and regions[index].end() >= a:
+                region = regions[index]
+                regions[index] = Region(shift(region.a), shift(region.b))
+                index -= 1
+        self._selection[:] = [Region(shift(r.a), shift(r.b)) for r in self._selection]
+
+        change = TextChange(HistoricPosition(a, a_row, a_col), HistoricPosition(b, b_row, b_col), text)
+        for listener in list(self._buffer.listeners):
+            listener.on_text_changed([change])
+
+    def insert(self, edit, point, text):
+        self._edit(point, point, text)
+        return len(text)
+
+    def erase(self, edit, region):
+        self._edit(region.begin(), region.end(), "")
+
+    def replace(self, edit, region, text):
+        self._edit(region.begin(), region.end(), text)
+
+    def run_command(self, name, args=None):
+        import sublime_plugin
+
+        sublime_plugin.run_command(self, name, args or {})
+
+    # Regions, popups and status
+
+    def add_regions(self, key, regions, scope="", icon="", flags=0):
+        self._regions[key] = (sorted(regions), scope, flags)
+
+    def get_regions(self, key):
+        return list(self._regions.get(key, ((),))[0])
+
+    def erase_regions(self, key):
+        self._regions.pop(key, None)
+
+    def region_keys(self):
+        """Not part of the API, lists the keys of the regions added to the view"""
+        return list(self._regions)
+
+    def show_popup(self, content, flags=0, location=-1, max_width=320, max_height=240, on_navigate=None, on_hide=None):
+        self.popup = content
+
+    def update_popup(self, content):
+        self.popup = content
+
+    def is_popup_visible(self):
+        return self.popup is not None
+
+    def hide_popup(self):
+        self.popup = None
+
+    def set_status(self, key, value):
+        self.status[key] = value
+
+    def erase_status(self, key):
+        self.status.pop(key, None)
+
+    def set_scratch(self, scratch):
+        pass
+
+    def set_name(self, name):
+        self.name = name
+
+    def set_read_only(self, read_only):
+        pass
+
+    def assign_syntax(self, syntax):
+        pass
+
+    def show(self, x, *args, **kwargs):
+        pass
+
+    def show_at_center(self, x):
+        pass
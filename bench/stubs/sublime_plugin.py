@@ -0,0 +1,84 @@
+"""Minimal in-process stand-in for Sublime Text's sublime_plugin module"""
+
+import re
+
+commands = {}
+
+
+def command_name(cls):
+    """TodoTxtSortCommand -> todo_txt_sort, like Sublime derives it"""
+    name = cls.__name__
+    if name.endswith("Command"):
+        name = name[: -len("Command")]
+    return re.sub(r"(?<!^)([A-Z])", r"_\1", name).lower()
+
+
+class _CommandMeta(type):
+    def __init__(cls, name, bases, namespace):
+        super().__init__(name, bases, namespace)
+        commands[command_name(cls)] = cls
+
+
+class TextCommand(metaclass=_CommandMeta):
+    def __init__(self, view):
+        self.view = view
+
+    def is_enabled(self, *args, **kwargs):
+        return True
+
+
+class WindowCommand(metaclass=_CommandMeta):
+    def __init__(self, window):
+        self.window = window
+
+    def is_enabled(self, *args, **kwargs):
+        return True
+
+
+class ApplicationCommand(metaclass=_CommandMeta):
+    def is_enabled(self, *args, **kwargs):
+        return True
+
+
+class EventListener(object):
+    pass
+
+
+class ViewEventListener(object):
+    def __init__(self, view):
+        self.view = view
+
+
+class TextChangeListener(object):
+    def __init__(self):
+        self.buffer = None
+
+    def attach(self, buffer):
+        self.buffer = buffer
+        buffer.listeners.append(self)
+
+    def detach(self):
+        self.buffer.listeners.remove(self)
+        self.buffer = None
+
+    def is_attached(self):
+        return self.buffer is not None
+
+
+class TextInputHandler(object):
+    pass
+
+
+class ListInputHandler(object):
+    pass
+
+
+def run_command(view, name, args):
+    """Run a text command on view with a dummy edit token"""
+    if name == "append":
+        # Built into Sublime Text
+        view.insert(object(), view.size(), args["characters"])
+        return
+    cls = commands.get(name)
+    if cls is not None and issubclass(cls, TextCommand):
+        cls(view).run(object(), **args)
@@ -0,0 +1,201 @@
+import gzip
+import json
+import os
+import shutil
+import threading
+
+from .todotxt_tasks import format_date, parse_task, today_ordinal
+from .todotxt_writer import writer
+
+ARCHIVE_DIR = "done"
+MANIFEST_FILE = "manifest.json"
+
+
+class ArchiveManifest(object):
+    """Per-partition task counts and completion date ranges of a monthly archive
+
+    Partitions are keyed by month ("2026-10") and record their file name,
+    task count, first and last completion date and whether they are
+    compressed, so lookups can skip partitions outside a date range without
+    opening them.
+
+    outstanding counts the archives planned against this manifest and not
+    finished yet; partitions are not compressed while any is, as their
+    appends may still target the uncompressed files.
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.path = os.path.join(archive_dir, MANIFEST_FILE)
+        self.partitions = {}
+        self.outstanding = 0
+        self.lock = threading.RLock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.partitions = json.load(f).get("partitions", {})
+        except (OSError, ValueError):
+            self.partitions = {}
+        return self
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"partitions": self.partitions}, indent=2, sort_keys=True)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(self.path + ".tmp", self.path)
+
+    def partition_path(self, month):
+        """Return the file of a partition, creating its manifest entry if needed"""
+        entry = self.partitions.get(month)
+        if entry is None:
+            entry = self.partitions[month] = {
+                "file": "{0}.txt".format(month),
+                "count": 0,
+                "first": None,
+                "last": None,
+                "compressed": False,
+            }
+        return os.path.join(self.archive_dir, entry["file"])
+
+    def record(self, month, count, first, last):
+        entry = self.partitions[month]
+        entry["count"] += count
+        entry["first"] = min(filter(None, (entry["first"], first)))
+        entry["last"] = max(filter(None, (entry["last"], last)))
+
+    def partitions_between(self, first=None, last=None):
+        """Return the paths of partitions holding tasks completed in [first, last]
+
+        Dates are YYYY-MM-DD strings, None leaves that side of the range open.
+        Partitions whose first archive is not recorded yet are always listed.
+        """
+        paths = []
+        for month in sorted(self.partitions):
+            entry = self.partitions[month]
+            if first is not None and entry["last"] is not None and entry["last"] < first:
+                continue
+            if last is not None and entry["first"] is not None and entry["first"] > last:
+                continue
+            paths.append(os.path.join(self.archive_dir, entry["file"]))
+        return paths
+
+    def compress_closed(self, current_month):
+        """Gzip every uncompressed partition older than current_month
+
+        Runs on the writer thread, so no append to a partition can happen
+        while it is compressed. A partition is only swapped for its gzipped
+        copy if no archive was planned meanwhile, as such an archive may
+        target the uncompressed file; a later run compresses it.
+        """
+        with self.lock:
+            if self.outstanding:
+                return
+            months = [
+                (month, entry["file"])
+                for month, entry in sorted(self.partitions.items())
+                if month < current_month and not entry["compressed"]
+            ]
+
+        for month, name in months:
+            path = os.path.join(self.archive_dir, name)
+            exists = os.path.exists(path)
+            if exists:
+                with open(path, "rb") as source, gzip.open(path + ".gz.tmp", "wb") as target:
+                    shutil.copyfileobj(source, target)
+
+            with self.lock:
+                if self.outstanding:
+                    if exists:
+                        os.remove(path + ".gz.tmp")
+                    break
+                if exists:
+                    os.replace(path + ".gz.tmp", path + ".gz")
+                    os.remove(path)
+                entry = self.partitions[month]
+                entry["file"] = name + ".gz"
+                entry["compressed"] = True
+        self.save()
+
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+
+def get_manifest(archive_dir):
+    """Return the shared manifest of an archive, loaded on first use
+
+    Every archive of a directory plans and records through this one
+    instance, so consecutive archives never save stale copies over each
+    other.
+    """
+    with _manifests_lock:
+        manifest = _manifests.get(archive_dir)
+        if manifest is None:
+            manifest = _manifests[archive_dir] = ArchiveManifest(archive_dir).load()
+        return manifest
+
+
+class MonthlyArchive(object):
+    """Completed tasks partitioned by completion month under ARCHIVE_DIR
+
+    plan() assigns task lines to partition files without writing anything,
+    so the caller can journal and perform the appends; finish() then
+    records them in the manifest. Recording, saving and compressing happen
+    on the writer thread, in order with the appends.
+    """
+
+    def __init__(self, todo_dir):
+        self.archive_dir = os.path.join(todo_dir, ARCHIVE_DIR)
+        self.manifest = get_manifest(self.archive_dir)
+        self.today = format_date(today_ordinal())
+        self._planned = None
+
+    def plan(self, lines):
+        """Return a list of (partition_path, lines) for completed task lines
+
+        Tasks without a completion date go to the current month. Every plan
+        must be followed by a call to finish().
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        months = {}
+        for line in lines:
+            task = parse_task(line)
+            completed = self.today
+            if task is not None and task.completion_date is not None:
+                completed = format_date(task.completion_date)
+            months.setdefault(completed[:7], []).append((completed, line))
+
+        appends = []
+        self._planned = []
+        with self.manifest.lock:
+            self.manifest.outstanding += 1
+            for month, entries in sorted(months.items()):
+                dates = [completed for completed, _ in entries]
+                self._planned.append((month, len(entries), min(dates), max(dates)))
+                appends.append((self.manifest.partition_path(month), [line for _, line in entries]))
+
+        # New partitions are listed before their first append lands
+        writer.call(self.manifest.save)
+        return appends
+
+    def finish(self, moved, compress=False):
+        """Record the planned appends if moved, then compress closed months once idle"""
+        planned = self._planned
+        self._planned = None
+        if planned is None:
+            return
+
+        def record():
+            with self.manifest.lock:
+                if moved:
+                    for month, count, first, last in planned:
+                        self.manifest.record(month, count, first, last)
+                self.manifest.outstanding -= 1
+            self.manifest.save()
+            if compress:
+                writer.when_idle(lambda: self.manifest.compress_closed(self.today[:7]))
+
+        writer.call(record)
@@ -1,8 +1,46 @@
+import os
+
 import sublime
 import sublime_plugin
 
+from .todotxt_commands import DONE_FILE, SOMEDAY_FILE, TODO_FILE, WAITING_FILE
+from .todotxt_index import get_index
+from .todotxt_large_files import HUGE, NORMAL, file_tier
+from .todotxt_perf import instrument
+from .todotxt_settings import get_setting
+from .todotxt_tag_cache import sibling_tags
+
+SIBLING_FILES = (TODO_FILE, DONE_FILE, SOMEDAY_FILE, WAITING_FILE)
+
+
+def sibling_paths(view):
+    """Return the other todo files in the view's directory"""
+    file_name = view.file_name()
+    if not file_name or not get_setting("complete_from_sibling_files", True):
+        return []
+
+    directory = os.path.dirname(file_name)
+    current = os.path.normcase(os.path.abspath(file_name))
+    paths = [os.path.join(directory, name) for name in SIBLING_FILES]
+    return [path for path in paths if os.path.normcase(os.path.abspath(path)) != current]
+
 
+@instrument
 class TodoTxtAutocomplete(sublime_plugin.EventListener):
+    def on_activated_async(self, view):
+        # Completions only read the sibling tag cache, which is refreshed here
+        if view.match_selector(0, "text.todo") and file_tier(view) == NORMAL:
+            sibling_tags.refresh(sibling_paths(view))
+
+    def on_load_async(self, view):
+        if view.match_selector(0, "text.todo") and file_tier(view) == NORMAL:
+            sibling_tags.refresh(sibling_paths(view))
+
+    def on_post_save_async(self, view):
+        # The saved file is a sibling of the other todo files of its directory
+        if view.file_name() and view.match_selector(0, "text.todo"):
+            sibling_tags.invalidate(view.file_name())
+
     def on_query_completions(self, view, prefix, locations):
         # Only trigger for todo.txt files
         if not view.match_selector(locations[0], "text.todo"):
@@ -13,20 +51,40 @@ class TodoTxtAutocomplete(sublime_plugin.EventListener):
         pref = view.substr(pref)
 
         if pref == "@":
-            regex = r"\s@\S+"  # Todo item context
+            sigil = "@"  # Todo item context
         elif pref == "+":
-            regex = r"\s\+\S+"  # Todo item project
+            sigil = "+"  # Todo item project
         else:
             return None
 
-        # Find all matches in the current view
-        matches = view.find_all(regex)
-        matches = {view.substr(x).lstrip() for x in matches}
+        # Huge files get no completions, large ones only their own tags
+        tier = file_tier(view)
+        if tier == HUGE:
+            return None
+
+        # Tags of the current view, most frequent first
+        index = get_index(view)
+        with index.lock:
+            index.refresh()
+            tags = index.tags[sigil]
+            autocompletes = tags.completions()
+            local = tags.counts
 
-        # Create autocomplete list
-        autocompletes = [[x, x] for x in sorted(matches)]
+            # Then tags only found in the other todo files
+            other = sibling_tags.tags(sibling_paths(view), sigil) if tier == NORMAL else None
+            if other:
+                other_tags = sorted(
+                    (tag for tag in other if tag not in local),
+                    key=lambda tag: (-other[tag], tag.lower()),
+                )
+                autocompletes = autocompletes + [
+                    ["{0}{1}\t{2} elsewhere".format(sigil, tag, other[tag]), sigil + tag]
+                    for tag in other_tags
+                ]
 
         return (
             autocompletes,
-            sublime.INHIBIT_WORD_COMPLETIONS | sublime.INHIBIT_EXPLICIT_COMPLETIONS,
+            sublime.INHIBIT_WORD_COMPLETIONS
+            | sublime.INHIBIT_EXPLICIT_COMPLETIONS
+            | getattr(sublime, "INHIBIT_REORDER", 0),
         )
@@ -5,63 +5,144 @@ from datetime import datetime
 import sublime
 import sublime_plugin
 
+from .todotxt_archive import ARCHIVE_DIR, MonthlyArchive
+from .todotxt_edits import apply_line_order, transform_selected_lines
+from .todotxt_journal import journal
+from .todotxt_perf import instrument
+from .todotxt_scheduler import scheduler
+from .todotxt_settings import get_setting
+from .todotxt_tasks import parse_task
+
+TODO_FILE = "todo.txt"
 DONE_FILE = "done.txt"
 WAITING_FILE = "waiting.txt"
 SOMEDAY_FILE = "someday.txt"
 
+SORT_KEYS = ("status", "priority", "due", "creation", "context", "project")
 
-def needs_newline(file_path):
-    """Check if a file needs a newline before appending content"""
-    if not os.path.exists(file_path) or os.path.getsize(file_path) == 0:
-        return False
+# Regions of lines waiting to be removed once their move is on disk
+PENDING_MOVE_KEY = "todotxt_pending_move_{0}"
 
-    with open(file_path, "rb") as f:
-        # Seek to the last byte
-        f.seek(-1, os.SEEK_END)
-        last_char = f.read(1)
-        # Check if last character is not a newline
-        return last_char not in (b"\n", b"\r")
+DEFAULT_MOVE_SAVE_DELAY = 1000
 
 
+# Moves whose lines are still in a buffer, entry id -> (buffer id, on_finished)
+_pending_moves = {}
+
+
+def start_move(view, source, appends, lines, regions, message, on_finished=None, flush=False):
+    """Queue a journaled move and remove regions from view once it is written
+
+    lines are the (row, text) of the moved lines in view, regions their
+    text, without the last newline of each region
+    so that text typed on the next line is not tracked with them. The lines stay in
+    the view, tracked as hidden regions, until the background writer
+    reports the appends on disk; todo_txt_finish_move then erases them and
+    saves, which commits the move. If every view of the
+    buffer closed meanwhile, the lines are removed from the saved file
+    instead. on_finished(moved) is called once the move is complete or
+    undone, flush skips the deferred save.
+    """
+    entry_id = journal.begin(source, appends, lines)
+    key = PENDING_MOVE_KEY.format(entry_id)
+    views = [view] + view.clones()
+    for clone in views:
+        clone.add_regions(key, regions, "", "", sublime.HIDDEN)
+    _pending_moves[entry_id] = (view.buffer_id(), on_finished)
+
+    def on_done(error):
+        target = next((clone for clone in views if clone.is_valid()), None)
+        if target is None:
+            sublime.set_timeout_async(lambda: _finish_closed_move(entry_id, error), 0)
+            return
+        target.run_command(
+            "todo_txt_finish_move",
+            {
+                "entry_id": entry_id,
+                "error": str(error) if error else None,
+                "message": message,
+                "flush": flush,
+            },
+        )
+
+    journal.write(entry_id, on_done)
+
+
+def pending_move_rows(view):
+    """Return the rows of view whose lines are still being moved"""
+    rows = set()
+    for entry_id, (buffer_id, _) in list(_pending_moves.items()):
+        if buffer_id != view.buffer_id():
+            continue
+        for region in view.get_regions(PENDING_MOVE_KEY.format(entry_id)):
+            rows.update(range(view.rowcol(region.begin())[0], view.rowcol(region.end())[0] + 1))
+    return rows
+
+
+def _move_finished(entry_id, moved):
+    _, on_finished = _pending_moves.pop(entry_id, (None, None))
+    if on_finished is not None:
+        on_finished(moved)
+
+
+def _finish_closed_move(entry_id, error):
+    """Complete a move whose source view closed before its appends were written"""
+    if error is None:
+        try:
+            journal.finish_on_disk(entry_id)
+        except OSError as e:
+            # Left to the recovery on the next load
+            print("TodoTxt: Unable to finish move {0} - {1}".format(entry_id, str(e)))
+    _move_finished(entry_id, error is None)
+
+
+def save_after_move(view, flush=False):
+    """Save view once moves have been quiet for move_save_delay ms
+
+    The save commits the journaled moves; until then a crash is recovered
+    from the journal, so consecutive moves can share one save.
+    """
+    delay = get_setting("move_save_delay", DEFAULT_MOVE_SAVE_DELAY)
+    if flush or not delay:
+        scheduler.cancel(view, "save")
+        view.run_command("save")
+        return
+
+    def save():
+        # Nothing to do if the view was saved by hand meanwhile
+        if view.is_valid() and view.is_dirty():
+            view.run_command("save")
+
+    scheduler.schedule(view, "save", lambda view: sublime.set_timeout(save, 0), delay)
+
+
+@instrument
 class TodoTxtToggleTaskCompletionCommand(sublime_plugin.TextCommand):
     """Toggle task completion: mark complete or uncomplete"""
 
     def run(self, edit):
-        view = self.view
-
         # Get current date
         today = datetime.now().strftime("%Y-%m-%d")
+        completion_prefix = "x {0} ".format(today)
 
-        # Process each selection/cursor (in reverse to handle insertions correctly)
-        for region in reversed(view.sel()):
-            # If it's a single cursor (empty selection), process the line at cursor
-            if region.empty():
-                lines_to_process = [view.line(region)]
-            else:
-                # For selections, process all lines that intersect with the selection
-                lines_to_process = view.lines(region)
-
-            # Process each line (in reverse to handle insertions correctly)
-            for line in reversed(lines_to_process):
-                line_text = view.substr(line)
-                stripped = line_text.lstrip()
-
-                # If already completed, uncomplete it
-                if stripped.startswith("x "):
-                    # Remove "x YYYY-MM-DD " from the beginning
-                    # Match "x " followed by optional date and space
-                    uncompleted = re.sub(r"^(\s*)x\s+(?:\d{4}-\d{2}-\d{2}\s+)?", r"\1", line_text)
-                    view.replace(edit, line, uncompleted)
-                else:
-                    # Add completion marker at the beginning of the line
-                    completion_prefix = "x {0} ".format(today)
-                    view.insert(edit, line.begin(), completion_prefix)
+        def toggle(line_text):
+            # If already completed, uncomplete it
+            if line_text.lstrip().startswith("x "):
+                # Remove "x YYYY-MM-DD " from the beginning
+                # Match "x " followed by optional date and space
+                return re.sub(r"^(\s*)x\s+(?:\d{4}-\d{2}-\d{2}\s+)?", r"\1", line_text)
+
+            # Add completion marker at the beginning of the line
+            return completion_prefix + line_text
+
+        transform_selected_lines(self.view, edit, toggle)
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
+@instrument
 class TodoTxtAddNewTaskCommand(sublime_plugin.TextCommand):
     """Add a new task via input panel"""
 
@@ -107,6 +188,7 @@ class TodoTxtAddNewTaskCommand(sublime_plugin.TextCommand):
         return self.view.match_selector(0, "text.todo")
 
 
+@instrument
 class TodoTxtInsertTaskCommand(sublime_plugin.TextCommand):
     """Helper command to insert a task (needed for async callback)"""
 
@@ -134,86 +216,123 @@ class TodoTxtInsertTaskCommand(sublime_plugin.TextCommand):
         view.show(new_line)
 
 
-class TodoTxtSortByContextCommand(sublime_plugin.TextCommand):
-    """Sort tasks by context (@word)"""
+@instrument
+class TodoTxtSortCommand(sublime_plugin.TextCommand):
+    """Sort tasks by one or more keys in a single pass
 
-    def run(self, edit):
+    keys is a list such as ["status", "priority", "due:desc"], each being one
+    of SORT_KEYS optionally followed by ":asc" (default) or ":desc". Tasks
+    without a priority, due date or creation date always sort last.
+    """
+
+    def run(self, edit, keys=None):
         view = self.view
 
+        if not keys:
+            window = view.window()
+            if window:
+                window.show_input_panel(
+                    "Sort by (e.g. status priority due:desc):",
+                    "status priority due",
+                    lambda text: text.split() and view.run_command("todo_txt_sort", {"keys": text.split()}),
+                    None,
+                    None,
+                )
+            return
+
+        try:
+            spec = self._parse_keys(keys)
+        except ValueError as e:
+            sublime.status_message("TodoTxt: {0}".format(str(e)))
+            return
+
         # Get all lines in the file
         region = sublime.Region(0, view.size())
         content = view.substr(region)
         lines = content.split("\n")
 
-        # Sort lines by context
-        sorted_lines = self._sort_by_context(lines)
-
-        # Replace the entire content
-        view.replace(edit, region, "\n".join(sorted_lines))
-
-    def _sort_by_context(self, lines):
-        """Sort lines by their context, preserving empty lines"""
-        # Separate empty lines from task lines
+        # Sort lines by the requested keys, then move only the lines that changed place
+        order = self._sort(lines, spec)
+        apply_line_order(view, edit, lines, order)
+
+    def _parse_keys(self, keys):
+        """Turn ["due:desc", ...] into [("due", True), ...]"""
+        spec = []
+        for key in keys:
+            name, _, order = key.lower().partition(":")
+            if name not in SORT_KEYS:
+                raise ValueError("Unknown sort key '{0}'".format(name))
+            if order not in ("", "asc", "desc"):
+                raise ValueError("Unknown sort order '{0}'".format(order))
+            spec.append((name, order == "desc"))
+        return spec
+
+    def _sort(self, lines, spec):
+        """Return the indices of non-empty lines ordered by a key tuple computed once per task"""
         tasks = []
         for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped:
-                context = self._extract_context(stripped)
-                tasks.append((context, i, line))
-
-        # Sort by context (case-insensitive), then by original order
-        tasks.sort(key=lambda x: (x[0].lower(), x[1]))
-
-        # Return sorted lines
-        return [task[2] for task in tasks]
+            task = parse_task(line)
+            if task is not None:
+                tasks.append((i, task))
+
+        # Tags are compared case-insensitively through their rank among all values
+        ranks = {}
+        for name, _ in spec:
+            if name in ("context", "project") and name not in ranks:
+                values = set()
+                for _, task in tasks:
+                    tags = task.contexts if name == "context" else task.projects
+                    values.add(tags[0].lower() if tags else "")
+                ranks[name] = {value: rank for rank, value in enumerate(sorted(values))}
+
+        decorated = []
+        for i, task in tasks:
+            key = []
+            for name, descending in spec:
+                if name == "status":
+                    missing, value = False, 1 if task.completed else 0
+                elif name == "priority":
+                    missing = task.priority is None
+                    value = 0 if missing else ord(task.priority)
+                elif name == "due":
+                    missing, value = task.due is None, task.due or 0
+                elif name == "creation":
+                    missing, value = task.creation_date is None, task.creation_date or 0
+                else:
+                    tags = task.contexts if name == "context" else task.projects
+                    missing, value = False, ranks[name][tags[0].lower() if tags else ""]
+                key.append(missing)
+                key.append(-value if descending else value)
+            # Original position keeps the sort stable
+            key.append(i)
+            decorated.append(tuple(key))
 
-    def _extract_context(self, line):
-        """Extract the first context (@word) from a line, or empty string if none"""
-        match = re.search(r"\s@(\S+)", line)
-        return match.group(1) if match else ""
+        decorated.sort()
+        return [key[-1] for key in decorated]
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
-class TodoTxtSortByProjectCommand(sublime_plugin.TextCommand):
-    """Sort tasks by project (+word)"""
+# The single-key commands of earlier versions, kept for existing key bindings.
+# todo_txt_sort records their timings.
+class TodoTxtSortByContextCommand(sublime_plugin.TextCommand):
+    """Sort tasks by context (@word), same as todo_txt_sort with keys ["context"]"""
 
     def run(self, edit):
-        view = self.view
-
-        # Get all lines in the file
-        region = sublime.Region(0, view.size())
-        content = view.substr(region)
-        lines = content.split("\n")
-
-        # Sort lines by project
-        sorted_lines = self._sort_by_project(lines)
+        self.view.run_command("todo_txt_sort", {"keys": ["context"]})
 
-        # Replace the entire content
-        view.replace(edit, region, "\n".join(sorted_lines))
-
-    def _sort_by_project(self, lines):
-        """Sort lines by their project, preserving empty lines"""
-        # Separate empty lines from task lines
-        tasks = []
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped:
-                project = self._extract_project(stripped)
-                tasks.append((project, i, line))
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
 
-        # Sort by project (case-insensitive), then by original order
-        tasks.sort(key=lambda x: (x[0].lower(), x[1]))
 
-        # Return sorted lines
-        return [task[2] for task in tasks]
+class TodoTxtSortByProjectCommand(sublime_plugin.TextCommand):
+    """Sort tasks by project (+word), same as todo_txt_sort with keys ["project"]"""
 
-    def _extract_project(self, line):
-        """Extract the first project (+word) from a line, or empty string if none"""
-        match = re.search(r"\s\+(\S+)", line)
-        return match.group(1) if match else ""
+    def run(self, edit):
+        self.view.run_command("todo_txt_sort", {"keys": ["project"]})
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
@@ -221,51 +340,10 @@ class TodoTxtSortByProjectCommand(sublime_plugin.TextCommand):
 
 
 class TodoTxtSortByDueDateCommand(sublime_plugin.TextCommand):
-    """Sort tasks by due date (due:YYYY-MM-DD)"""
+    """Sort tasks by due date (due:YYYY-MM-DD), same as todo_txt_sort with keys ["due"]"""
 
     def run(self, edit):
-        view = self.view
-
-        # Get all lines in the file
-        region = sublime.Region(0, view.size())
-        content = view.substr(region)
-        lines = content.split("\n")
-
-        # Sort lines by due date
-        sorted_lines = self._sort_by_due_date(lines)
-
-        # Replace the entire content
-        view.replace(edit, region, "\n".join(sorted_lines))
-
-    def _sort_by_due_date(self, lines):
-        """Sort lines by their due date"""
-        # Separate empty lines from task lines
-        tasks = []
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped:
-                due_date = self._extract_due_date(stripped)
-                tasks.append((due_date, i, line))
-
-        # Sort by due date (None/invalid dates last), then by original order
-        # Use a tuple where None becomes a far future date for sorting
-        tasks.sort(key=lambda x: (x[0] if x[0] is not None else "9999-99-99", x[1]))
-
-        # Return sorted lines
-        return [task[2] for task in tasks]
-
-    def _extract_due_date(self, line):
-        """Extract the due date (due:YYYY-MM-DD) from a line, or None if none"""
-        match = re.search(r"\bdue:(\d{4}-\d{2}-\d{2})\b", line)
-        if match:
-            date_str = match.group(1)
-            # Validate the date format
-            try:
-                datetime.strptime(date_str, "%Y-%m-%d")
-                return date_str
-            except ValueError:
-                return None
-        return None
+        self.view.run_command("todo_txt_sort", {"keys": ["due"]})
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
@@ -273,47 +351,10 @@ class TodoTxtSortByDueDateCommand(sublime_plugin.TextCommand):
 
 
 class TodoTxtSortByPriorityCommand(sublime_plugin.TextCommand):
-    """Sort tasks by priority (A) through (Z)"""
+    """Sort tasks by priority (A) through (Z), same as todo_txt_sort with keys ["priority"]"""
 
     def run(self, edit):
-        view = self.view
-
-        # Get all lines in the file
-        region = sublime.Region(0, view.size())
-        content = view.substr(region)
-        lines = content.split("\n")
-
-        # Sort lines by priority
-        sorted_lines = self._sort_by_priority(lines)
-
-        # Replace the entire content
-        view.replace(edit, region, "\n".join(sorted_lines))
-
-    def _sort_by_priority(self, lines):
-        """Sort lines by their priority"""
-        # Separate empty lines from task lines
-        tasks = []
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped:
-                priority = self._extract_priority(stripped)
-                tasks.append((priority, i, line))
-
-        # Sort by priority (None/no priority last), then by original order
-        # Priority A comes before B, etc. Tasks without priority go to the end
-        tasks.sort(key=lambda x: (x[0] if x[0] is not None else "ZZZ", x[1]))
-
-        # Return sorted lines
-        return [task[2] for task in tasks]
-
-    def _extract_priority(self, line):
-        """Extract the priority (A) through (Z) from a line, or None if none"""
-        # Priority format in todo.txt: (A) at the beginning of the line
-        # Can be after completion marker: x 2025-10-29 (A) task
-        match = re.match(r"^(?:x\s+\d{4}-\d{2}-\d{2}\s+)?\(([A-Z])\)\s+", line)
-        if match:
-            return match.group(1)
-        return None
+        self.view.run_command("todo_txt_sort", {"keys": ["priority"]})
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
@@ -321,76 +362,10 @@ class TodoTxtSortByPriorityCommand(sublime_plugin.TextCommand):
 
 
 class TodoTxtSortByCreationDateCommand(sublime_plugin.TextCommand):
-    """Sort tasks by creation date (YYYY-MM-DD at start of task)"""
+    """Sort tasks by creation date (YYYY-MM-DD at start of task), same as todo_txt_sort with keys ["creation"]"""
 
     def run(self, edit):
-        view = self.view
-
-        # Get all lines in the file
-        region = sublime.Region(0, view.size())
-        content = view.substr(region)
-        lines = content.split("\n")
-
-        # Sort lines by creation date
-        sorted_lines = self._sort_by_creation_date(lines)
-
-        # Replace the entire content
-        view.replace(edit, region, "\n".join(sorted_lines))
-
-    def _sort_by_creation_date(self, lines):
-        """Sort lines by their creation date"""
-        # Separate empty lines from task lines
-        tasks = []
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped:
-                creation_date = self._extract_creation_date(stripped)
-                tasks.append((creation_date, i, line))
-
-        # Sort by creation date (None/invalid dates last), then by original order
-        # Use a tuple where None becomes a far future date for sorting
-        tasks.sort(key=lambda x: (x[0] if x[0] is not None else "9999-99-99", x[1]))
-
-        # Return sorted lines
-        return [task[2] for task in tasks]
-
-    def _extract_creation_date(self, line):
-        """Extract the creation date from a line, or None if none"""
-        # Creation date formats in todo.txt:
-        # - (A) 2025-10-29 task (with priority)
-        # - 2025-10-29 task (without priority)
-        # - x 2025-10-29 2025-10-15 task (completed, completion date then creation date)
-
-        # Check for completed task: x YYYY-MM-DD YYYY-MM-DD
-        match = re.match(r"^x\s+\d{4}-\d{2}-\d{2}\s+(\d{4}-\d{2}-\d{2})\s+", line)
-        if match:
-            date_str = match.group(1)
-            if self._validate_date(date_str):
-                return date_str
-
-        # Check for task with priority: (A) YYYY-MM-DD
-        match = re.match(r"^\([A-Z]\)\s+(\d{4}-\d{2}-\d{2})\s+", line)
-        if match:
-            date_str = match.group(1)
-            if self._validate_date(date_str):
-                return date_str
-
-        # Check for task without priority: YYYY-MM-DD at start
-        match = re.match(r"^(\d{4}-\d{2}-\d{2})\s+", line)
-        if match:
-            date_str = match.group(1)
-            if self._validate_date(date_str):
-                return date_str
-
-        return None
-
-    def _validate_date(self, date_str):
-        """Validate a date string"""
-        try:
-            datetime.strptime(date_str, "%Y-%m-%d")
-            return True
-        except ValueError:
-            return False
+        self.view.run_command("todo_txt_sort", {"keys": ["creation"]})
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
@@ -398,52 +373,21 @@ class TodoTxtSortByCreationDateCommand(sublime_plugin.TextCommand):
 
 
 class TodoTxtSortByStatusCommand(sublime_plugin.TextCommand):
-    """Sort tasks by status (incomplete first, completed last)"""
+    """Sort tasks by status (incomplete first, completed last), same as todo_txt_sort with keys ["status"]"""
 
     def run(self, edit):
-        view = self.view
-
-        # Get all lines in the file
-        region = sublime.Region(0, view.size())
-        content = view.substr(region)
-        lines = content.split("\n")
-
-        # Sort lines by status
-        sorted_lines = self._sort_by_status(lines)
-
-        # Replace the entire content
-        view.replace(edit, region, "\n".join(sorted_lines))
-
-    def _sort_by_status(self, lines):
-        """Sort lines by their completion status"""
-        # Separate empty lines from task lines
-        tasks = []
-        for i, line in enumerate(lines):
-            stripped = line.strip()
-            if stripped:
-                is_completed = self._is_completed(stripped)
-                # Use 0 for incomplete, 1 for completed to sort incomplete first
-                tasks.append((1 if is_completed else 0, i, line))
-
-        # Sort by status (incomplete=0 first, completed=1 last), then by original order
-        tasks.sort(key=lambda x: (x[0], x[1]))
-
-        # Return sorted lines
-        return [task[2] for task in tasks]
-
-    def _is_completed(self, line):
-        """Check if a task is completed (starts with 'x ')"""
-        return line.startswith("x ")
+        self.view.run_command("todo_txt_sort", {"keys": ["status"]})
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
+@instrument
 class TodoTxtArchiveCompletedCommand(sublime_plugin.TextCommand):
-    """Archive completed tasks to DONE_FILE"""
+    """Archive completed tasks to DONE_FILE, or to monthly partitions under ARCHIVE_DIR"""
 
-    def run(self, edit):
+    def run(self, edit, flush=False):
         view = self.view
 
         # Get the todo.txt file path
@@ -452,209 +396,204 @@ class TodoTxtArchiveCompletedCommand(sublime_plugin.TextCommand):
             sublime.status_message("TodoTxt: Please save the file first")
             return
 
-        # Get the DONE_FILE path (same directory as todo.txt)
-        todo_dir = os.path.dirname(todo_file)
-        done_file = os.path.join(todo_dir, DONE_FILE)
-
         # Get all lines in the file
         region = sublime.Region(0, view.size())
         content = view.substr(region)
         lines = content.split("\n")
 
-        # Separate completed and incomplete tasks
+        # Separate completed and incomplete tasks, leaving alone those already being moved
         completed_tasks = []
-        incomplete_tasks = []
+        archived_rows = set()
+        pending_rows = pending_move_rows(view)
 
-        for line in lines:
-            stripped = line.strip()
-            if stripped:
-                if stripped.startswith("x "):
-                    completed_tasks.append(line)
-                else:
-                    incomplete_tasks.append(line)
+        for row, line in enumerate(lines):
+            task = parse_task(line)
+            if task is not None and task.completed and row not in pending_rows:
+                completed_tasks.append(line)
+                archived_rows.add(row)
 
         # If no completed tasks, show message and return
         if not completed_tasks:
             sublime.status_message("TodoTxt: No completed tasks to archive")
             return
 
-        # Append completed tasks to DONE_FILE
-        try:
-            with open(done_file, "a", encoding="utf-8") as f:
-                if needs_newline(done_file):
-                    f.write("\n")
-                for task in completed_tasks:
-                    f.write(task + "\n")
-        except Exception as e:
-            sublime.status_message("TodoTxt: Error writing to {0} - {1}".format(DONE_FILE, str(e)))
-            return
+        # Get the archive targets (same directory as todo.txt)
+        todo_dir = os.path.dirname(todo_file)
+        archive = None
+        if get_setting("archive_mode", "single") == "monthly":
+            # Monthly mode partitions the archive by completion month
+            target = ARCHIVE_DIR + "/"
+            archive = MonthlyArchive(todo_dir)
+        else:
+            target = DONE_FILE
+
+        # Text of the lines leaving the file, contiguous rows merged into one region
+        regions = []
+        offset = 0
+        for row, line in enumerate(lines):
+            if row in archived_rows:
+                if row - 1 in archived_rows:
+                    regions[-1] = sublime.Region(regions[-1].begin(), offset + len(line))
+                else:
+                    regions.append(sublime.Region(offset, offset + len(line)))
+            offset += len(line) + 1
 
-        # Replace the current file content with only incomplete tasks
-        view.replace(edit, region, "\n".join(incomplete_tasks))
+        # Record the partitions in the manifest once the tasks are moved
+        on_finished = None
+        if archive is not None:
+            compress = get_setting("archive_compress", False)
 
-        # Show success message
+            def on_finished(moved):
+                archive.finish(moved, compress)
+
+        # Append completed tasks to the archive through the move journal
         task_count = len(completed_tasks)
         task_word = "task" if task_count == 1 else "tasks"
-        sublime.status_message(
-            "TodoTxt: Archived {0} {1} to {2}".format(task_count, task_word, DONE_FILE)
-        )
+        try:
+            if archive is not None:
+                appends = archive.plan(completed_tasks)
+            else:
+                appends = [(os.path.join(todo_dir, DONE_FILE), completed_tasks)]
+            start_move(
+                view,
+                todo_file,
+                appends,
+                [(row, lines[row]) for row in sorted(archived_rows)],
+                regions,
+                "Archived {0} {1} to {2}".format(task_count, task_word, target),
+                on_finished,
+                flush,
+            )
+        except Exception as e:
+            if archive is not None:
+                archive.finish(False)
+            sublime.status_message("TodoTxt: Error writing to {0} - {1}".format(target, str(e)))
+            return
+
+        sublime.status_message("TodoTxt: Archiving {0} {1} to {2}...".format(task_count, task_word, target))
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
+@instrument
 class TodoTxtRemovePriorityCommand(sublime_plugin.TextCommand):
     """Remove priorities from selected tasks or task at cursor"""
 
     def run(self, edit):
-        view = self.view
-
-        # Process each selection/cursor (in reverse to handle deletions correctly)
-        for region in reversed(view.sel()):
-            # If it's a single cursor (empty selection), process the line at cursor
-            if region.empty():
-                lines_to_process = [view.line(region)]
-            else:
-                # For selections, process all lines that intersect with the selection
-                lines_to_process = view.lines(region)
-
-            # Process each line (in reverse to handle deletions correctly)
-            for line in reversed(lines_to_process):
-                line_text = view.substr(line)
-
-                # Remove priority if it exists
-                # Priority format: (A) at the beginning or after completion marker
-                # Patterns: "(A) task" or "x 2025-10-29 (A) task"
-                new_text = re.sub(r"^((?:x\s+\d{4}-\d{2}-\d{2}\s+)?)\([A-Z]\)\s+", r"\1", line_text)
+        def remove_priority(line_text):
+            # Priority format: (A) at the beginning or after completion marker
+            # Patterns: "(A) task" or "x 2025-10-29 (A) task"
+            return re.sub(r"^((?:x\s+\d{4}-\d{2}-\d{2}\s+)?)\([A-Z]\)\s+", r"\1", line_text)
 
-                # Only replace if something changed
-                if new_text != line_text:
-                    view.replace(edit, line, new_text)
+        transform_selected_lines(self.view, edit, remove_priority)
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
+@instrument
 class TodoTxtIncreasePriorityCommand(sublime_plugin.TextCommand):
     """Increase priority of selected tasks (A becomes higher priority, add A if none)"""
 
     def run(self, edit):
-        view = self.view
+        transform_selected_lines(self.view, edit, self._increase_priority)
 
-        # Process each selection/cursor (in reverse to handle replacements correctly)
-        for region in reversed(view.sel()):
-            # If it's a single cursor (empty selection), process the line at cursor
-            if region.empty():
-                lines_to_process = [view.line(region)]
-            else:
-                # For selections, process all lines that intersect with the selection
-                lines_to_process = view.lines(region)
-
-            # Process each line (in reverse to handle replacements correctly)
-            for line in reversed(lines_to_process):
-                line_text = view.substr(line)
-
-                # Check if task has a priority
-                # Pattern: (A) at the beginning or after completion marker
-                match = re.match(r"^((?:x\s+\d{4}-\d{2}-\d{2}\s+)?)\(([A-Z])\)\s+(.*)$", line_text)
-
-                if match:
-                    # Task has priority, increase it (A is highest, Z is lowest)
-                    prefix = match.group(1)
-                    current_priority = match.group(2)
-                    rest = match.group(3)
-
-                    if current_priority > "A":
-                        # Increase priority (B -> A, C -> B, etc.)
-                        new_priority = chr(ord(current_priority) - 1)
-                        new_text = "{0}({1}) {2}".format(prefix, new_priority, rest)
-                        view.replace(edit, line, new_text)
-                else:
-                    # No priority, add (A) priority
-                    # Check if it's a completed task or has creation date
-                    completion_match = re.match(r"^(x\s+\d{4}-\d{2}-\d{2}\s+)", line_text)
-                    if completion_match:
-                        # Completed task: x 2025-10-29 (A) task
-                        prefix = completion_match.group(1)
-                        rest = line_text[len(prefix) :]
-                        new_text = "{0}(A) {1}".format(prefix, rest)
-                    else:
-                        # Regular task or task with creation date
-                        new_text = "(A) {0}".format(line_text)
-
-                    view.replace(edit, line, new_text)
+    def _increase_priority(self, line_text):
+        # Check if task has a priority
+        # Pattern: (A) at the beginning or after completion marker
+        match = re.match(r"^((?:x\s+\d{4}-\d{2}-\d{2}\s+)?)\(([A-Z])\)\s+(.*)$", line_text)
+
+        if match:
+            # Task has priority, increase it (A is highest, Z is lowest)
+            prefix = match.group(1)
+            current_priority = match.group(2)
+            rest = match.group(3)
+
+            if current_priority > "A":
+                # Increase priority (B -> A, C -> B, etc.)
+                new_priority = chr(ord(current_priority) - 1)
+                return "{0}({1}) {2}".format(prefix, new_priority, rest)
+            return line_text
+
+        # No priority, add (A) priority
+        # Check if it's a completed task or has creation date
+        completion_match = re.match(r"^(x\s+\d{4}-\d{2}-\d{2}\s+)", line_text)
+        if completion_match:
+            # Completed task: x 2025-10-29 (A) task
+            prefix = completion_match.group(1)
+            rest = line_text[len(prefix) :]
+            return "{0}(A) {1}".format(prefix, rest)
+
+        # Regular task or task with creation date
+        return "(A) {0}".format(line_text)
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
+@instrument
 class TodoTxtDecreasePriorityCommand(sublime_plugin.TextCommand):
     """Decrease priority of selected tasks (A becomes B, Z removes priority)"""
 
     def run(self, edit):
-        view = self.view
-
-        # Process each selection/cursor (in reverse to handle replacements correctly)
-        for region in reversed(view.sel()):
-            # If it's a single cursor (empty selection), process the line at cursor
-            if region.empty():
-                lines_to_process = [view.line(region)]
-            else:
-                # For selections, process all lines that intersect with the selection
-                lines_to_process = view.lines(region)
+        transform_selected_lines(self.view, edit, self._decrease_priority)
 
-            # Process each line (in reverse to handle replacements correctly)
-            for line in reversed(lines_to_process):
-                line_text = view.substr(line)
+    def _decrease_priority(self, line_text):
+        # Check if task has a priority
+        # Pattern: (A) at the beginning or after completion marker
+        match = re.match(r"^((?:x\s+\d{4}-\d{2}-\d{2}\s+)?)\(([A-Z])\)\s+(.*)$", line_text)
 
-                # Check if task has a priority
-                # Pattern: (A) at the beginning or after completion marker
-                match = re.match(r"^((?:x\s+\d{4}-\d{2}-\d{2}\s+)?)\(([A-Z])\)\s+(.*)$", line_text)
+        # If no priority, do nothing
+        if not match:
+            return line_text
 
-                if match:
-                    # Task has priority, decrease it (A -> B, B -> C, etc.)
-                    prefix = match.group(1)
-                    current_priority = match.group(2)
-                    rest = match.group(3)
+        # Task has priority, decrease it (A -> B, B -> C, etc.)
+        prefix = match.group(1)
+        current_priority = match.group(2)
+        rest = match.group(3)
 
-                    if current_priority < "Z":
-                        # Decrease priority (A -> B, B -> C, etc.)
-                        new_priority = chr(ord(current_priority) + 1)
-                        new_text = "{0}({1}) {2}".format(prefix, new_priority, rest)
-                    else:
-                        # Priority is Z, remove it
-                        new_text = "{0}{1}".format(prefix, rest)
+        if current_priority < "Z":
+            # Decrease priority (A -> B, B -> C, etc.)
+            new_priority = chr(ord(current_priority) + 1)
+            return "{0}({1}) {2}".format(prefix, new_priority, rest)
 
-                    view.replace(edit, line, new_text)
-                # If no priority, do nothing
+        # Priority is Z, remove it
+        return "{0}{1}".format(prefix, rest)
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
-class TodoTxtMoveToSomedayCommand(sublime_plugin.TextCommand):
-    """Move selected tasks to SOMEDAY_FILE"""
+@instrument
+class TodoTxtMoveCommand(sublime_plugin.TextCommand):
+    """Move selected tasks to another todo file in the same directory"""
 
-    def run(self, edit):
+    TARGET_FILE = None
+
+    def run(self, edit, target=None, flush=False):
         view = self.view
+        target = target or self.TARGET_FILE
+        if not target:
+            return
 
-        # Get the todo.txt file path
-        todo_file = view.file_name()
-        if not todo_file:
+        # Get the current file path
+        current_file = view.file_name()
+        if not current_file:
             sublime.status_message("TodoTxt: Please save the file first")
             return
 
-        # Get the SOMEDAY_FILE path (same directory as todo.txt)
-        todo_dir = os.path.dirname(todo_file)
-        someday_file = os.path.join(todo_dir, SOMEDAY_FILE)
+        # Get the target path (same directory as current file)
+        target_file = os.path.join(os.path.dirname(current_file), target)
 
-        # Collect all lines that are selected
+        # Collect all lines that are selected once, except those already being moved
         selected_lines = []
         all_regions = []
+        skipped_rows = pending_move_rows(view)
 
         for region in view.sel():
             # If it's a single cursor (empty selection), process the line at cursor
@@ -665,187 +604,105 @@ class TodoTxtMoveToSomedayCommand(sublime_plugin.TextCommand):
                 lines = view.lines(region)
 
             for line in lines:
+                row = view.rowcol(line.begin())[0]
+                if row in skipped_rows:
+                    continue
+                skipped_rows.add(row)
                 line_text = view.substr(line).strip()
                 if line_text:  # Only add non-empty lines
                     selected_lines.append(line_text)
-                    all_regions.append(line)
+                    all_regions.append((row, line))
 
         # If no tasks selected, show message and return
         if not selected_lines:
             sublime.status_message("TodoTxt: No tasks selected to move")
             return
 
-        # Append selected tasks to SOMEDAY_FILE
+        # Append selected tasks to the target file through the move journal
+        task_count = len(selected_lines)
+        task_word = "task" if task_count == 1 else "tasks"
+        all_regions.sort()
         try:
-            with open(someday_file, "a", encoding="utf-8") as f:
-                if needs_newline(someday_file):
-                    f.write("\n")
-                for task in selected_lines:
-                    f.write(task + "\n")
-        except Exception as e:
-            sublime.status_message(
-                "TodoTxt: Error writing to {0} - {1}".format(SOMEDAY_FILE, str(e))
+            start_move(
+                view,
+                current_file,
+                [(target_file, selected_lines)],
+                [(row, view.substr(line)) for row, line in all_regions],
+                [line for _, line in all_regions],
+                "Moved {0} {1} to {2}".format(task_count, task_word, target),
+                flush=flush,
             )
+        except Exception as e:
+            sublime.status_message("TodoTxt: Error writing to {0} - {1}".format(target, str(e)))
             return
 
-        # Remove selected lines from the current file (in reverse order)
-        for line in reversed(all_regions):
-            # Get the full line region including the newline
-            full_line = view.full_line(line)
-            view.erase(edit, full_line)
-
-        # Save the current file
-        view.run_command("save")
-
-        # Show success message
-        task_count = len(selected_lines)
-        task_word = "task" if task_count == 1 else "tasks"
-        sublime.status_message(
-            "TodoTxt: Moved {0} {1} to {2}".format(task_count, task_word, SOMEDAY_FILE)
-        )
+        sublime.status_message("TodoTxt: Moving {0} {1} to {2}...".format(task_count, task_word, target))
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
-class TodoTxtMoveToWaitingCommand(sublime_plugin.TextCommand):
-    """Move selected tasks to WAITING_FILE"""
+@instrument
+class TodoTxtFinishMoveCommand(sublime_plugin.TextCommand):
+    """Remove the lines of a move once the writer has appended them, then save"""
 
-    def run(self, edit):
+    def run(self, edit, entry_id, error=None, message=None, flush=False):
         view = self.view
-
-        # Get the todo.txt file path
-        todo_file = view.file_name()
-        if not todo_file:
-            sublime.status_message("TodoTxt: Please save the file first")
+        key = PENDING_MOVE_KEY.format(entry_id)
+        regions = view.get_regions(key)
+        for clone in [view] + view.clones():
+            clone.erase_regions(key)
+
+        if error:
+            _move_finished(entry_id, False)
+            sublime.status_message("TodoTxt: Error writing tasks - {0}".format(error))
             return
 
-        # Get the WAITING_FILE path (same directory as todo.txt)
-        todo_dir = os.path.dirname(todo_file)
-        waiting_file = os.path.join(todo_dir, WAITING_FILE)
-
-        # Collect all lines that are selected
-        selected_lines = []
-        all_regions = []
-
-        for region in view.sel():
-            # If it's a single cursor (empty selection), process the line at cursor
-            if region.empty():
-                lines = [view.line(region)]
-            else:
-                # For selections, process all lines that intersect with the selection
-                lines = view.lines(region)
-
-            for line in lines:
-                line_text = view.substr(line).strip()
-                if line_text:  # Only add non-empty lines
-                    selected_lines.append(line_text)
-                    all_regions.append(line)
-
-        # If no tasks selected, show message and return
-        if not selected_lines:
-            sublime.status_message("TodoTxt: No tasks selected to move")
+        # Lines edited while they were written are kept, and the move undone
+        texts = [line.strip() for region in regions for line in view.substr(region).split("\n") if line.strip()]
+        if sorted(texts) != sorted(journal.lines(entry_id)):
+            journal.abort(entry_id)
+            _move_finished(entry_id, False)
+            sublime.status_message("TodoTxt: Tasks changed while being moved, move undone")
             return
 
-        # Append selected tasks to WAITING_FILE
-        try:
-            with open(waiting_file, "a", encoding="utf-8") as f:
-                if needs_newline(waiting_file):
-                    f.write("\n")
-                for task in selected_lines:
-                    f.write(task + "\n")
-        except Exception as e:
-            sublime.status_message(
-                "TodoTxt: Error writing to {0} - {1}".format(WAITING_FILE, str(e))
-            )
-            return
+        for region in reversed(regions):
+            view.erase(edit, sublime.Region(region.begin(), min(region.end() + 1, view.size())))
+        journal.mark_removed(entry_id)
+        _move_finished(entry_id, True)
 
-        # Remove selected lines from the current file (in reverse order)
-        for line in reversed(all_regions):
-            # Get the full line region including the newline
-            full_line = view.full_line(line)
-            view.erase(edit, full_line)
+        # Saving the current file commits the move
+        save_after_move(view, flush)
+        if message:
+            sublime.status_message("TodoTxt: " + message)
 
-        # Save the current file
-        view.run_command("save")
 
-        # Show success message
-        task_count = len(selected_lines)
-        task_word = "task" if task_count == 1 else "tasks"
-        sublime.status_message(
-            "TodoTxt: Moved {0} {1} to {2}".format(task_count, task_word, WAITING_FILE)
-        )
+@instrument
+class TodoTxtSaveMovesCommand(sublime_plugin.TextCommand):
+    """Save now instead of waiting for the deferred save after moves"""
+
+    def run(self, edit):
+        save_after_move(self.view, flush=True)
 
     def is_enabled(self):
         """Only enable in todo.txt files"""
         return self.view.match_selector(0, "text.todo")
 
 
-class TodoTxtMoveToTodoCommand(sublime_plugin.TextCommand):
-    """Move selected tasks to todo.txt"""
-
-    def run(self, edit):
-        view = self.view
-
-        # Get the current file path
-        current_file = view.file_name()
-        if not current_file:
-            sublime.status_message("TodoTxt: Please save the file first")
-            return
-
-        # Get the todo.txt path (same directory as current file)
-        current_dir = os.path.dirname(current_file)
-        todo_file = os.path.join(current_dir, "todo.txt")
-
-        # Collect all lines that are selected
-        selected_lines = []
-        all_regions = []
-
-        for region in view.sel():
-            # If it's a single cursor (empty selection), process the line at cursor
-            if region.empty():
-                lines = [view.line(region)]
-            else:
-                # For selections, process all lines that intersect with the selection
-                lines = view.lines(region)
+class TodoTxtMoveToSomedayCommand(TodoTxtMoveCommand):
+    """Move selected tasks to SOMEDAY_FILE"""
 
-            for line in lines:
-                line_text = view.substr(line).strip()
-                if line_text:  # Only add non-empty lines
-                    selected_lines.append(line_text)
-                    all_regions.append(line)
+    TARGET_FILE = SOMEDAY_FILE
 
-        # If no tasks selected, show message and return
-        if not selected_lines:
-            sublime.status_message("TodoTxt: No tasks selected to move")
-            return
 
-        # Append selected tasks to todo.txt
-        try:
-            with open(todo_file, "a", encoding="utf-8") as f:
-                if needs_newline(todo_file):
-                    f.write("\n")
-                for task in selected_lines:
-                    f.write(task + "\n")
-        except Exception as e:
-            sublime.status_message("TodoTxt: Error writing to todo.txt - {0}".format(str(e)))
-            return
+class TodoTxtMoveToWaitingCommand(TodoTxtMoveCommand):
+    """Move selected tasks to WAITING_FILE"""
 
-        # Remove selected lines from the current file (in reverse order)
-        for line in reversed(all_regions):
-            # Get the full line region including the newline
-            full_line = view.full_line(line)
-            view.erase(edit, full_line)
+    TARGET_FILE = WAITING_FILE
 
-        # Save the current file
-        view.run_command("save")
 
-        # Show success message
-        task_count = len(selected_lines)
-        task_word = "task" if task_count == 1 else "tasks"
-        sublime.status_message("TodoTxt: Moved {0} {1} to todo.txt".format(task_count, task_word))
+class TodoTxtMoveToTodoCommand(TodoTxtMoveCommand):
+    """Move selected tasks to TODO_FILE (from someday.txt, waiting.txt, etc.)"""
 
-    def is_enabled(self):
-        """Enable in todo.txt files (someday.txt, waiting.txt, etc.)"""
-        return self.view.match_selector(0, "text.todo")
+    TARGET_FILE = TODO_FILE
@@ -1,72 +1,191 @@
-import re
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import sublime
 import sublime_plugin
 
+from .todotxt_highlight import paint, visible_rows_changed
+from .todotxt_large_files import HUGE, LARGE, file_tier
+from .todotxt_perf import instrument, timed
+from .todotxt_scheduler import scheduler
+from .todotxt_tasks import today_ordinal
 
+# View id -> (today, change_count) of the last highlight pass
+_painted = {}
+
+# View id -> due date ordinals of the painted future regions, in buffer order
+_future_days = {}
+
+# Bumped on every load and unload, so timer chains of an earlier load stop
+_generation = 0
+
+
+def _milliseconds_to_midnight():
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    # A second late, so that today_ordinal() has rolled over when the timer fires
+    return int((midnight - now).total_seconds() * 1000) + 1000
+
+
+def _schedule_midnight(generation):
+    sublime.set_timeout_async(lambda: _on_midnight(generation), _milliseconds_to_midnight())
+
+
+def _on_midnight(generation):
+    if generation != _generation:
+        return
+    today = today_ordinal()
+    highlighter = TodoTxtDueDateHighlighter()
+    for window in sublime.windows():
+        for view in window.views():
+            if view.id() in _painted and view.match_selector(0, "text.todo"):
+                highlighter.rollover_due_dates(view, today)
+    _schedule_midnight(generation)
+
+
+def plugin_loaded():
+    global _generation
+    _generation += 1
+    _schedule_midnight(_generation)
+
+
+def plugin_unloaded():
+    global _generation
+    _generation += 1
+
+
+@instrument
 class TodoTxtDueDateHighlighter(sublime_plugin.EventListener):
     """Highlight due dates based on whether they're past, present, or future"""
 
     def on_modified_async(self, view):
         if view.match_selector(0, "text.todo"):
-            self.highlight_due_dates(view)
+            scheduler.schedule(view, "due_dates", self.highlight_due_dates)
 
     def on_load_async(self, view):
         if view.match_selector(0, "text.todo"):
-            self.highlight_due_dates(view)
+            scheduler.schedule(view, "due_dates", self.highlight_due_dates, delay=0)
 
     def on_activated_async(self, view):
         if view.match_selector(0, "text.todo"):
-            self.highlight_due_dates(view)
-
+            scheduler.schedule(view, "due_dates", self.highlight_due_dates, delay=0)
+
+    def on_selection_modified_async(self, view):
+        # Large files are only highlighted around the visible region
+        if (
+            view.match_selector(0, "text.todo")
+            and file_tier(view) == LARGE
+            and visible_rows_changed(view, "due_dates")
+        ):
+            scheduler.schedule(view, "due_dates", self.highlight_due_dates)
+
+    def on_close(self, view):
+        _painted.pop(view.id(), None)
+        _future_days.pop(view.id(), None)
+
+    @timed()
     def highlight_due_dates(self, view):
-        # Clear existing regions
-        view.erase_regions("due_date_past")
-        view.erase_regions("due_date_today")
-        view.erase_regions("due_date_future")
+        tier = file_tier(view)
+        if tier == HUGE:
+            _painted.pop(view.id(), None)
+            self.draw_due_dates(view, {})
+            return
+
+        today = today_ordinal()
+        _painted[view.id()] = (today, view.change_count())
+
+        def collect_due_dates(index, start, stop):
+            return self.collect_due_dates(index, start, stop, today)
+
+        paint(view, "due_dates", collect_due_dates, self.draw_due_dates, visible_only=tier == LARGE)
+
+    @timed()
+    def rollover_due_dates(self, view, today):
+        """Reclassify the due dates that changed class since the last pass
+
+        Only regions painted as future and now due today or earlier move,
+        while everything painted as today becomes past. The due date of
+        every future region is kept from the last pass, so neither the
+        buffer nor its index is scanned again.
+        """
+        painted_today, change_count = _painted.get(view.id(), (None, None))
+        if painted_today is None or painted_today >= today:
+            return
+
+        future = view.get_regions("due_date_future")
+        days = _future_days.get(view.id(), [])
+        if view.change_count() != change_count or len(days) != len(future):
+            # Edited since the last pass, which a full pass is pending for
+            scheduler.schedule(view, "due_dates", self.highlight_due_dates, delay=0)
+            return
+
+        past = view.get_regions("due_date_past") + view.get_regions("due_date_today")
+        due_today = []
+        still_future = []
+        future_days = []
+        for region, day in zip(future, days):
+            if day < today:
+                past.append(region)
+            elif day == today:
+                due_today.append(region)
+            else:
+                still_future.append(region)
+                future_days.append(day)
+        past.sort(key=lambda region: region.begin())
+
+        _painted[view.id()] = (today, change_count)
+        self.draw_due_dates(
+            view,
+            {
+                "due_date_past": past,
+                "due_date_today": due_today,
+                "due_date_future": still_future,
+                "due_date_future_days": future_days,
+            },
+        )
 
-        # Get today's date
-        today = datetime.now().date()
+    def collect_due_dates(self, index, start, stop, today=None):
+        """Classify the due dates found in rows [start, stop)
 
-        # Find all due:YYYY-MM-DD patterns
-        due_pattern = r"\bdue:(\d{4}-\d{2}-\d{2})\b"
-        regions = view.find_all(due_pattern)
+        due_date_future_days holds the due date of each future region, for
+        rollover_due_dates().
+        """
+        if today is None:
+            today = today_ordinal()
 
         past_regions = []
         today_regions = []
         future_regions = []
+        future_days = []
+
+        for region, task in index.due_regions(start, stop):
+            if task.due < today:
+                past_regions.append(region)
+            elif task.due == today:
+                today_regions.append(region)
+            else:
+                future_regions.append(region)
+                future_days.append(task.due)
+
+        return {
+            "due_date_past": past_regions,
+            "due_date_today": today_regions,
+            "due_date_future": future_regions,
+            "due_date_future_days": future_days,
+        }
+
+    def draw_due_dates(self, view, regions):
+        _future_days[view.id()] = regions.get("due_date_future_days", [])
 
-        for region in regions:
-            # Check if the task is completed (line starts with "x ")
-            line = view.line(region)
-            line_text = view.substr(line).lstrip()
-            if line_text.startswith("x "):
-                # Skip completed tasks
-                continue
-
-            text = view.substr(region)
-            match = re.match(due_pattern, text)
-            if match:
-                date_str = match.group(1)
-                try:
-                    due_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-
-                    if due_date < today:
-                        past_regions.append(region)
-                    elif due_date == today:
-                        today_regions.append(region)
-                    else:
-                        future_regions.append(region)
-                except ValueError:
-                    # Invalid date format, skip
-                    pass
+        # Clear existing regions
+        view.erase_regions("due_date_past")
+        view.erase_regions("due_date_today")
+        view.erase_regions("due_date_future")
 
         # Apply color regions
         # Past dates - red (error scope)
         view.add_regions(
             "due_date_past",
-            past_regions,
+            regions.get("due_date_past", []),
             scope="region.redish",
             flags=sublime.DRAW_NO_FILL,
         )
@@ -74,7 +193,7 @@ class TodoTxtDueDateHighlighter(sublime_plugin.EventListener):
         # Today - yellow/orange (warning scope)
         view.add_regions(
             "due_date_today",
-            today_regions,
+            regions.get("due_date_today", []),
             scope="region.orangish",
             flags=sublime.DRAW_NO_FILL,
         )
@@ -82,7 +201,7 @@ class TodoTxtDueDateHighlighter(sublime_plugin.EventListener):
         # Future dates - green (success scope)
         view.add_regions(
             "due_date_future",
-            future_regions,
+            regions.get("due_date_future", []),
             scope="region.greenish",
             flags=sublime.DRAW_NO_FILL,
         )
@@ -0,0 +1,240 @@
+import os
+import threading
+
+import sublime
+import sublime_plugin
+
+from .todotxt_commands import DONE_FILE, SOMEDAY_FILE, TODO_FILE, WAITING_FILE
+from .todotxt_incremental import IncrementalReader, PerDirectory
+from .todotxt_index import get_index
+from .todotxt_large_files import HUGE, file_tier
+from .todotxt_perf import instrument, timed
+from .todotxt_settings import get_setting
+from .todotxt_tasks import parse_task
+
+DUPLICATE_FILES = (TODO_FILE, SOMEDAY_FILE, WAITING_FILE, DONE_FILE)
+
+DUPLICATES_KEY = "todotxt_duplicates"
+
+
+def task_key(task):
+    """Hash of a task with its completion marker, dates and priority stripped
+
+    Whitespace and case are ignored. Completed tasks keep their completion
+    date, so a task done on two different days is not a duplicate. Neither
+    is an open task of its completed copy in done.txt, on purpose: tasks
+    that recur are added again once the previous one is done.
+    """
+    body = " ".join(task.text[task.body_start :].split()).lower()
+    if task.completed:
+        return hash((task.completion_date, body))
+    return hash(body)
+
+
+class FileHashes(object):
+    """Task keys of one todo file on disk, key -> line numbers
+
+    The file is read by an IncrementalReader, so an append_only file
+    (done.txt) only has its appended lines hashed. The last line, when it
+    has no newline, is hashed apart on every update as it may still grow.
+    """
+
+    __slots__ = ("path", "reader", "lines", "rows", "partial_key")
+
+    def __init__(self, path, append_only=False):
+        self.path = path
+        self.reader = IncrementalReader(path, append_only)
+        self.partial_key = None
+        self._reset()
+
+    def _reset(self):
+        self.lines = 0
+        self.rows = {}
+
+    def update(self):
+        """Bring the keys up to date with the file, return True if anything changed"""
+        changed = self.reader.update(self._add_lines, self._reset)
+        task = parse_task(self.reader.partial)
+        partial_key = task_key(task) if task is not None else None
+        changed = changed or partial_key != self.partial_key
+        self.partial_key = partial_key
+        return changed
+
+    def line_numbers(self, key):
+        """Return the line numbers of the tasks of the file with key"""
+        line_numbers = self.rows.get(key, [])
+        if key == self.partial_key:
+            return line_numbers + [self.lines + 1]
+        return line_numbers
+
+    def _add_lines(self, data, offset):
+        text = data.decode("utf-8", "replace")
+        if not text:
+            return
+        lines = text.split("\n")
+        if text.endswith("\n"):
+            lines.pop()
+
+        rows = self.rows
+        for line_number, line in enumerate(lines, self.lines + 1):
+            task = parse_task(line.rstrip("\r"))
+            if task is not None:
+                rows.setdefault(task_key(task), []).append(line_number)
+        self.lines += len(lines)
+
+
+class DuplicateIndex(object):
+    """Task keys of the todo files of one directory
+
+    Files on disk are hashed incrementally by FileHashes. The file being
+    edited is hashed from its view instead, reusing the key of every line
+    whose text did not change since the previous run, so a check costs a
+    dictionary lookup per line plus the parsing of what changed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = [
+            FileHashes(os.path.join(directory, name), append_only=name == DONE_FILE) for name in DUPLICATE_FILES
+        ]
+        # Buffer id -> line text -> key, as of the last check of the buffer
+        self._view_keys = {}
+        self._lock = threading.Lock()
+
+    def find(self, view):
+        """Return [(row, region, [(path, line_number), ...])] for the duplicated tasks of view
+
+        The locations list the other copies, the view's own lines included.
+        """
+        current = os.path.normcase(os.path.abspath(view.file_name()))
+
+        with self._lock:
+            others = []
+            for file_hashes in self.files:
+                if os.path.normcase(os.path.abspath(file_hashes.path)) == current:
+                    continue
+                try:
+                    file_hashes.update()
+                except OSError as e:
+                    print("TodoTxt: Unable to read {0} - {1}".format(file_hashes.path, str(e)))
+                others.append(file_hashes)
+
+            previous = self._view_keys.get(view.buffer_id(), {})
+            keys = {}
+            view_rows = {}
+            index = get_index(view)
+            with index.lock:
+                for row, line_start, task in index.iter_tasks():
+                    key = previous.get(task.text)
+                    if key is None:
+                        key = task_key(task)
+                    keys[task.text] = key
+                    view_rows.setdefault(key, []).append((row, line_start, len(task.text)))
+            self._view_keys[view.buffer_id()] = keys
+
+        path = view.file_name()
+        duplicates = []
+        for key, rows in view_rows.items():
+            elsewhere = [
+                (file_hashes.path, line_number)
+                for file_hashes in others
+                for line_number in file_hashes.line_numbers(key)
+            ]
+            if len(rows) < 2 and not elsewhere:
+                continue
+            for row, line_start, length in rows:
+                copies = [(path, other + 1) for other, _, _ in rows if other != row] + elsewhere
+                duplicates.append((row, sublime.Region(line_start, line_start + length), copies))
+
+        duplicates.sort(key=lambda duplicate: duplicate[0])
+        return duplicates
+
+    def discard(self, view):
+        with self._lock:
+            self._view_keys.pop(view.buffer_id(), None)
+
+
+_duplicate_indexes = PerDirectory(DuplicateIndex)
+
+
+def get_duplicate_index(directory):
+    """Return the shared duplicate index of a directory"""
+    return _duplicate_indexes.get(directory)
+
+
+@timed()
+def highlight_duplicates(view):
+    """Underline the duplicated tasks of view and return them"""
+    duplicates = get_duplicate_index(os.path.dirname(view.file_name())).find(view)
+    view.add_regions(
+        DUPLICATES_KEY,
+        [region for _, region, _ in duplicates],
+        scope="region.purplish",
+        flags=sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SOLID_UNDERLINE,
+    )
+    return duplicates
+
+
+@instrument
+class TodoTxtFindDuplicatesCommand(sublime_plugin.TextCommand):
+    """Highlight the tasks also found elsewhere in the todo files and list them"""
+
+    def run(self, edit):
+        view = self.view
+        if not view.file_name():
+            sublime.status_message("TodoTxt: Please save the file first")
+            return
+
+        sublime.set_timeout_async(lambda: self._find(view), 0)
+
+    def _find(self, view):
+        duplicates = highlight_duplicates(view)
+        sublime.set_timeout(lambda: self._show_results(view, duplicates), 0)
+
+    def _show_results(self, view, duplicates):
+        window = view.window()
+        if not duplicates:
+            sublime.status_message("TodoTxt: No duplicate tasks")
+            return
+        if window is None:
+            return
+
+        items = []
+        for row, region, copies in duplicates:
+            where = ", ".join("{0}:{1}".format(os.path.basename(path), line) for path, line in copies)
+            items.append([view.substr(region).strip(), "line {0}, also at {1}".format(row + 1, where)])
+
+        def on_select(index):
+            if index >= 0:
+                region = duplicates[index][1]
+                view.sel().clear()
+                view.sel().add(region.begin())
+                view.show_at_center(region)
+
+        window.show_quick_panel(items, on_select)
+        sublime.status_message("TodoTxt: {0} duplicate task(s)".format(len(duplicates)))
+
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
+
+
+@instrument
+class TodoTxtDuplicateListener(sublime_plugin.EventListener):
+    """Highlight duplicates after saving when check_duplicates_on_save is set"""
+
+    def on_post_save_async(self, view):
+        if (
+            get_setting("check_duplicates_on_save", False)
+            and view.match_selector(0, "text.todo")
+            and file_tier(view) != HUGE
+        ):
+            duplicates = highlight_duplicates(view)
+            if duplicates:
+                sublime.status_message("TodoTxt: {0} duplicate task(s)".format(len(duplicates)))
+
+    def on_close(self, view):
+        directory = os.path.dirname(view.file_name() or "")
+        index = _duplicate_indexes.existing(directory)
+        if index is not None:
+            index.discard(view)
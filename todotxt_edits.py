@@ -0,0 +1,143 @@
+import os
+from bisect import bisect_left
+from itertools import accumulate
+
+import sublime
+
+
+def longest_increasing_subsequence(values):
+    """Return the positions of a longest strictly increasing subsequence of values"""
+    tails = []
+    tail_positions = []
+    previous = [-1] * len(values)
+
+    for position, value in enumerate(values):
+        i = bisect_left(tails, value)
+        if i == len(tails):
+            tails.append(value)
+            tail_positions.append(position)
+        else:
+            tails[i] = value
+            tail_positions[i] = position
+        previous[position] = tail_positions[i - 1] if i else -1
+
+    result = []
+    position = tail_positions[-1] if tail_positions else -1
+    while position >= 0:
+        result.append(position)
+        position = previous[position]
+    result.reverse()
+    return result
+
+
+def line_order_hunks(line_count, order):
+    """Compute the hunks turning rows 0..line_count-1 into the rows listed in order
+
+    Rows on a longest increasing subsequence of order stay where they are,
+    every other row is deleted or re-inserted. Returns a list of
+    (first_row, stop_row, inserted_rows) replacing [first_row, stop_row).
+    """
+    kept = set(order[position] for position in longest_increasing_subsequence(order))
+
+    hunks = []
+    row = 0
+    inserted = []
+    for index in order:
+        if index in kept:
+            if row < index or inserted:
+                hunks.append((row, index, inserted))
+            row = index + 1
+            inserted = []
+        else:
+            inserted.append(index)
+
+    if row < line_count or inserted:
+        hunks.append((row, line_count, inserted))
+    return hunks
+
+
+def apply_line_order(view, edit, lines, order):
+    """Rewrite the whole view as the given lines in the given order with minimal edits
+
+    lines are the current lines of the view, order lists the indices of the
+    lines to keep in their new order (lines left out are removed). Only the
+    lines that actually move are touched, which keeps undo history small and
+    leaves regions and bookmarks on unmoved lines in place. Returns the
+    number of hunks applied.
+    """
+    hunks = line_order_hunks(len(lines), order)
+    if not hunks:
+        return 0
+
+    # Offsets are computed as if every line, including the last, ended with
+    # a newline; a temporary newline makes that true while hunks are applied
+    starts = [0]
+    starts.extend(accumulate(len(line) + 1 for line in lines))
+    content_size = starts[-1] - 1
+
+    touches_end = hunks[-1][1] == len(lines)
+    if touches_end:
+        view.insert(edit, content_size, "\n")
+
+    for first_row, stop_row, inserted in reversed(hunks):
+        region = sublime.Region(starts[first_row], starts[stop_row])
+        text = "".join(lines[index] + "\n" for index in inserted)
+        if region.empty():
+            view.insert(edit, region.begin(), text)
+        else:
+            view.replace(edit, region, text)
+
+    if touches_end and order:
+        size = view.size()
+        view.erase(edit, sublime.Region(size - 1, size))
+    return len(hunks)
+
+
+def transform_selected_lines(view, edit, transform):
+    """Apply transform(line_text) -> new_text to every line touched by the selections
+
+    The lines of each selection are read with a single substr() and written
+    back with a single replace() covering only the changed span, processing
+    selections bottom-up like a per-line loop would. Returns the number of
+    replacements made.
+    """
+    replacements = 0
+    for region in reversed(view.sel()):
+        block = view.line(region)
+        lines = view.substr(block).split("\n")
+        new_lines = [transform(line) for line in lines]
+        if _replace_changed(view, edit, block.begin(), lines, new_lines):
+            replacements += 1
+    return replacements
+
+
+def _replace_changed(view, edit, begin, lines, new_lines):
+    """Replace the span where new_lines differ from lines, which start at begin"""
+    first = 0
+    while first < len(lines) and lines[first] == new_lines[first]:
+        first += 1
+    if first == len(lines):
+        return False
+
+    last = len(lines) - 1
+    while last > first and lines[last] == new_lines[last]:
+        last -= 1
+
+    old_text = "\n".join(lines[first : last + 1])
+    new_text = "\n".join(new_lines[first : last + 1])
+    start = begin + sum(len(line) + 1 for line in lines[:first])
+
+    # Trim unchanged characters so that e.g. adding a prefix is a plain insert
+    prefix = len(os.path.commonprefix([old_text, new_text]))
+    limit = min(len(old_text), len(new_text)) - prefix
+    suffix = min(len(os.path.commonprefix([old_text[::-1], new_text[::-1]])), limit)
+
+    region = sublime.Region(start + prefix, start + len(old_text) - suffix)
+    text = new_text[prefix : len(new_text) - suffix]
+    if region.empty():
+        view.insert(edit, region.begin(), text)
+    elif text:
+        view.replace(edit, region, text)
+    else:
+        view.erase(edit, region)
+    return True
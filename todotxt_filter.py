@@ -0,0 +1,230 @@
+import re
+
+import sublime
+import sublime_plugin
+
+from .todotxt_index import get_index
+from .todotxt_perf import instrument, timed
+from .todotxt_scheduler import scheduler
+from .todotxt_tasks import date_ordinal, today_ordinal
+
+PRIORITY_PATTERN = re.compile(r"([A-Z])(?:-([A-Z]))?$")
+DUE_PATTERN = re.compile(r"due(<=|>=|<|>|=|:)(.+)$")
+RELATIVE_DATE_PATTERN = re.compile(r"([+-]\d+)([dw])$")
+
+RELATIVE_DAYS = {"today": 0, "tomorrow": 1, "yesterday": -1}
+
+# Source buffer id -> {filter view id: (filter view, query)}
+_filters = {}
+
+
+def parse_date(value):
+    """Turn YYYY-MM-DD, today, tomorrow, yesterday or +Nd/-Nw into a date ordinal"""
+    value = value.lower()
+    if value in RELATIVE_DAYS:
+        return today_ordinal() + RELATIVE_DAYS[value]
+
+    match = RELATIVE_DATE_PATTERN.match(value)
+    if match:
+        days = int(match.group(1)) * (7 if match.group(2) == "w" else 1)
+        return today_ordinal() + days
+
+    ordinal = date_ordinal(value) if len(value) == 10 else None
+    if ordinal is None:
+        raise ValueError("Invalid date '{0}'".format(value))
+    return ordinal
+
+
+def parse_query(query):
+    """Parse a filter query into a list of (negated, kind, argument) terms
+
+    Terms are separated by whitespace and negated by a leading "-":
+
+    - pri:A, pri:A-C or pri:none
+    - @context and +project
+    - done
+    - due, or due with <, <=, =, >=, > and a date, e.g. due<=+7d
+    - any other word matches the task text, ignoring case
+    """
+    terms = []
+    for word in query.split():
+        negated = word.startswith("-") and len(word) > 1
+        if negated:
+            word = word[1:]
+        lower = word.lower()
+
+        if lower == "pri:none":
+            terms.append((negated, "priority", None))
+        elif lower.startswith("pri:"):
+            match = PRIORITY_PATTERN.match(word[4:].upper())
+            if not match:
+                raise ValueError("Invalid priority '{0}'".format(word[4:]))
+            first, last = match.group(1), match.group(2) or match.group(1)
+            terms.append((negated, "priority", (min(first, last), max(first, last))))
+        elif word[0] in "@+" and len(word) > 1:
+            terms.append((negated, "tag", (word[0], lower[1:])))
+        elif lower == "done":
+            terms.append((negated, "done", None))
+        elif lower == "due":
+            terms.append((negated, "due", (None, None)))
+        elif DUE_PATTERN.match(lower):
+            operator, value = DUE_PATTERN.match(lower).groups()
+            ordinal = parse_date(value)
+            bounds = {
+                "<": (None, ordinal - 1),
+                "<=": (None, ordinal),
+                "=": (ordinal, ordinal),
+                ":": (ordinal, ordinal),
+                ">=": (ordinal, None),
+                ">": (ordinal + 1, None),
+            }[operator]
+            terms.append((negated, "due", bounds))
+        else:
+            terms.append((negated, "text", lower))
+    return terms
+
+
+def _term_tasks(index, kind, argument):
+    """Return the set of tasks an indexed term matches"""
+    if kind == "priority":
+        if argument is None:
+            with_priority = set()
+            for tasks in index.priorities.values():
+                with_priority |= tasks
+            return index.all_tasks - with_priority
+        first, last = argument
+        matches = set()
+        for letter in range(ord(first), ord(last) + 1):
+            matches |= index.priorities.get(chr(letter), set())
+        return matches
+    if kind == "tag":
+        sigil, tag = argument
+        return index.tag_tasks[sigil].get(tag, set())
+    if kind == "done":
+        return index.completed
+    if kind == "due":
+        return set(index.due_dates.between(*argument))
+    raise ValueError(kind)
+
+
+def filter_tasks(index, terms):
+    """Return the sorted rows of the tasks of index matching every term"""
+    with index.lock:
+        index.refresh()
+
+        positive = []
+        negative = []
+        texts = []
+        for negated, kind, argument in terms:
+            if kind == "text":
+                texts.append((negated, argument))
+            elif negated:
+                negative.append(_term_tasks(index, kind, argument))
+            else:
+                positive.append(_term_tasks(index, kind, argument))
+
+        # Intersect from the smallest posting set, then subtract exclusions
+        positive.sort(key=len)
+        matches = set(positive[0]) if positive else set(index.all_tasks)
+        for tasks in positive[1:]:
+            matches &= tasks
+        for tasks in negative:
+            matches -= tasks
+
+        if texts:
+            matches = set(
+                task
+                for task in matches
+                if all((text in task.text.lower()) != negated for negated, text in texts)
+            )
+        return index.rows_of(matches)
+
+
+def render_filter(source, filter_view, query):
+    """Fill a filter view with the tasks of source matching query"""
+    try:
+        terms = parse_query(query)
+    except ValueError as e:
+        sublime.status_message("TodoTxt: {0}".format(str(e)))
+        return
+
+    index = get_index(source)
+    with index.lock:
+        rows = filter_tasks(index, terms)
+        text = "\n".join(index.lines[row] for row in rows)
+    filter_view.run_command("todo_txt_filter_render", {"text": text})
+
+
+@instrument
+class TodoTxtFilterCommand(sublime_plugin.TextCommand):
+    """Show the tasks matching a query in a scratch view kept up to date"""
+
+    def run(self, edit, query=None):
+        view = self.view
+        window = view.window()
+        if not window:
+            return
+
+        if query is None:
+            window.show_input_panel(
+                "Filter tasks (e.g. pri:A-C @office due<=+7d -done):",
+                "",
+                lambda text: view.run_command("todo_txt_filter", {"query": text}),
+                None,
+                None,
+            )
+            return
+
+        try:
+            parse_query(query)
+        except ValueError as e:
+            sublime.status_message("TodoTxt: {0}".format(str(e)))
+            return
+
+        filter_view = window.new_file()
+        filter_view.set_scratch(True)
+        filter_view.set_name("Filter: {0}".format(query))
+        filter_view.assign_syntax(view.settings().get("syntax"))
+        filter_view.set_read_only(True)
+        _filters.setdefault(view.buffer_id(), {})[filter_view.id()] = (filter_view, query)
+        sublime.set_timeout_async(lambda: render_filter(view, filter_view, query), 0)
+
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
+
+
+@instrument
+class TodoTxtFilterRenderCommand(sublime_plugin.TextCommand):
+    """Replace the content of a filter view"""
+
+    def run(self, edit, text):
+        view = self.view
+        if view.substr(sublime.Region(0, view.size())) == text:
+            return
+        view.set_read_only(False)
+        view.replace(edit, sublime.Region(0, view.size()), text)
+        view.set_read_only(True)
+
+
+@instrument
+class TodoTxtFilterListener(sublime_plugin.EventListener):
+    """Re-run the filters of a buffer after it changes"""
+
+    def on_modified_async(self, view):
+        filters = _filters.get(view.buffer_id())
+        if filters:
+            scheduler.schedule(view, "filter", self.refresh_filters)
+
+    @timed()
+    def refresh_filters(self, view):
+        for filter_view, query in list(_filters.get(view.buffer_id(), {}).values()):
+            if filter_view.is_valid():
+                render_filter(view, filter_view, query)
+
+    def on_pre_close(self, view):
+        # Other views of the buffer keep its filters refreshing
+        if not view.clones():
+            _filters.pop(view.buffer_id(), None)
+        for filters in _filters.values():
+            filters.pop(view.id(), None)
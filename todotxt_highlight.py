@@ -0,0 +1,126 @@
+import sublime
+
+from .todotxt_index import get_index
+from .todotxt_perf import timed
+from .todotxt_scheduler import scheduler
+from .todotxt_settings import get_setting
+
+DEFAULT_LAZY_HIGHLIGHT_LINES = 20000
+DEFAULT_LAZY_HIGHLIGHT_CHUNK = 2000
+DEFAULT_LAZY_HIGHLIGHT_MARGIN = 100
+
+# (view id, pass name) -> (first, last) visible row of the last visible-only pass
+_visible_rows = {}
+
+
+def _visible_row_range(view):
+    visible = view.visible_region()
+    return view.rowcol(visible.begin())[0], view.rowcol(visible.end())[0]
+
+
+def visible_rows_changed(view, name):
+    """Check whether view scrolled since its last visible-only pass called name"""
+    return _visible_rows.get((view.id(), name)) != _visible_row_range(view)
+
+
+def discard_visible_rows(view):
+    """Forget the visible-only passes of a closed view"""
+    view_id = view.id()
+    for key in [key for key in _visible_rows if key[0] == view_id]:
+        _visible_rows.pop(key, None)
+
+
+def _unchanged(found):
+    return found
+
+
+def paint(view, name, collect, draw, visible_only=False, resolve=None):
+    """Run a highlight pass over a view
+
+    collect(index, start_row, stop_row) returns a dict of region key to the
+    list of regions found in those rows, draw(view, regions_by_key) applies
+    them. collect runs under the index lock; with resolve, collect returns
+    whatever it found in the rows instead and resolve(found) turns it into
+    the dict after the lock is released, for work such as disk access that
+    must not block the other users of the index. Buffers above lazy_highlight_lines are processed in chunks, the
+    chunks around the visible region first, with the rest filled in from
+    the async thread. A pass stops as soon as a newer one is scheduled.
+
+    With visible_only, whatever the size of the buffer, only the chunks
+    around the visible region are highlighted and the rest is left bare.
+    """
+    index = get_index(view)
+    with index.lock:
+        total = len(index.lines)
+        change_count = index.change_count
+
+    if resolve is None:
+        resolve = _unchanged
+
+    threshold = get_setting("lazy_highlight_lines", DEFAULT_LAZY_HIGHLIGHT_LINES)
+    if not visible_only and (not threshold or total <= threshold):
+        with index.lock:
+            found = collect(index, 0, total)
+        regions = resolve(found)
+        if not scheduler.is_stale(view, name):
+            draw(view, regions)
+        return
+
+    chunk_size = max(get_setting("lazy_highlight_chunk", DEFAULT_LAZY_HIGHLIGHT_CHUNK), 1)
+    margin = get_setting("lazy_highlight_margin", DEFAULT_LAZY_HIGHLIGHT_MARGIN)
+    pending = set(range((total + chunk_size - 1) // chunk_size))
+    collected = {}
+
+    def visible_chunks():
+        visible = view.visible_region()
+        first = max(view.rowcol(visible.begin())[0] - margin, 0)
+        last = min(view.rowcol(visible.end())[0] + margin, total - 1)
+        return range(first // chunk_size, last // chunk_size + 1)
+
+    if visible_only:
+        _visible_rows[(view.id(), name)] = _visible_row_range(view)
+        pending = set(visible_chunks()) or {0}
+
+    def merged():
+        keys = set()
+        for chunk_regions in collected.values():
+            keys.update(chunk_regions)
+        return {
+            key: [region for chunk in sorted(collected) for region in collected[chunk].get(key, ())]
+            for key in keys
+        }
+
+    @timed("paint.{0}".format(name))
+    def step():
+        if scheduler.is_stale(view, name) or not view.is_valid():
+            return
+
+        # Re-prioritize on every step so scrolling pulls new chunks forward
+        visible = [chunk for chunk in visible_chunks() if chunk in pending]
+        if visible:
+            chunks = visible
+        else:
+            center = visible_chunks()[0]
+            chunks = [min(pending, key=lambda chunk: abs(chunk - center))]
+
+        found = {}
+        with index.lock:
+            if index.change_count != change_count:
+                return
+            for chunk in chunks:
+                start = chunk * chunk_size
+                found[chunk] = collect(index, start, min(start + chunk_size, total))
+        for chunk in chunks:
+            collected[chunk] = resolve(found[chunk])
+            pending.discard(chunk)
+
+        # Redraw only when something on screen changed or the pass is complete
+        if visible or not pending:
+            if scheduler.is_stale(view, name):
+                return
+            draw(view, merged())
+
+        if pending:
+            sublime.set_timeout_async(step, 0)
+
+    step()
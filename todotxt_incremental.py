@@ -0,0 +1,135 @@
+import binascii
+import gzip
+import os
+import threading
+
+# Bytes before the consumed end of a file compared to detect a pure append
+TAIL_CHECK_BYTES = 64
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+
+class IncrementalReader(object):
+    """Reads the lines of a file as it changes, consuming each line once
+
+    An append_only file (done.txt, archive partitions) that grew with the
+    bytes before the consumed end unchanged only has its new lines read;
+    any other change reads the whole file again. Only complete lines are
+    consumed, a last line without a newline, as left by saving from the
+    editor, is kept in partial instead since it may still grow. Gzip files
+    grow by whole members, which decompress on their own from a member
+    boundary, and have no partial line.
+    """
+
+    __slots__ = ("path", "append_only", "compressed", "size", "mtime", "inode", "offset", "tail", "partial")
+
+    def __init__(self, path, append_only=False):
+        self.path = path
+        self.append_only = append_only
+        self.compressed = path.endswith(".gz")
+        self.reset()
+
+    def reset(self):
+        self.size = None
+        self.mtime = None
+        self.inode = None
+        # Bytes of the file consumed so far
+        self.offset = 0
+        self.tail = b""
+        self.partial = ""
+
+    def state(self):
+        """Return the checkpoint as JSON compatible values"""
+        return [self.size, self.mtime, self.inode, self.offset, binascii.hexlify(self.tail).decode("ascii")]
+
+    def load_state(self, state):
+        self.size, self.mtime, self.inode, self.offset, tail = state
+        self.tail = binascii.unhexlify(tail)
+        self.partial = ""
+        if self.size != self.offset:
+            # The partial line is not stored, read it again on the next update
+            self.size = None
+
+    def update(self, consume, reset):
+        """Consume the lines appended since the last update
+
+        reset() is called first when the file has to be read again from the
+        start, then consume(data, offset) with each run of complete lines,
+        as bytes, and the offset they start at in the file. Returns True if
+        the file was reset or lines were consumed. A missing file counts as
+        empty.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self.size is None and not self.offset:
+                return False
+            self.reset()
+            reset()
+            return True
+
+        if (stat.st_size, stat.st_mtime, stat.st_ino) == (self.size, self.mtime, self.inode):
+            return False
+
+        with open(self.path, "rb") as f:
+            appended = self._is_appended(f, stat)
+            if not appended:
+                self.reset()
+                reset()
+            offset = self.offset
+            f.seek(self.offset)
+            if self.compressed:
+                data = f.read(stat.st_size - self.offset)
+                if data:
+                    consume(gzip.decompress(data), self.offset)
+                    self._consumed(data)
+            else:
+                self._read_lines(f, stat.st_size, consume)
+
+        self.size, self.mtime, self.inode = stat.st_size, stat.st_mtime, stat.st_ino
+        return not appended or self.offset != offset
+
+    def _is_appended(self, f, stat):
+        if not self.append_only or stat.st_ino != self.inode or stat.st_size < self.offset:
+            return False
+        f.seek(self.offset - len(self.tail))
+        return f.read(len(self.tail)) == self.tail
+
+    def _read_lines(self, f, size, consume):
+        remainder = b""
+        while self.offset + len(remainder) < size:
+            chunk = f.read(min(READ_CHUNK_BYTES, size - self.offset - len(remainder)))
+            if not chunk:
+                break
+            data = remainder + chunk
+            end = data.rfind(b"\n") + 1
+            if end:
+                consume(data[:end], self.offset)
+                self._consumed(data[:end])
+            remainder = data[end:]
+        self.partial = remainder.decode("utf-8", "replace").rstrip("\r")
+
+    def _consumed(self, data):
+        self.offset += len(data)
+        self.tail = (self.tail + data[-TAIL_CHECK_BYTES:])[-TAIL_CHECK_BYTES:]
+
+
+class PerDirectory(object):
+    """Shared instances of a class taking a directory, created on first use"""
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, directory):
+        with self._lock:
+            instance = self._instances.get(directory)
+            if instance is None:
+                instance = self._instances[directory] = self._factory(directory)
+            return instance
+
+    def existing(self, directory):
+        """Return the instance of directory if one was created, or None"""
+        with self._lock:
+            return self._instances.get(directory)
@@ -0,0 +1,370 @@
+import threading
+from bisect import bisect_left, insort
+from itertools import count
+
+import sublime
+import sublime_plugin
+
+from .todotxt_perf import instrument
+from .todotxt_tasks import parse_task
+
+# Placeholders for lines not parsed yet: loaded from disk, or edited since
+_UNPARSED = object()
+_EDITED = object()
+
+# Monotonic stamp recording when a tag was last typed
+_clock = count(1)
+
+# Rows between two cached line offsets
+OFFSET_BLOCK = 1024
+
+_indexes = {}
+_listeners = {}
+_lock = threading.Lock()
+
+
+class TagIndex(object):
+    """Occurrence counts and recency of the tags of one kind
+
+    ranked() and completions() are cached until a tag is added or removed,
+    so repeated completion queries do not depend on the size of the buffer.
+    """
+
+    def __init__(self, sigil):
+        self.sigil = sigil
+        self.counts = {}
+        self.last_used = {}
+        self._ranked = None
+        self._completions = None
+
+    def add(self, tag, stamp=0):
+        self.counts[tag] = self.counts.get(tag, 0) + 1
+        if stamp:
+            self.last_used[tag] = stamp
+        self._ranked = None
+        self._completions = None
+
+    def remove(self, tag):
+        if self.counts.get(tag, 0) > 1:
+            self.counts[tag] -= 1
+        else:
+            self.counts.pop(tag, None)
+            self.last_used.pop(tag, None)
+        self._ranked = None
+        self._completions = None
+
+    def ranked(self):
+        """Return tags by descending frequency, then most recently typed"""
+        if self._ranked is None:
+            counts = self.counts
+            last_used = self.last_used
+            self._ranked = sorted(
+                counts, key=lambda tag: (-counts[tag], -last_used.get(tag, 0), tag.lower())
+            )
+        return self._ranked
+
+    def completions(self):
+        """Return ranked [trigger, contents] completion pairs"""
+        if self._completions is None:
+            self._completions = [
+                ["{0}{1}\t{2}".format(self.sigil, tag, self.counts[tag]), self.sigil + tag]
+                for tag in self.ranked()
+            ]
+        return self._completions
+
+
+class DueList(object):
+    """Tasks with a due date, ordered by due date
+
+    Tasks added in bulk, as when a buffer is first parsed, are sorted in
+    one go the next time the list is read instead of being inserted one by
+    one.
+    """
+
+    # Pending additions beyond which the whole list is re-sorted
+    MERGE_LIMIT = 64
+
+    def __init__(self):
+        self._sorted = []
+        self._pending = []
+
+    def __len__(self):
+        return len(self._sorted) + len(self._pending)
+
+    def add(self, task):
+        self._pending.append((task.due, id(task), task))
+
+    def remove(self, task):
+        key = (task.due, id(task))
+        i = bisect_left(self._sorted, key)
+        if i < len(self._sorted) and self._sorted[i][1] == key[1]:
+            del self._sorted[i]
+            return
+        for i, entry in enumerate(self._pending):
+            if entry[1] == key[1]:
+                del self._pending[i]
+                return
+
+    def _merge(self):
+        if not self._pending:
+            return
+        if len(self._pending) > self.MERGE_LIMIT:
+            self._sorted.extend(self._pending)
+            self._sorted.sort()
+        else:
+            for entry in self._pending:
+                insort(self._sorted, entry)
+        self._pending = []
+
+    def between(self, first=None, last=None):
+        """Return the tasks due from first to last inclusive, both date ordinals or None"""
+        self._merge()
+        entries = self._sorted
+        start = 0 if first is None else bisect_left(entries, (first,))
+        stop = len(entries) if last is None else bisect_left(entries, (last + 1,))
+        return [entry[2] for entry in entries[start:stop]]
+
+
+class TaskIndex(object):
+    """Parsed tasks of a single buffer
+
+    The index keeps one entry per line and is kept in sync from text change
+    deltas, so an edit only costs work proportional to the edited lines.
+    Changed lines are parsed lazily the next time they are requested.
+
+    Line offsets are cached every OFFSET_BLOCK rows, computed up to the
+    rows requested and dropped from the edited row onward, so finding
+    where a row begins does not depend on the size of the buffer above
+    the last edit.
+
+    Parsed tasks are also indexed by attribute for filtering: priority
+    buckets, lowercased tag postings, completion and due dates.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.tasks = []
+        self.change_count = -1
+        self.lock = threading.RLock()
+        self._reset_attributes()
+        self._unparsed = 0
+        self._block_starts = [0]
+
+    def _reset_attributes(self):
+        self.tags = {"@": TagIndex("@"), "+": TagIndex("+")}
+        self.all_tasks = set()
+        self.completed = set()
+        self.priorities = {}
+        self.tag_tasks = {"@": {}, "+": {}}
+        self.due_dates = DueList()
+
+    def rebuild(self, view):
+        """Load the whole buffer, marking every line as unparsed"""
+        content = view.substr(sublime.Region(0, view.size()))
+        self.lines = content.split("\n")
+        self.tasks = [_UNPARSED] * len(self.lines)
+        self._reset_attributes()
+        self.change_count = view.change_count()
+        self._unparsed = len(self.lines)
+        self._block_starts = [0]
+
+    def invalidate(self):
+        """Force a full rebuild on next access"""
+        self.change_count = -1
+
+    def apply_changes(self, changes, change_count):
+        """Splice a list of sublime.TextChange deltas into the index"""
+        for change in changes:
+            a, b = change.a, change.b
+            if b.row >= len(self.lines):
+                self.invalidate()
+                return
+
+            prefix = self.lines[a.row][: a.col]
+            suffix = self.lines[b.row][b.col :]
+            new_lines = (prefix + change.str + suffix).split("\n")
+
+            for task in self.tasks[a.row : b.row + 1]:
+                if task is _UNPARSED or task is _EDITED:
+                    self._unparsed -= 1
+                elif task is not None:
+                    self._remove(task)
+
+            self.lines[a.row : b.row + 1] = new_lines
+            self.tasks[a.row : b.row + 1] = [_EDITED] * len(new_lines)
+            self._unparsed += len(new_lines)
+            # Offsets up to the edited row are unchanged
+            del self._block_starts[a.row // OFFSET_BLOCK + 1 :]
+
+        self.change_count = change_count
+
+    def refresh(self, start=0, stop=None):
+        """Parse every unparsed line in rows [start, stop)"""
+        if not self._unparsed:
+            return
+
+        tasks = self.tasks
+        if stop is None or stop > len(tasks):
+            stop = len(tasks)
+
+        stamp = None
+        for row in range(max(start, 0), stop):
+            state = tasks[row]
+            if state is _UNPARSED or state is _EDITED:
+                task = parse_task(self.lines[row])
+                tasks[row] = task
+                self._unparsed -= 1
+                if task is not None:
+                    # Only tags typed since the buffer was loaded count as recently used
+                    if state is _EDITED and stamp is None:
+                        stamp = next(_clock)
+                    self._add(task, stamp if state is _EDITED else 0)
+
+    def _add(self, task, stamp=0):
+        self.all_tasks.add(task)
+        if task.completed:
+            self.completed.add(task)
+        if task.priority:
+            self.priorities.setdefault(task.priority, set()).add(task)
+        if task.due is not None:
+            self.due_dates.add(task)
+        for sigil, tags in (("@", task.contexts), ("+", task.projects)):
+            postings = self.tag_tasks[sigil]
+            for tag in tags:
+                self.tags[sigil].add(tag, stamp)
+                postings.setdefault(tag.lower(), set()).add(task)
+
+    def _remove(self, task):
+        self.all_tasks.discard(task)
+        self.completed.discard(task)
+        if task.priority:
+            self.priorities[task.priority].discard(task)
+        if task.due is not None:
+            self.due_dates.remove(task)
+        for sigil, tags in (("@", task.contexts), ("+", task.projects)):
+            postings = self.tag_tasks[sigil]
+            for tag in tags:
+                self.tags[sigil].remove(tag)
+                tasks = postings.get(tag.lower())
+                if tasks is not None:
+                    tasks.discard(task)
+                    if not tasks:
+                        del postings[tag.lower()]
+
+    def rows_of(self, tasks):
+        """Return the sorted rows of the given parsed tasks"""
+        return [row for row, task in enumerate(self.tasks) if task in tasks]
+
+    def line_start(self, row):
+        """Return the buffer offset at which row begins"""
+        lines = self.lines
+        starts = self._block_starts
+        block = row // OFFSET_BLOCK
+        while len(starts) <= block:
+            first = (len(starts) - 1) * OFFSET_BLOCK
+            starts.append(starts[-1] + sum(map(len, lines[first : first + OFFSET_BLOCK])) + OFFSET_BLOCK)
+
+        first = block * OFFSET_BLOCK
+        return starts[block] + sum(map(len, lines[first:row])) + row - first
+
+    def iter_tasks(self, start=0, stop=None):
+        """Yield (row, line_start, task) for parsed non-blank lines in [start, stop)"""
+        self.refresh(start, stop)
+        if stop is None or stop > len(self.tasks):
+            stop = len(self.tasks)
+
+        start = max(start, 0)
+        lines = self.lines
+        offset = self.line_start(start) if start < stop else 0
+        for row in range(start, stop):
+            task = self.tasks[row]
+            if task is not None:
+                yield row, offset, task
+            offset += len(lines[row]) + 1
+
+    def due_regions(self, start=0, stop=None):
+        """Yield (region, task) for due dates of incomplete tasks"""
+        for _, line_start, task in self.iter_tasks(start, stop):
+            if task.due is not None and not task.completed:
+                span = task.due_span
+                yield sublime.Region(line_start + span[0], line_start + span[1]), task
+
+    def note_regions(self, start=0, stop=None):
+        """Yield (region, note_file) for every note reference"""
+        for _, line_start, task in self.iter_tasks(start, stop):
+            for note_start, note_end, note_file in task.notes:
+                yield sublime.Region(line_start + note_start, line_start + note_end), note_file
+
+
+def get_index(view):
+    """Return the up to date task index of a view's buffer"""
+    buffer_id = view.buffer_id()
+    with _lock:
+        index = _indexes.get(buffer_id)
+        if index is None:
+            index = _indexes[buffer_id] = TaskIndex()
+            listener = TodoTxtIndexListener(index)
+            listener.attach(view.buffer())
+            _listeners[buffer_id] = listener
+
+    with index.lock:
+        if index.change_count != view.change_count():
+            index.rebuild(view)
+    return index
+
+
+def discard_index(view):
+    """Drop the index of a view's buffer"""
+    buffer_id = view.buffer_id()
+    with _lock:
+        _indexes.pop(buffer_id, None)
+        listener = _listeners.pop(buffer_id, None)
+    if listener is not None and listener.is_attached():
+        listener.detach()
+
+
+@instrument
+class TodoTxtIndexListener(sublime_plugin.TextChangeListener):
+    """Feed buffer change deltas into the buffer's task index"""
+
+    def __init__(self, index=None):
+        super().__init__()
+        self.index = index
+
+    @classmethod
+    def is_applicable(cls, buffer):
+        # Attached explicitly by get_index()
+        return False
+
+    def on_text_changed(self, changes):
+        index = self.index
+        view = self.buffer.primary_view()
+        if index is None or view is None:
+            return
+
+        with index.lock:
+            change_count = view.change_count()
+            if index.change_count < 0 or index.change_count == change_count:
+                # Not built yet, or already rebuilt from the final content
+                return
+
+            index.apply_changes(changes, change_count)
+            if len(index.lines) != view.rowcol(view.size())[0] + 1:
+                index.invalidate()
+
+    def on_reload(self):
+        if self.index is not None:
+            self.index.invalidate()
+
+    def on_revert(self):
+        if self.index is not None:
+            self.index.invalidate()
+
+
+@instrument
+class TodoTxtIndexCleanup(sublime_plugin.EventListener):
+    """Release task indexes when their last view closes"""
+
+    def on_pre_close(self, view):
+        if not view.clones():
+            discard_index(view)
@@ -0,0 +1,353 @@
+import gzip
+import json
+import os
+import threading
+import uuid
+
+import sublime
+import sublime_plugin
+
+from .todotxt_perf import instrument
+from .todotxt_writer import AppendJob, writer
+
+JOURNAL_FILE = "journal.json"
+
+# Rows around its recorded row a moved line is looked for when it is removed
+# from a saved source, which the lines above it may have shifted
+REMOVE_WINDOW = 16
+
+# Entry states: appends not known to be on disk yet, or appended but the
+# tasks may still be in the saved source file
+PENDING = "pending"
+APPENDED = "appended"
+
+
+def _fsync_write(path, data):
+    """Replace a file with data, durably"""
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class MoveJournal(object):
+    """Write-ahead journal making task moves between files crash-safe
+
+    A move is recorded before anything is written, the appends to the
+    target files are made with one write and one fsync each, and the entry
+    is committed once the source file has been saved without the moved
+    tasks. Appends are made by the background writer, so a slow disk never
+    blocks the editor. recover() replays or rolls back whatever a crash
+    interrupted.
+    """
+
+    def __init__(self):
+        self._entries = None
+        self._lock = threading.RLock()
+
+    def _journal_file(self):
+        return os.path.join(sublime.cache_path(), "TodoTxt", JOURNAL_FILE)
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        try:
+            with open(self._journal_file(), "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def _persist(self):
+        journal_file = self._journal_file()
+        os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+        _fsync_write(journal_file, json.dumps(self._entries))
+
+    def begin(self, source, appends, lines):
+        """Record a move of task lines from source into target files
+
+        appends is a list of (target_path, lines), lines the (row, text) of
+        the moved lines in source at the time of the move. The entry is
+        persisted by the writer thread once the append offsets are known.
+        Returns the entry id.
+        """
+        entry = {
+            "source": source,
+            "state": PENDING,
+            "lines": [[row, text.strip()] for row, text in lines],
+            "appends": [],
+        }
+        for path, targets in appends:
+            text = "".join(line + "\n" for line in targets)
+            entry["appends"].append({"path": path, "offset": None, "text": text})
+
+        entry_id = uuid.uuid4().hex
+        with self._lock:
+            self._load()
+            self._entries[entry_id] = entry
+        return entry_id
+
+    def write(self, entry_id, on_done=None):
+        """Queue the appends of an entry on the background writer
+
+        Once every append is on disk the entry is marked appended; if one
+        fails the targets are truncated back and the entry dropped, leaving
+        the files as they were before begin(). on_done(error) is called on
+        the main thread either way.
+        """
+        with self._lock:
+            entry = self._entries[entry_id]
+        remaining = [len(entry["appends"])]
+        errors = []
+
+        def prepare(append, offset, newline):
+            with self._lock:
+                if newline and not append["path"].endswith(".gz"):
+                    append["text"] = "\n" + append["text"]
+                append["offset"] = offset
+            data = append["text"].encode("utf-8")
+            if append["path"].endswith(".gz"):
+                data = gzip.compress(data)
+            return data
+
+        def done(error):
+            if error is not None:
+                errors.append(error)
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+            sublime.set_timeout_async(lambda: finish(errors[0] if errors else None), 0)
+
+        def finish(error):
+            try:
+                if error is not None:
+                    self.rollback(entry_id)
+                else:
+                    with self._lock:
+                        entry["state"] = APPENDED
+                        self._persist()
+            except OSError as e:
+                error = error or e
+            if on_done is not None:
+                sublime.set_timeout(lambda: on_done(error), 0)
+
+        for append in entry["appends"]:
+            job = AppendJob(
+                lambda offset, newline, append=append: prepare(append, offset, newline),
+                self._persist_locked,
+                done,
+            )
+            writer.append(append["path"], job)
+
+    def _persist_locked(self):
+        with self._lock:
+            self._persist()
+
+    def lines(self, entry_id):
+        """Return the stripped text of the lines an entry moves out of its source"""
+        with self._lock:
+            return [text for _, text in self._entries[entry_id]["lines"]]
+
+    def mark_removed(self, entry_id):
+        """Record that the lines of an entry were removed from its source buffer
+
+        Persisted by the writer thread, so that the entry can still be
+        committed by a save after the plugin is reloaded.
+        """
+        with self._lock:
+            self._entries[entry_id]["removed"] = True
+        writer.call(self._persist_locked)
+
+    def abort(self, entry_id):
+        """Roll back an entry on the writer thread, after any append queued before"""
+        writer.call(lambda: self.rollback(entry_id))
+
+    def finish_on_disk(self, entry_id):
+        """Remove the lines of an appended entry from its saved source and commit it
+
+        Used when the source view closed before the appends completed, so
+        the lines cannot be removed from the buffer. An entry whose lines
+        are not all found near their rows is left in the journal.
+        """
+        with self._lock:
+            self._load()
+            entry = self._entries.get(entry_id)
+            if entry is None or entry["state"] != APPENDED:
+                return
+            if not _remove_lines(entry["source"], entry["lines"]):
+                _report_left(entry_id, entry)
+                return
+            del self._entries[entry_id]
+            self._persist()
+
+    def rollback(self, entry_id):
+        """Undo whatever part of an entry's appends reached the disk"""
+        with self._lock:
+            self._load()
+            entry = self._entries.pop(entry_id, None)
+            if entry is None:
+                return
+            for append in entry["appends"]:
+                _truncate_append(append)
+            self._persist()
+
+    def commit_source(self, source):
+        """Commit every appended entry whose lines left a just saved file"""
+        with self._lock:
+            self._load()
+            committed = [
+                entry_id
+                for entry_id, entry in self._entries.items()
+                if entry["state"] == APPENDED and entry.get("removed") and _same_file(entry["source"], source)
+            ]
+            for entry_id in committed:
+                del self._entries[entry_id]
+            if committed:
+                self._persist()
+
+    def recover(self):
+        """Complete or roll back moves interrupted by a crash
+
+        Moves out of a file open in a view are left alone: they may only be
+        waiting for their deferred save, which the buffer would overwrite.
+        So are moves whose lines are not all found near their recorded rows,
+        for the user to settle from the journal file.
+        """
+        open_files = set()
+        for window in sublime.windows():
+            for view in window.views():
+                if view.file_name():
+                    open_files.add(_normalized(view.file_name()))
+
+        with self._lock:
+            self._load()
+            if not self._entries:
+                return
+            for entry_id, entry in list(self._entries.items()):
+                if _normalized(entry["source"]) in open_files:
+                    continue
+                try:
+                    if entry["state"] == APPENDED or all(map(_is_appended, entry["appends"])):
+                        # Tasks reached their targets, make sure they left the source
+                        if not _remove_lines(entry["source"], entry["lines"]):
+                            _report_left(entry_id, entry)
+                            continue
+                    else:
+                        for append in entry["appends"]:
+                            _truncate_append(append)
+                except OSError as e:
+                    print("TodoTxt: Unable to recover move {0} - {1}".format(entry_id, str(e)))
+                    continue
+                del self._entries[entry_id]
+            self._persist()
+
+
+def _normalized(path):
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _same_file(a, b):
+    return _normalized(a) == _normalized(b)
+
+
+def _appended_bytes(append):
+    """Return the bytes found at an append's offset, or None if it never started"""
+    if append["offset"] is None:
+        return None
+    try:
+        with open(append["path"], "rb") as f:
+            f.seek(append["offset"])
+            return f.read()
+    except OSError:
+        return None
+
+
+def _is_appended(append):
+    data = _appended_bytes(append)
+    if not data:
+        return False
+    expected = append["text"].encode("utf-8")
+    if append["path"].endswith(".gz"):
+        try:
+            return gzip.decompress(data).startswith(expected)
+        except (OSError, EOFError):
+            return False
+    return data.startswith(expected)
+
+
+def _truncate_append(append):
+    """Cut a file back to its size before the append, if only our data follows"""
+    data = _appended_bytes(append)
+    if not data:
+        return
+    expected = append["text"].encode("utf-8")
+    if append["path"].endswith(".gz"):
+        try:
+            ours = expected.startswith(gzip.decompress(data))
+        except (OSError, EOFError):
+            # An incomplete gzip member can only be the interrupted append
+            ours = True
+    else:
+        ours = expected.startswith(data)
+    if ours:
+        with open(append["path"], "r+b") as f:
+            f.truncate(append["offset"])
+
+
+def _report_left(entry_id, entry):
+    print(
+        "TodoTxt: Move {0} left in {1}, the moved tasks were not all found in {2}".format(
+            entry_id, journal._journal_file(), entry["source"]
+        )
+    )
+
+
+def _nearest_row(lines, row, text, taken):
+    """Return the row within REMOVE_WINDOW of row whose stripped text is text, or None"""
+    for distance in range(REMOVE_WINDOW + 1):
+        for candidate in (row - distance, row + distance):
+            if 0 <= candidate < len(lines) and candidate not in taken and lines[candidate].strip() == text:
+                return candidate
+    return None
+
+
+def _remove_lines(path, moved):
+    """Remove moved (row, text) lines from a file, return False if the file was left alone
+
+    Each line is looked for at its recorded row first, then at the nearest
+    row with the same text within REMOVE_WINDOW rows, as the lines above it
+    may have changed since the move. Lines are only removed when all of
+    them are found.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+    except FileNotFoundError:
+        return True
+
+    removed = set()
+    for row, text in moved:
+        match = _nearest_row(lines, row, text, removed)
+        if match is not None:
+            removed.add(match)
+
+    if len(removed) < len(moved):
+        return False
+    _fsync_write(path, "\n".join(line for row, line in enumerate(lines) if row not in removed))
+    return True
+
+
+journal = MoveJournal()
+
+
+def plugin_loaded():
+    journal.recover()
+
+
+@instrument
+class TodoTxtJournalListener(sublime_plugin.EventListener):
+    """Commit journaled moves once their source file is saved"""
+
+    def on_post_save(self, view):
+        if view.file_name():
+            journal.commit_source(view.file_name())
@@ -0,0 +1,182 @@
+import sublime
+import sublime_plugin
+
+from .todotxt_highlight import discard_visible_rows, visible_rows_changed
+from .todotxt_perf import instrument
+from .todotxt_scheduler import scheduler
+from .todotxt_settings import get_setting
+
+NORMAL = "normal"
+LARGE = "large"
+HUGE = "huge"
+
+MODES = (NORMAL, LARGE, HUGE)
+
+DEFAULT_LARGE_FILE_LINES = 50000
+DEFAULT_LARGE_FILE_SIZE = 5000000
+DEFAULT_HUGE_FILE_LINES = 250000
+DEFAULT_HUGE_FILE_SIZE = 25000000
+DEFAULT_VIEWPORT_POLL_INTERVAL = 250
+
+# View setting forcing a tier, set by todo_txt_set_large_file_mode
+OVERRIDE_SETTING = "todotxt_large_file_mode"
+
+STATUS_KEY = "todotxt_large_file"
+
+STATUS_TEXT = {
+    LARGE: "TodoTxt: large file, visible highlights only",
+    HUGE: "TodoTxt: huge file, highlights and completions off",
+}
+
+# Bumped whenever a view is activated or deactivated, so only the viewport
+# poll of the active view keeps running
+_poll_generation = 0
+
+
+def _exceeds(lines, size, prefix, default_lines, default_size):
+    max_lines = get_setting(prefix + "_lines", default_lines)
+    max_size = get_setting(prefix + "_size", default_size)
+    return bool(max_lines and lines > max_lines) or bool(max_size and size > max_size)
+
+
+def file_tier(view):
+    """Return NORMAL, LARGE or HUGE for a view, from its size or its override
+
+    NORMAL files get every feature. LARGE files are only highlighted around
+    the visible region, get no note prefetching and complete tags from the
+    file itself only. HUGE files get no due date or note highlighting and
+    no tag completions. Sizes are in characters.
+    """
+    override = view.settings().get(OVERRIDE_SETTING)
+    if override in MODES:
+        return override
+
+    size = view.size()
+    lines = view.rowcol(size)[0] + 1
+    if _exceeds(lines, size, "huge_file", DEFAULT_HUGE_FILE_LINES, DEFAULT_HUGE_FILE_SIZE):
+        return HUGE
+    if _exceeds(lines, size, "large_file", DEFAULT_LARGE_FILE_LINES, DEFAULT_LARGE_FILE_SIZE):
+        return LARGE
+    return NORMAL
+
+
+def update_status(view):
+    """Show the tier of a view in the status bar, nothing for NORMAL files"""
+    tier = file_tier(view)
+    if tier == NORMAL:
+        view.erase_status(STATUS_KEY)
+        return
+    text = STATUS_TEXT[tier]
+    if view.settings().get(OVERRIDE_SETTING) in MODES:
+        text += " (forced)"
+    view.set_status(STATUS_KEY, text)
+
+
+def _poll_viewport(view, generation):
+    """Repaint the active large view when it scrolled, every viewport_poll_interval ms
+
+    Scrolling with the mouse wheel or the scroll bar moves no selection, so
+    no event reports it.
+    """
+    interval = get_setting("viewport_poll_interval", DEFAULT_VIEWPORT_POLL_INTERVAL)
+    if generation != _poll_generation or not interval or not view.is_valid():
+        return
+
+    if file_tier(view) == LARGE:
+        # Imported here, both highlighters depend on this module
+        from .todotxt_due_dates import TodoTxtDueDateHighlighter
+        from .todotxt_notes import TodoTxtNoteHighlighter
+
+        if visible_rows_changed(view, "due_dates"):
+            scheduler.schedule(view, "due_dates", TodoTxtDueDateHighlighter().highlight_due_dates, delay=0)
+        if visible_rows_changed(view, "notes"):
+            scheduler.schedule(view, "notes", TodoTxtNoteHighlighter().highlight_notes, delay=0)
+
+    sublime.set_timeout_async(lambda: _poll_viewport(view, generation), interval)
+
+
+def _stop_viewport_poll():
+    global _poll_generation
+    _poll_generation += 1
+
+
+def plugin_unloaded():
+    _stop_viewport_poll()
+
+
+@instrument
+class TodoTxtLargeFileIndicator(sublime_plugin.EventListener):
+    """Keep the large file status of todo views up to date
+
+    The active todo view is also polled for scrolling, see _poll_viewport().
+    """
+
+    def on_load_async(self, view):
+        if view.match_selector(0, "text.todo"):
+            update_status(view)
+
+    def on_activated_async(self, view):
+        _stop_viewport_poll()
+        if view.match_selector(0, "text.todo"):
+            update_status(view)
+            _poll_viewport(view, _poll_generation)
+
+    def on_deactivated_async(self, view):
+        _stop_viewport_poll()
+
+    def on_modified_async(self, view):
+        # Edits can move a file across a limit
+        if view.match_selector(0, "text.todo"):
+            scheduler.schedule(view, "large_file_status", update_status)
+
+    def on_post_save_async(self, view):
+        if view.match_selector(0, "text.todo"):
+            update_status(view)
+
+    def on_close(self, view):
+        discard_visible_rows(view)
+
+
+@instrument
+class TodoTxtSetLargeFileModeCommand(sublime_plugin.TextCommand):
+    """Force a view into a large file tier, or back to automatic
+
+    mode is "normal", "large", "huge" or "auto".
+    """
+
+    def run(self, edit, mode=None):
+        view = self.view
+        if mode is None:
+            window = view.window()
+            if window:
+                choices = ["auto"] + list(MODES)
+                items = [
+                    ["Automatic", "Choose from the file size"],
+                    ["Normal", "Every feature"],
+                    ["Large", "Visible highlights only, completions from this file only"],
+                    ["Huge", "No highlights and no completions"],
+                ]
+                window.show_quick_panel(
+                    items,
+                    lambda index: index >= 0
+                    and view.run_command("todo_txt_set_large_file_mode", {"mode": choices[index]}),
+                )
+            return
+
+        if mode in MODES:
+            view.settings().set(OVERRIDE_SETTING, mode)
+        else:
+            view.settings().erase(OVERRIDE_SETTING)
+        update_status(view)
+
+        # Imported here, both highlighters depend on this module
+        from .todotxt_due_dates import TodoTxtDueDateHighlighter
+        from .todotxt_notes import TodoTxtNoteHighlighter
+
+        sublime.set_timeout_async(lambda: TodoTxtDueDateHighlighter().highlight_due_dates(view), 0)
+        sublime.set_timeout_async(lambda: TodoTxtNoteHighlighter().highlight_notes(view), 0)
+        sublime.status_message("TodoTxt: Using {0} file mode".format(file_tier(view)))
+
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
@@ -0,0 +1,103 @@
+import os
+import sys
+import threading
+import time
+
+from .todotxt_settings import get_setting
+
+DEFAULT_NOTE_CACHE_TTL = 5
+
+# Filesystems that treat differently cased names as the same file
+CASE_INSENSITIVE = sys.platform in ("darwin", "win32")
+
+
+class DirectorySnapshot(object):
+    """Names in a directory at a given mtime"""
+
+    __slots__ = ("names", "mtime", "checked")
+
+    def __init__(self, names, mtime, checked):
+        if CASE_INSENSITIVE:
+            names = frozenset(name.lower() for name in names)
+        self.names = names
+        self.mtime = mtime
+        self.checked = checked
+
+    def __contains__(self, name):
+        return (name.lower() if CASE_INSENSITIVE else name) in self.names
+
+
+class NoteExistenceCache(object):
+    """Answer note existence from cached directory listings
+
+    Each directory is listed once and re-validated by its mtime at most every
+    note_cache_ttl seconds, so checking many references costs a handful of
+    stat calls instead of one per reference. Directories are stat'ed and
+    listed outside the lock, so a slow directory never blocks a lookup on
+    another thread.
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _validate(self, directory, snapshot, now):
+        """Return an up to date snapshot of directory, listing it only if its mtime changed"""
+        try:
+            mtime = os.stat(directory).st_mtime
+        except OSError:
+            mtime = None
+
+        if snapshot is not None and snapshot.mtime == mtime:
+            snapshot.checked = now
+            return snapshot
+
+        try:
+            names = frozenset(os.listdir(directory)) if mtime is not None else frozenset()
+        except OSError:
+            names = frozenset()
+        return DirectorySnapshot(names, mtime, now)
+
+    def exists_many(self, paths):
+        """Return a list of booleans telling whether each normalized path exists"""
+        now = time.time()
+        ttl = get_setting("note_cache_ttl", DEFAULT_NOTE_CACHE_TTL)
+
+        split = [os.path.split(path) for path in paths]
+        with self._lock:
+            generation = self._generation
+            snapshots = {directory: self._snapshots.get(directory) for directory, _ in split}
+
+        expired = [
+            directory
+            for directory, snapshot in snapshots.items()
+            if snapshot is None or now - snapshot.checked >= ttl
+        ]
+        for directory in expired:
+            snapshots[directory] = self._validate(directory, snapshots[directory], now)
+
+        if expired:
+            with self._lock:
+                # Listings started before a refresh() may predate the change it was for
+                if generation == self._generation:
+                    for directory in expired:
+                        self._snapshots[directory] = snapshots[directory]
+
+        return [bool(name) and name in snapshots[directory] for directory, name in split]
+
+    def exists(self, path):
+        """Check whether a single normalized path exists"""
+        return self.exists_many([path])[0]
+
+    def refresh(self, directory=None):
+        """Forget the snapshot of a directory, or of every directory"""
+        with self._lock:
+            self._generation += 1
+            if directory is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(os.path.normpath(directory), None)
+
+
+note_cache = NoteExistenceCache()
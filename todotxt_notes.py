@@ -1,10 +1,47 @@
 import os
-import re
+import threading
 
 import sublime
 import sublime_plugin
 
+from .todotxt_highlight import paint, visible_rows_changed
+from .todotxt_index import get_index
+from .todotxt_large_files import HUGE, LARGE, NORMAL, file_tier
+from .todotxt_note_cache import note_cache
+from .todotxt_perf import instrument, timed
+from .todotxt_preview_cache import preview_cache
+from .todotxt_scheduler import scheduler
+from .todotxt_settings import get_setting
+from .todotxt_tasks import parse_task
 
+DEFAULT_PREVIEW_BYTES = 32 * 1024
+
+# Lines around the cursor whose notes are prefetched into the preview cache
+PREFETCH_LINES = 20
+
+LOADING_HTML = """
+    <div style="margin-top: 20px; font-size: 0.9em; color: color(var(--foreground) alpha(0.5)); font-style: italic;">Loading preview...</div>
+"""
+
+# Regions drawn by TodoTxtNoteHighlighter, used for hover hit-testing
+NOTE_REGION_KEYS = ("note_references_exists", "note_references_missing")
+
+
+def _region_containing(regions, point):
+    """Binary search regions, sorted and non-overlapping, for the one containing point"""
+    low, high = 0, len(regions)
+    while low < high:
+        middle = (low + high) // 2
+        if regions[middle].end() < point:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(regions) and regions[low].contains(point):
+        return regions[low]
+    return None
+
+
+@instrument
 class TodoTxtOpenNoteCommand(sublime_plugin.TextCommand):
     """Open a note file referenced in a todo.txt task"""
 
@@ -26,15 +63,38 @@ class TodoTxtOpenNoteCommand(sublime_plugin.TextCommand):
             with open(full_path, "w") as f:
                 pass
 
+            note_cache.refresh(parent_dir)
+
         # Open the file in Sublime Text
         self.view.window().open_file(full_path)
 
 
+@instrument
+class TodoTxtRefreshNotesCommand(sublime_plugin.TextCommand):
+    """Re-read note directories and re-highlight note references"""
+
+    def run(self, edit):
+        note_cache.refresh()
+        sublime.set_timeout_async(lambda: TodoTxtNoteHighlighter().highlight_notes(self.view), 0)
+
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
+
+
+@instrument
 class TodoTxtNoteNavigator(sublime_plugin.EventListener):
-    """Make note: references hoverable with preview"""
+    """Make note: references hoverable with preview
 
-    NOTE_PATTERN = r"\bnote:(\S+)"
-    MAX_PREVIEW_LINES = 500
+    The popup opens at once with a placeholder, the note is read on a worker
+    thread and filled in with update_popup() unless the popup was hidden or
+    replaced by another hover meanwhile.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # View id -> token of the hover whose popup is showing
+        self._hovers = {}
 
     def on_hover(self, view, point, hover_zone):
         if not self._should_process_hover(view, point, hover_zone):
@@ -44,61 +104,127 @@ class TodoTxtNoteNavigator(sublime_plugin.EventListener):
         if note_info:
             self._show_note_popup(view, point, note_info)
 
-    def _should_process_hover(self, view, point, hover_zone):
-        """Check if we should process this hover event"""
-        return view.match_selector(point, "text.todo") and hover_zone == sublime.HOVER_TEXT
+    def on_selection_modified_async(self, view):
+        # Prefetching is left out for large files
+        if view.file_name() and view.match_selector(0, "text.todo") and file_tier(view) == NORMAL:
+            scheduler.schedule(view, "note_prefetch", self.prefetch_notes)
 
-    def _get_note_at_point(self, view, point):
-        """Extract note information if hovering over a note reference"""
-        line_region = view.line(point)
-        line_text = view.substr(line_region)
+    @timed()
+    def prefetch_notes(self, view):
+        """Render the previews of notes referenced near the cursor in the background"""
+        selection = view.sel()
+        if not len(selection):
+            return
+        row = view.rowcol(selection[0].b)[0]
 
-        match = re.search(self.NOTE_PATTERN, line_text)
-        if not match:
-            return None
+        index = get_index(view)
+        with index.lock:
+            nearby = index.note_regions(row - PREFETCH_LINES, row + PREFETCH_LINES + 1)
+            note_files = [note_file for _, note_file in nearby]
+        if not note_files:
+            return
+
+        todo_file_dir = os.path.dirname(view.file_name())
+        full_paths = [os.path.normpath(os.path.join(todo_file_dir, note_file)) for note_file in note_files]
+        existing = [path for path, exists in zip(full_paths, note_cache.exists_many(full_paths)) if exists]
 
-        note_start = line_region.begin() + match.start()
-        note_end = line_region.begin() + match.end()
-        note_region = sublime.Region(note_start, note_end)
+        def prefetch():
+            for path in existing:
+                preview_cache.get(path, self._render_preview)
 
-        if not note_region.contains(point):
+        threading.Thread(target=prefetch, daemon=True).start()
+
+    def _should_process_hover(self, view, point, hover_zone):
+        """Check if we should process this hover event
+
+        Notes are relative to the todo file, so untitled views such as filter
+        results have none.
+        """
+        return (
+            bool(view.file_name())
+            and view.match_selector(point, "text.todo")
+            and hover_zone == sublime.HOVER_TEXT
+        )
+
+    def _get_note_at_point(self, view, point):
+        """Extract note information if hovering over a note reference"""
+        note_file, exists = self._note_file_at(view, point)
+        if note_file is None:
             return None
 
-        note_file = match.group(1)
         todo_file_dir = os.path.dirname(view.file_name())
         full_path = os.path.normpath(os.path.join(todo_file_dir, note_file))
 
+        # Existence is confirmed by the worker, it may need to list the directory
         return {
             "note_file": note_file,
             "full_path": full_path,
-            "exists": os.path.exists(full_path),
+            "exists": exists,
         }
 
+    def _note_file_at(self, view, point):
+        """Return (note_file, exists) for the note referenced at point, or (None, None)
+
+        Looks the point up in the regions drawn by TodoTxtNoteHighlighter,
+        whose key tells whether the note existed when highlighted, falling
+        back to parsing the line when it has not been highlighted yet; exists
+        is then None. Any number of note references per line is supported.
+        """
+        for key in NOTE_REGION_KEYS:
+            region = _region_containing(view.get_regions(key), point)
+            if region is not None:
+                prefix, sep, note_file = view.substr(region).partition(":")
+                if prefix == "note" and note_file:
+                    return note_file, key == "note_references_exists"
+
+        line_region = view.line(point)
+        line_text = view.substr(line_region)
+        if "note:" not in line_text:
+            return None, None
+        task = parse_task(line_text)
+        if task is None:
+            return None, None
+        for start, end, note_file in task.notes:
+            if line_region.begin() + start <= point <= line_region.begin() + end:
+                return note_file, None
+        return None, None
+
     def _read_file_preview(self, file_path):
-        """Read the first N lines of a file for preview"""
+        """Read the first note_preview_bytes of a file for preview"""
+        limit = get_setting("note_preview_bytes", DEFAULT_PREVIEW_BYTES)
         try:
-            lines = []
-            with open(file_path, "r", encoding="utf-8") as f:
-                for i in range(self.MAX_PREVIEW_LINES):
-                    line = f.readline()
-                    if not line:  # EOF reached
-                        break
-                    lines.append(line.rstrip("\n\r"))
-            return "\n".join(lines) if lines else None
+            with open(file_path, "rb") as f:
+                data = f.read(limit + 1)
         except Exception as e:
             return "Error: {0}".format(str(e))
 
-    def _build_popup_html(self, note_info, content_preview):
+        truncated = len(data) > limit
+        content = data[:limit].decode("utf-8", "replace")
+        if truncated:
+            # Cut at the last complete line
+            content = content[: content.rfind("\n") + 1 or len(content)] + "..."
+        content = "\n".join(line.rstrip("\r") for line in content.rstrip("\n").split("\n"))
+        return content or None
+
+    def _render_preview(self, file_path):
+        """Read and render the preview part of a note popup"""
+        return self._build_content_html(self._read_file_preview(file_path))
+
+    def _build_popup_html(self, note_info, content_html):
         """Build the HTML for the popup"""
         import html
 
         note_file = note_info["note_file"]
         full_path = note_info["full_path"]
+        # None while existence is not known yet
         exists = note_info["exists"]
 
-        action_text = "Click to open" if exists else "Click to create"
+        if exists is None:
+            action_text = "Click to open or create"
+        else:
+            action_text = "Click to open" if exists else "Click to create"
 
-        if not exists:
+        if exists is False:
             full_path = "<span style='color: red;'>{0}</span><br>".format(html.escape(full_path))
         else:
             full_path = "<span style='font-size: 0.9em; color: color(var(--foreground) alpha(0.7));'>{0}</span><br>".format(
@@ -108,30 +234,6 @@ class TodoTxtNoteNavigator(sublime_plugin.EventListener):
         # Only show status if file doesn't exist
         status_html = ""
 
-        content_html = ""
-        if exists:
-            if content_preview is None or content_preview == "":
-                # Empty file - show placeholder
-                content_html = """
-                    <div style="margin-top: 20px; overflow-y: auto; font-family: monospace;">
-                        <div style="font-size: 0.9em; color: color(var(--foreground) alpha(0.5)); font-style: italic;">&lt;EMPTY FILE&gt;</div>
-                    </div>
-                """
-            elif content_preview.startswith("Error:"):
-                content_html = (
-                    '<div style="margin-top: 20px; color: red; font-size: 0.9em;">{0}</div>'.format(
-                        html.escape(content_preview)
-                    )
-                )
-            else:
-                # Escape HTML and replace newlines with <br> for proper display
-                escaped_content = html.escape(content_preview).replace("\n", "<br>")
-                content_html = """
-                    <div style="margin-top: 20px; overflow-y: auto; font-family: monospace;">
-                        <div style="font-size: 0.9em; white-space: pre-wrap; word-wrap: break-word;">{0}</div>
-                    </div>
-                """.format(escaped_content)
-
         return """
         <body style="padding: 8px;">
             <div style="font-family: system;">
@@ -145,72 +247,160 @@ class TodoTxtNoteNavigator(sublime_plugin.EventListener):
         </body>
         """.format(html.escape(note_file), status_html, full_path, action_text, content_html)
 
+    def _build_content_html(self, content_preview):
+        """Build the HTML for the preview of an existing note"""
+        import html
+
+        if content_preview is None or content_preview == "":
+            # Empty file - show placeholder
+            return """
+                <div style="margin-top: 20px; overflow-y: auto; font-family: monospace;">
+                    <div style="font-size: 0.9em; color: color(var(--foreground) alpha(0.5)); font-style: italic;">&lt;EMPTY FILE&gt;</div>
+                </div>
+            """
+        if content_preview.startswith("Error:"):
+            return '<div style="margin-top: 20px; color: red; font-size: 0.9em;">{0}</div>'.format(
+                html.escape(content_preview)
+            )
+
+        # Escape HTML and replace newlines with <br> for proper display
+        escaped_content = html.escape(content_preview).replace("\n", "<br>")
+        return """
+            <div style="margin-top: 20px; overflow-y: auto; font-family: monospace;">
+                <div style="font-size: 0.9em; white-space: pre-wrap; word-wrap: break-word;">{0}</div>
+            </div>
+        """.format(escaped_content)
+
     def _show_note_popup(self, view, point, note_info):
-        """Show the popup with note information and preview"""
-        content_preview = None
-        if note_info["exists"]:
-            content_preview = self._read_file_preview(note_info["full_path"])
+        """Show the popup with a placeholder and load the preview in the background"""
+        view_id = view.id()
+        token = object()
+        self._hovers[view_id] = token
 
-        html = self._build_popup_html(note_info, content_preview)
+        def on_hide():
+            if self._hovers.get(view_id) is token:
+                del self._hovers[view_id]
 
+        # Missing notes have no preview to wait for
+        placeholder = "" if note_info["exists"] is False else LOADING_HTML
         view.show_popup(
-            html,
+            self._build_popup_html(note_info, placeholder),
             flags=sublime.HIDE_ON_MOUSE_MOVE_AWAY,
             location=point,
             max_width=600,
             on_navigate=lambda href: self.open_note(view, note_info["note_file"]),
+            on_hide=on_hide,
         )
 
+        threading.Thread(target=self._load_popup, args=(view, note_info, token), daemon=True).start()
+
+    def _load_popup(self, view, note_info, token):
+        """Read the note on a worker thread, then fill in the popup if still shown"""
+        view_id = view.id()
+        if self._hovers.get(view_id) is not token:
+            return
+
+        note_info = dict(note_info, exists=note_cache.exists(note_info["full_path"]))
+        content_html = ""
+        if note_info["exists"]:
+            content_html = preview_cache.get(note_info["full_path"], self._render_preview)
+        html = self._build_popup_html(note_info, content_html)
+
+        def update():
+            if self._hovers.get(view_id) is token and view.is_popup_visible():
+                view.update_popup(html)
+
+        sublime.set_timeout(update, 0)
+
     def open_note(self, view, file_path):
         """Trigger the command to open/create the note file"""
         view.run_command("todo_txt_open_note", {"file_path": file_path})
 
 
+@instrument
 class TodoTxtNoteHighlighter(sublime_plugin.EventListener):
-    """Highlight note: references"""
+    """Highlight note: references
 
-    NOTE_PATTERN = r"\bnote:(\S+)"
+    Views without a file name, such as filter results, are left alone since
+    notes are found relative to the todo file.
+    """
 
     def on_modified_async(self, view):
-        if view.match_selector(0, "text.todo"):
-            self.highlight_notes(view)
+        if view.file_name() and view.match_selector(0, "text.todo"):
+            scheduler.schedule(view, "notes", self.highlight_notes)
 
     def on_load_async(self, view):
-        if view.match_selector(0, "text.todo"):
-            self.highlight_notes(view)
+        if view.file_name() and view.match_selector(0, "text.todo"):
+            scheduler.schedule(view, "notes", self.highlight_notes, delay=0)
 
     def on_activated_async(self, view):
-        if view.match_selector(0, "text.todo"):
-            self.highlight_notes(view)
-
+        if view.file_name() and view.match_selector(0, "text.todo"):
+            scheduler.schedule(view, "notes", self.highlight_notes, delay=0)
+
+    def on_selection_modified_async(self, view):
+        # Large files are only highlighted around the visible region
+        if (
+            view.file_name()
+            and view.match_selector(0, "text.todo")
+            and file_tier(view) == LARGE
+            and visible_rows_changed(view, "notes")
+        ):
+            scheduler.schedule(view, "notes", self.highlight_notes)
+
+    @timed()
     def highlight_notes(self, view):
-        # Clear existing regions
-        view.erase_regions("note_references_exists")
-        view.erase_regions("note_references_missing")
-
-        # Find all note:path patterns
-        regions = view.find_all(self.NOTE_PATTERN)
+        tier = file_tier(view)
+        if tier == HUGE or not view.file_name():
+            self.draw_notes(view, {})
+            return
 
         todo_file_dir = os.path.dirname(view.file_name())
+
+        def split_notes(note_regions):
+            return self.split_notes(todo_file_dir, note_regions)
+
+        paint(
+            view,
+            "notes",
+            self.collect_notes,
+            self.draw_notes,
+            visible_only=tier == LARGE,
+            resolve=split_notes,
+        )
+
+    def collect_notes(self, index, start, stop):
+        """Return the (region, note_file) references found in rows [start, stop)"""
+        return list(index.note_regions(start, stop))
+
+    def split_notes(self, todo_file_dir, note_regions):
+        """Split note references by existence, outside the index lock as it may list directories"""
         existing_regions = []
         missing_regions = []
 
-        for region in regions:
-            text = view.substr(region)
-            match = re.match(self.NOTE_PATTERN, text)
-            if match:
-                note_file = match.group(1)
-                full_path = os.path.normpath(os.path.join(todo_file_dir, note_file))
+        full_paths = [
+            os.path.normpath(os.path.join(todo_file_dir, note_file)) for _, note_file in note_regions
+        ]
+
+        for (region, _), exists in zip(note_regions, note_cache.exists_many(full_paths)):
+            if exists:
+                existing_regions.append(region)
+            else:
+                missing_regions.append(region)
 
-                if os.path.exists(full_path):
-                    existing_regions.append(region)
-                else:
-                    missing_regions.append(region)
+        return {
+            "note_references_exists": existing_regions,
+            "note_references_missing": missing_regions,
+        }
+
+    def draw_notes(self, view, regions):
+        # Clear existing regions
+        view.erase_regions("note_references_exists")
+        view.erase_regions("note_references_missing")
 
         # Highlight existing notes with green underline
         view.add_regions(
             "note_references_exists",
-            existing_regions,
+            regions.get("note_references_exists", []),
             scope="region.greenish",
             flags=sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SOLID_UNDERLINE,
         )
@@ -218,7 +408,7 @@ class TodoTxtNoteHighlighter(sublime_plugin.EventListener):
         # Highlight missing notes with red underline
         view.add_regions(
             "note_references_missing",
-            missing_regions,
+            regions.get("note_references_missing", []),
             scope="region.redish",
             flags=sublime.DRAW_NO_FILL | sublime.DRAW_NO_OUTLINE | sublime.DRAW_SOLID_UNDERLINE,
         )
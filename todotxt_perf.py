@@ -0,0 +1,336 @@
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import threading
+import time
+from collections import deque
+
+import sublime
+import sublime_plugin
+
+from .todotxt_settings import SETTINGS_FILE, get_setting
+
+PROFILE_DIR = "profiles"
+
+DEFAULT_LOG_THRESHOLD = 100
+
+# Latest durations kept per operation to compute percentiles
+SAMPLE_SIZE = 1000
+
+# Functions listed in the console summary of a profile capture
+PROFILE_SUMMARY_LINES = 30
+
+# Tag of the settings listener keeping the enabled flag up to date
+SETTINGS_TAG = "todotxt_perf"
+
+
+def command_name(cls):
+    """TodoTxtSortCommand -> todo_txt_sort, the way Sublime names commands"""
+    name = cls.__name__
+    if name.endswith("Command"):
+        name = name[: -len("Command")]
+    return re.sub(r"(?<!^)([A-Z])", r"_\1", name).lower()
+
+
+def _view_lines(args):
+    """Return the line count of the view an operation works on, or None"""
+    for arg in args:
+        if isinstance(arg, sublime_plugin.TextChangeListener):
+            arg = arg.buffer.primary_view() if arg.buffer else None
+        elif isinstance(arg, sublime_plugin.TextCommand):
+            arg = arg.view
+        if isinstance(arg, sublime.View):
+            return arg.rowcol(arg.size())[0] + 1
+    return None
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class OperationStats(object):
+    __slots__ = ("count", "total", "maximum", "lines", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.lines = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+
+class PerfRecorder(object):
+    """Latency histograms of the plugin's commands and listener callbacks
+
+    Recording is opt-in through the performance_stats setting. Operations
+    slower than performance_log_threshold ms are also logged to the console.
+    Independently of the setting, capture() profiles the next invocations of
+    one operation with cProfile and dumps the result to the cache directory.
+    """
+
+    def __init__(self):
+        self._operations = {}
+        self._captures = {}
+        self._profiling = False
+        self._enabled = None
+        self._lock = threading.Lock()
+
+    def enabled(self):
+        """Return the performance_stats setting, cached until the settings change"""
+        enabled = self._enabled
+        if enabled is None:
+            enabled = self._enabled = bool(get_setting("performance_stats", False))
+        return enabled
+
+    def settings_changed(self):
+        self._enabled = None
+
+    def active(self):
+        """Check whether invocations are recorded or profiled at all"""
+        return bool(self._captures) or self.enabled()
+
+    def record(self, name, seconds, lines=None):
+        with self._lock:
+            stats = self._operations.get(name)
+            if stats is None:
+                stats = self._operations[name] = OperationStats()
+            stats.count += 1
+            stats.total += seconds
+            stats.maximum = max(stats.maximum, seconds)
+            stats.lines += lines or 0
+            stats.samples.append(seconds)
+
+        threshold = get_setting("performance_log_threshold", DEFAULT_LOG_THRESHOLD)
+        if threshold and seconds * 1000 >= threshold:
+            print(
+                "TodoTxt: {0} took {1:.0f} ms{2}".format(
+                    name, seconds * 1000, " ({0} lines)".format(lines) if lines else ""
+                )
+            )
+
+    def call(self, name, func, args, kwargs):
+        """Run func(*args, **kwargs) as an invocation of name"""
+        profiler = self._start_capture(name)
+        if profiler is None and not self.enabled():
+            return func(*args, **kwargs)
+
+        lines = _view_lines(args)
+        start = time.perf_counter()
+        try:
+            if profiler is None:
+                return func(*args, **kwargs)
+            return profiler.runcall(func, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                self._finish_capture(name)
+            if self.enabled():
+                self.record(name, seconds, lines)
+
+    def capture(self, name, count):
+        """Profile the next count invocations of the operation called name"""
+        with self._lock:
+            self._captures[name] = [count, cProfile.Profile()]
+
+    def _start_capture(self, name):
+        if not self._captures:
+            return None
+        with self._lock:
+            capture = self._captures.get(name)
+            # cProfile can only be active once, nested operations are not profiled apart
+            if capture is None or self._profiling:
+                return None
+            self._profiling = True
+            return capture[1]
+
+    def _finish_capture(self, name):
+        with self._lock:
+            self._profiling = False
+            capture = self._captures[name]
+            capture[0] -= 1
+            if capture[0] > 0:
+                return
+            del self._captures[name]
+        self._dump(name, capture[1])
+
+    def _dump(self, name, profiler):
+        directory = os.path.join(sublime.cache_path(), "TodoTxt", PROFILE_DIR)
+        path = os.path.join(
+            directory, "{0}-{1}.pstats".format(re.sub(r"\W+", "_", name), time.strftime("%Y%m%d-%H%M%S"))
+        )
+        summary = io.StringIO()
+        try:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(path)
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(PROFILE_SUMMARY_LINES)
+        except (OSError, TypeError) as e:
+            print("TodoTxt: Unable to save profile of {0} - {1}".format(name, str(e)))
+            return
+        print("TodoTxt: Profile of {0} saved to {1}\n{2}".format(name, path, summary.getvalue()))
+        sublime.status_message("TodoTxt: Profile of {0} saved to {1}".format(name, path))
+
+    def pending_captures(self):
+        with self._lock:
+            return {name: capture[0] for name, capture in self._captures.items()}
+
+    def summary(self):
+        """Return (name, count, p50, p95, max, total, lines per call) rows, slowest total first"""
+        with self._lock:
+            snapshot = [
+                (name, stats.count, sorted(stats.samples), stats.maximum, stats.total, stats.lines)
+                for name, stats in self._operations.items()
+            ]
+
+        rows = []
+        for name, count, ordered, maximum, total, lines in snapshot:
+            rows.append(
+                (name, count, _percentile(ordered, 0.5), _percentile(ordered, 0.95), maximum, total, lines // count)
+            )
+        rows.sort(key=lambda row: -row[5])
+        return rows
+
+    def reset(self):
+        with self._lock:
+            self._operations.clear()
+
+
+perf = PerfRecorder()
+
+
+def plugin_loaded():
+    sublime.load_settings(SETTINGS_FILE).add_on_change(SETTINGS_TAG, perf.settings_changed)
+    # Settings read before the plugin was loaded may not have been the user's
+    perf.settings_changed()
+
+
+def plugin_unloaded():
+    sublime.load_settings(SETTINGS_FILE).clear_on_change(SETTINGS_TAG)
+
+
+def timed(name=None):
+    """Decorator recording each call of a function as an invocation of name
+
+    name defaults to the function's qualified name.
+    """
+
+    def decorate(func):
+        operation = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not perf.active():
+                return func(*args, **kwargs)
+            return perf.call(operation, func, args, kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def instrument(cls):
+    """Class decorator timing run() and the on_* callbacks a class defines
+
+    Commands are recorded under their command name, listener callbacks as
+    ClassName.on_event. Inherited methods are recorded under the name of the
+    class actually running them.
+    """
+
+    def wrap(method_name, func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            # Nothing is worked out unless recording or profiling
+            if not perf.active():
+                return func(self, *args, **kwargs)
+            owner = type(self)
+            if method_name == "run":
+                operation = command_name(owner)
+            else:
+                operation = "{0}.{1}".format(owner.__name__, method_name)
+            return perf.call(operation, func, (self,) + args, kwargs)
+
+        return wrapper
+
+    for method_name, func in list(vars(cls).items()):
+        if callable(func) and (method_name == "run" or method_name.startswith("on_")):
+            setattr(cls, method_name, wrap(method_name, func))
+    return cls
+
+
+class TodoTxtShowPerformanceStatsCommand(sublime_plugin.TextCommand):
+    """Show the recorded latencies of the plugin's operations in a new view"""
+
+    def run(self, edit, reset=False):
+        window = self.view.window()
+        if reset:
+            perf.reset()
+            sublime.status_message("TodoTxt: Performance stats reset")
+            return
+        if window is None:
+            return
+
+        lines = []
+        if not perf.enabled():
+            lines.append('Recording is off, set "performance_stats" to true in the TodoTxt settings.\n')
+
+        header = ("operation", "count", "p50 ms", "p95 ms", "max ms", "total ms", "lines")
+        layout = "{0:<48} {1:>7} {2:>9} {3:>9} {4:>9} {5:>10} {6:>9}"
+        lines.append(layout.format(*header))
+        for name, count, p50, p95, maximum, total, average_lines in perf.summary():
+            lines.append(
+                layout.format(
+                    name,
+                    count,
+                    "{0:.1f}".format(p50 * 1000),
+                    "{0:.1f}".format(p95 * 1000),
+                    "{0:.1f}".format(maximum * 1000),
+                    "{0:.0f}".format(total * 1000),
+                    average_lines or "",
+                )
+            )
+
+        captures = perf.pending_captures()
+        if captures:
+            lines.append("")
+            for name, count in sorted(captures.items()):
+                lines.append("Profiling the next {0} invocation(s) of {1}".format(count, name))
+
+        stats_view = window.new_file()
+        stats_view.set_scratch(True)
+        stats_view.set_name("TodoTxt Performance")
+        stats_view.run_command("append", {"characters": "\n".join(lines) + "\n"})
+        stats_view.set_read_only(True)
+
+
+class TodoTxtProfileCommand(sublime_plugin.TextCommand):
+    """Capture a cProfile of the next invocations of an operation"""
+
+    def run(self, edit, operation=None, count=1):
+        view = self.view
+        if operation is None:
+            window = view.window()
+            if window:
+                window.show_input_panel(
+                    "Profile the next invocations of (operation count):",
+                    "todo_txt_sort 1",
+                    lambda text: self._on_done(text),
+                    None,
+                    None,
+                )
+            return
+
+        perf.capture(operation, max(int(count), 1))
+        sublime.status_message("TodoTxt: Profiling the next {0} invocation(s) of {1}".format(count, operation))
+
+    def _on_done(self, text):
+        parts = text.split()
+        if not parts:
+            return
+        try:
+            count = int(parts[1]) if len(parts) > 1 else 1
+        except ValueError:
+            sublime.status_message("TodoTxt: Invalid invocation count '{0}'".format(parts[1]))
+            return
+        self.view.run_command("todo_txt_profile", {"operation": parts[0], "count": count})
@@ -0,0 +1,60 @@
+import os
+import threading
+from collections import OrderedDict
+
+from .todotxt_settings import get_setting
+
+DEFAULT_CACHE_BYTES = 4 * 1024 * 1024
+
+
+class PreviewCache(object):
+    """LRU cache of rendered note previews
+
+    Entries are keyed by path, mtime and size, so an edited note is rendered
+    again on its next hover, and evicted least recently used first once the
+    rendered HTML exceeds note_preview_cache_bytes in total.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, path, render):
+        """Return render(path) for the current version of path, cached"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return render(path)
+        key = (path, stat.st_mtime, stat.st_size)
+
+        with self._lock:
+            html = self._entries.get(key)
+            if html is not None:
+                self._entries.move_to_end(key)
+                return html
+
+        html = render(path)
+        self._put(key, html)
+        return html
+
+    def _put(self, key, html):
+        limit = get_setting("note_preview_cache_bytes", DEFAULT_CACHE_BYTES)
+        with self._lock:
+            # Drop previous versions of the same note
+            for old_key in [old_key for old_key in self._entries if old_key[0] == key[0]]:
+                self._size -= len(self._entries.pop(old_key))
+
+            self._entries[key] = html
+            self._size += len(html)
+            while self._size > limit and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+preview_cache = PreviewCache()
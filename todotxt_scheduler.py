@@ -0,0 +1,75 @@
+import threading
+
+import sublime
+import sublime_plugin
+
+from .todotxt_perf import instrument
+from .todotxt_settings import get_setting
+
+DEFAULT_HIGHLIGHT_DELAY = 150
+
+
+class HighlightScheduler(object):
+    """Coalesce bursts of view modifications into a single deferred pass
+
+    Every call to schedule() supersedes the passes still pending for the same
+    view and name, so holding a key down results in one pass once the view
+    has been quiet for the configured delay.
+    """
+
+    def __init__(self):
+        self._generations = {}
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def schedule(self, view, name, callback, delay=None):
+        """Run callback(view) after delay ms unless rescheduled meanwhile"""
+        if delay is None:
+            delay = get_setting("highlight_delay", DEFAULT_HIGHLIGHT_DELAY)
+
+        key = (view.id(), name)
+        with self._lock:
+            generation = self._generations.get(key, 0) + 1
+            self._generations[key] = generation
+
+        def run():
+            with self._lock:
+                if self._generations.get(key) != generation:
+                    return
+                self._running[key] = generation
+            if view.is_valid():
+                callback(view)
+
+        sublime.set_timeout_async(run, delay)
+
+    def cancel(self, view, name):
+        """Drop any pending pass and mark a running one as stale"""
+        key = (view.id(), name)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def is_stale(self, view, name):
+        """Check whether a newer pass was scheduled since the running one started"""
+        key = (view.id(), name)
+        with self._lock:
+            running = self._running.get(key)
+            return running is not None and running != self._generations.get(key)
+
+    def discard(self, view):
+        """Forget all bookkeeping for a closed view"""
+        view_id = view.id()
+        with self._lock:
+            for key in [key for key in self._generations if key[0] == view_id]:
+                self._generations.pop(key, None)
+                self._running.pop(key, None)
+
+
+scheduler = HighlightScheduler()
+
+
+@instrument
+class TodoTxtSchedulerCleanup(sublime_plugin.EventListener):
+    """Release scheduler bookkeeping of closed views"""
+
+    def on_close(self, view):
+        scheduler.discard(view)
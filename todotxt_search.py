@@ -0,0 +1,335 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+import sublime
+import sublime_plugin
+
+from .todotxt_commands import DONE_FILE, SOMEDAY_FILE, TODO_FILE, WAITING_FILE
+from .todotxt_incremental import IncrementalReader, PerDirectory
+from .todotxt_perf import instrument, timed
+
+SEARCH_DIR = "search"
+SEARCH_FILES = (TODO_FILE, SOMEDAY_FILE, WAITING_FILE, DONE_FILE)
+SEARCH_VERSION = 2
+
+# Maximum number of results shown in the quick panel
+SEARCH_LIMIT = 1000
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def search_terms(text):
+    """Split text into the lowercase words the index is keyed by"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+def _rows(postings):
+    """View a posting list stored as an array or, when freshly loaded, as bytes"""
+    if isinstance(postings, bytes):
+        return memoryview(postings).cast("I")
+    return postings
+
+
+def _to_bytes(postings):
+    return {word: rows if isinstance(rows, bytes) else rows.tobytes() for word, rows in postings.items()}
+
+
+class FileIndex(object):
+    """Inverted index of one todo file, word -> line numbers
+
+    The file is read by an IncrementalReader and only complete lines are
+    indexed, the last line is scanned by search() if it has no newline.
+    Postings added since the last save are kept in pending so that they
+    can be persisted as a delta, pending is None when the whole file has
+    to be written.
+    """
+
+    __slots__ = ("path", "append_only", "reader", "starts", "postings", "pending", "pending_start", "_words")
+
+    def __init__(self, path, append_only=False):
+        self.path = path
+        self.append_only = append_only
+        self.reader = IncrementalReader(path, append_only)
+        self._reset()
+
+    def _reset(self):
+        self.starts = array("Q")
+        self.postings = {}
+        self.pending = None
+        self.pending_start = 0
+        self._words = None
+
+    def header(self):
+        return self.reader.state()
+
+    def state(self):
+        """Return the whole index in its persisted form"""
+        return (self.header(), self.starts.tobytes(), _to_bytes(self.postings))
+
+    def delta(self):
+        """Return the changes since the last save in their persisted form"""
+        return (self.header(), self.starts[self.pending_start :].tobytes(), _to_bytes(self.pending))
+
+    def saved(self):
+        self.pending = {}
+        self.pending_start = len(self.starts)
+
+    def load_state(self, state):
+        header, starts, postings = state
+        self.reader.load_state(header)
+        self.starts = array("Q")
+        self.starts.frombytes(starts)
+        self.postings = postings
+        self._words = None
+        self.saved()
+
+    def load_delta(self, delta):
+        header, starts, postings = delta
+        self.reader.load_state(header)
+        self.starts.frombytes(starts)
+        for word, rows in postings.items():
+            self._postings_for(word).frombytes(rows)
+        self._words = None
+        self.saved()
+
+    def _postings_for(self, word):
+        rows = self.postings.get(word)
+        if rows is None:
+            rows = self.postings[word] = array("I")
+        elif isinstance(rows, bytes):
+            loaded = array("I")
+            loaded.frombytes(rows)
+            rows = self.postings[word] = loaded
+        return rows
+
+    def update(self):
+        """Bring the index up to date with the file, return whether it changed"""
+        return self.reader.update(self._index, self._reset)
+
+    def _index(self, data, offset):
+        pending = self.pending
+        for line in data.split(b"\n")[:-1]:
+            row = len(self.starts)
+            self.starts.append(offset)
+            offset += len(line) + 1
+            for word in set(search_terms(line.decode("utf-8", "replace"))):
+                self._postings_for(word).append(row)
+                if pending is not None:
+                    rows = pending.get(word)
+                    if rows is None:
+                        rows = pending[word] = array("I")
+                    rows.append(row)
+        self._words = None
+
+    def _rows_for(self, term):
+        """Return the rows containing a word starting with term"""
+        if self._words is None:
+            self._words = sorted(self.postings)
+        words = self._words
+
+        matches = set()
+        i = bisect_left(words, term)
+        while i < len(words) and words[i].startswith(term):
+            matches.update(_rows(self.postings[words[i]]))
+            i += 1
+        return matches
+
+    def search(self, terms, limit, newest_first=False):
+        """Return up to limit (row, text) of lines containing every term, as word prefixes"""
+        rows = None
+        # Intersect starting from the rarest term to keep the sets small
+        for term in sorted(terms, key=lambda term: len(_rows(self.postings.get(term, b"")))):
+            matches = self._rows_for(term)
+            rows = matches if rows is None else rows & matches
+            if not rows:
+                break
+
+        results = []
+        try:
+            with open(self.path, "rb") as f:
+                # A last line without newline is not indexed yet, scan it directly
+                f.seek(self.reader.offset)
+                row = len(self.starts)
+                for line in f.read().decode("utf-8", "replace").split("\n"):
+                    words = search_terms(line)
+                    if line.strip() and all(any(word.startswith(term) for word in words) for term in terms):
+                        results.append((row, line.rstrip("\r")))
+                    row += 1
+
+                rows = sorted(rows or (), reverse=newest_first)
+                indexed = []
+                for row in rows[: max(limit - len(results), 0)]:
+                    f.seek(self.starts[row])
+                    indexed.append((row, f.readline().decode("utf-8", "replace").rstrip("\r\n")))
+        except OSError:
+            return []
+
+        if newest_first:
+            return (results + indexed)[:limit]
+        return (indexed + results)[:limit]
+
+
+class SearchIndex(object):
+    """Persistent search index over the todo files of one directory
+
+    Stored in Sublime's cache directory as a stream of pickles: a full
+    snapshot followed by the deltas of later appends to done.txt, which is
+    compacted into a new snapshot once MAX_DELTAS accumulate or another
+    file changes.
+    """
+
+    MAX_DELTAS = 64
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = [FileIndex(os.path.join(directory, name), name == DONE_FILE) for name in SEARCH_FILES]
+        self._deltas = None
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _index_file(self):
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(self.directory)).encode("utf-8")).hexdigest()
+        return os.path.join(sublime.cache_path(), "TodoTxt", SEARCH_DIR, key + ".pickle")
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._index_file(), "rb") as f:
+                snapshot = pickle.load(f)
+                if snapshot.get("version") != SEARCH_VERSION:
+                    return
+                deltas = []
+                while True:
+                    try:
+                        deltas.append(pickle.load(f))
+                    except EOFError:
+                        break
+        except Exception:
+            return
+
+        files = {os.path.basename(f.path): f for f in self.files}
+        for name, state in snapshot["files"].items():
+            if name in files:
+                files[name].load_state(state)
+        for name, delta in deltas:
+            if name in files:
+                files[name].load_delta(delta)
+        self._deltas = len(deltas)
+
+    def _save(self, changed):
+        """Persist the index, as a delta record per file in changed when possible"""
+        index_file = self._index_file()
+        try:
+            os.makedirs(os.path.dirname(index_file), exist_ok=True)
+            if self._deltas is None or self._deltas >= self.MAX_DELTAS or any(f.pending is None for f in self.files):
+                snapshot = {
+                    "version": SEARCH_VERSION,
+                    "files": {os.path.basename(f.path): f.state() for f in self.files},
+                }
+                with open(index_file + ".tmp", "wb") as f:
+                    pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(index_file + ".tmp", index_file)
+                self._deltas = 0
+            else:
+                with open(index_file, "ab") as f:
+                    for file_index in changed:
+                        delta = (os.path.basename(file_index.path), file_index.delta())
+                        pickle.dump(delta, f, pickle.HIGHEST_PROTOCOL)
+                self._deltas += len(changed)
+        except OSError as e:
+            print("TodoTxt: Unable to save search index - {0}".format(str(e)))
+            return
+        for file_index in self.files:
+            file_index.saved()
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Return up to limit (path, line_number, text) matching every word of query
+
+        Archived tasks are listed last, most recent first.
+        """
+        terms = search_terms(query)
+        if not terms:
+            return []
+
+        with self._lock:
+            self._load()
+            changed = []
+            for file_index in self.files:
+                try:
+                    if file_index.update():
+                        changed.append(file_index)
+                except OSError as e:
+                    print("TodoTxt: Unable to index {0} - {1}".format(file_index.path, str(e)))
+            if changed:
+                self._save(changed)
+
+            results = []
+            for file_index in self.files:
+                matches = file_index.search(terms, limit - len(results), file_index.append_only)
+                results.extend((file_index.path, row + 1, text) for row, text in matches)
+            return results
+
+
+_search_indexes = PerDirectory(SearchIndex)
+
+
+def get_search_index(directory):
+    """Return the shared search index of a directory"""
+    return _search_indexes.get(directory)
+
+
+@instrument
+class TodoTxtSearchTasksCommand(sublime_plugin.TextCommand):
+    """Search the tasks of todo.txt, someday.txt, waiting.txt and done.txt"""
+
+    def run(self, edit, query=None):
+        view = self.view
+        if not view.file_name():
+            sublime.status_message("TodoTxt: Please save the file first")
+            return
+
+        if query is None:
+            view.window().show_input_panel(
+                "Search tasks:",
+                "",
+                lambda text: view.run_command("todo_txt_search_tasks", {"query": text}),
+                None,
+                None,
+            )
+            return
+
+        directory = os.path.dirname(view.file_name())
+        sublime.set_timeout_async(lambda: self._search(directory, query), 0)
+
+    @timed()
+    def _search(self, directory, query):
+        results = get_search_index(directory).search(query)
+        sublime.set_timeout(lambda: self._show_results(query, results), 0)
+
+    def _show_results(self, query, results):
+        window = self.view.window()
+        if not results:
+            sublime.status_message("TodoTxt: No tasks match '{0}'".format(query))
+            return
+        if window is None:
+            return
+
+        items = [[text.strip(), "{0}:{1}".format(os.path.basename(path), line)] for path, line, text in results]
+
+        def on_select(index):
+            if index >= 0:
+                path, line, _text = results[index]
+                window.open_file("{0}:{1}".format(path, line), sublime.ENCODED_POSITION)
+
+        window.show_quick_panel(items, on_select)
+
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
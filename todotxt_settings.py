@@ -0,0 +1,8 @@
+import sublime
+
+SETTINGS_FILE = "TodoTxt.sublime-settings"
+
+
+def get_setting(key, default=None):
+    """Read a value from the package settings"""
+    return sublime.load_settings(SETTINGS_FILE).get(key, default)
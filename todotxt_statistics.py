@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import threading
+from datetime import date, timedelta
+
+import sublime
+import sublime_plugin
+
+from .todotxt_archive import ARCHIVE_DIR, ArchiveManifest
+from .todotxt_commands import DONE_FILE
+from .todotxt_incremental import IncrementalReader, PerDirectory
+from .todotxt_perf import instrument, timed
+from .todotxt_tasks import format_date, parse_task, today_ordinal
+
+STATISTICS_DIR = "statistics"
+STATISTICS_VERSION = 2
+
+# Rows of each section of the report
+REPORT_DAYS = 14
+REPORT_WEEKS = 12
+REPORT_TAGS = 20
+
+
+def _add(counts, key, amount=1):
+    counts[key] = counts.get(key, 0) + amount
+
+
+class FileStatistics(object):
+    """Completion aggregates of one archive file, checkpointed at a byte offset
+
+    Archive files only grow, so the IncrementalReader of the file only
+    parses what was appended since the checkpoint, anything else resets
+    the aggregates. The last line without a newline left out by the reader
+    is counted in partial, which is parsed again on every update.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.reader = IncrementalReader(path, append_only=True)
+        self.partial = None
+        self.reset()
+
+    def reset(self):
+        # Completion date -> tasks, completed tasks without one are only counted
+        self.days = {}
+        self.undated = 0
+        self.projects = {}
+        self.contexts = {}
+        # Days from creation to completion -> tasks
+        self.lead_times = {}
+
+    def state(self):
+        return {
+            "checkpoint": self.reader.state(),
+            "days": self.days,
+            "undated": self.undated,
+            "projects": self.projects,
+            "contexts": self.contexts,
+            "lead_times": self.lead_times,
+        }
+
+    def load_state(self, state):
+        self.reader.load_state(state["checkpoint"])
+        self.days = state["days"]
+        self.undated = state["undated"]
+        self.projects = state["projects"]
+        self.contexts = state["contexts"]
+        self.lead_times = {int(days): count for days, count in state["lead_times"].items()}
+
+    def update(self):
+        """Parse what was appended since the checkpoint, return True if the checkpoint moved"""
+        changed = self.reader.update(lambda data, offset: self._parse(data.decode("utf-8", "replace")), self.reset)
+        self.partial = None
+        if self.reader.partial:
+            self.partial = FileStatistics(self.path)
+            self.partial._parse(self.reader.partial)
+        return changed
+
+    def _parse(self, text):
+        for line in text.split("\n"):
+            task = parse_task(line.rstrip("\r"))
+            if task is None or not task.completed:
+                continue
+
+            for project in task.projects:
+                _add(self.projects, project)
+            for context in task.contexts:
+                _add(self.contexts, context)
+
+            if task.completion_date is None:
+                self.undated += 1
+                continue
+            _add(self.days, format_date(task.completion_date))
+            if task.creation_date is not None and task.creation_date <= task.completion_date:
+                _add(self.lead_times, task.completion_date - task.creation_date)
+
+
+class DoneStatistics(object):
+    """Completion statistics of done.txt and the monthly archive of a directory
+
+    The aggregates and checkpoints of every file are persisted in Sublime's
+    cache directory, so a run only parses what was archived since the last
+    one.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _statistics_file(self):
+        key = hashlib.sha1(os.path.normcase(os.path.abspath(self.directory)).encode("utf-8")).hexdigest()
+        return os.path.join(sublime.cache_path(), "TodoTxt", STATISTICS_DIR, key + ".json")
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self._statistics_file(), "r", encoding="utf-8") as f:
+                stored = json.load(f)
+            if stored.get("version") != STATISTICS_VERSION:
+                return
+            for path, state in stored["files"].items():
+                file_statistics = FileStatistics(path)
+                file_statistics.load_state(state)
+                self.files[path] = file_statistics
+        except (OSError, ValueError, KeyError, TypeError):
+            self.files = {}
+
+    def _save(self):
+        statistics_file = self._statistics_file()
+        stored = {
+            "version": STATISTICS_VERSION,
+            "files": {path: file_statistics.state() for path, file_statistics in self.files.items()},
+        }
+        try:
+            os.makedirs(os.path.dirname(statistics_file), exist_ok=True)
+            with open(statistics_file + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(stored, f)
+            os.replace(statistics_file + ".tmp", statistics_file)
+        except OSError as e:
+            print("TodoTxt: Unable to save statistics - {0}".format(str(e)))
+
+    def _archive_paths(self):
+        paths = [os.path.join(self.directory, DONE_FILE)]
+        manifest = ArchiveManifest(os.path.join(self.directory, ARCHIVE_DIR)).load()
+        paths.extend(manifest.partitions_between())
+        return [path for path in paths if os.path.exists(path)]
+
+    def update(self):
+        """Bring the aggregates up to date, return the FileStatistics of every archive file
+
+        The unterminated last lines of the files are included as FileStatistics of their own.
+        """
+        with self._lock:
+            self._load()
+            paths = self._archive_paths()
+            changed = False
+
+            # Partitions compressed since the last run are parsed again under their new name
+            for path in [path for path in self.files if path not in paths]:
+                del self.files[path]
+                changed = True
+
+            for path in paths:
+                file_statistics = self.files.get(path)
+                if file_statistics is None:
+                    file_statistics = self.files[path] = FileStatistics(path)
+                try:
+                    changed = file_statistics.update() or changed
+                except (OSError, EOFError) as e:
+                    print("TodoTxt: Unable to read {0} - {1}".format(path, str(e)))
+
+            if changed:
+                self._save()
+            files = list(self.files.values())
+            return files + [file_statistics.partial for file_statistics in files if file_statistics.partial]
+
+
+_statistics = PerDirectory(DoneStatistics)
+
+
+def get_statistics(directory):
+    """Return the shared statistics of a directory"""
+    return _statistics.get(directory)
+
+
+def _median(histogram):
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen * 2 >= total:
+            return value
+
+
+def _top(counts, sigil):
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0].lower()))
+    return ["  {0:<30} {1:>8}".format(sigil + name, count) for name, count in ordered[:REPORT_TAGS]]
+
+
+def format_report(files, today=None):
+    """Render the merged aggregates of files as the text of the report"""
+    if today is None:
+        today = today_ordinal()
+
+    days = {}
+    projects = {}
+    contexts = {}
+    lead_times = {}
+    undated = 0
+    for file_statistics in files:
+        for day, count in file_statistics.days.items():
+            _add(days, day, count)
+        for project, count in file_statistics.projects.items():
+            _add(projects, project, count)
+        for context, count in file_statistics.contexts.items():
+            _add(contexts, context, count)
+        for lead_time, count in file_statistics.lead_times.items():
+            _add(lead_times, lead_time, count)
+        undated += file_statistics.undated
+
+    lines = ["Completed tasks: {0}".format(sum(days.values()) + undated)]
+    if undated:
+        lines.append("Without a completion date: {0}".format(undated))
+    median = _median(lead_times)
+    if median is not None:
+        lines.append(
+            "Median time from creation to completion: {0} day(s), over {1} tasks with both dates".format(
+                median, sum(lead_times.values())
+            )
+        )
+
+    lines.extend(["", "Per day"])
+    for ordinal in range(today - REPORT_DAYS + 1, today + 1):
+        day = format_date(ordinal)
+        lines.append("  {0} {1:<3} {2:>8}".format(day, date.fromordinal(ordinal).strftime("%a"), days.get(day, 0)))
+
+    weeks = {}
+    for day, count in days.items():
+        year, week, _ = date(int(day[0:4]), int(day[5:7]), int(day[8:10])).isocalendar()
+        _add(weeks, (year, week), count)
+    lines.extend(["", "Per week"])
+    current = date.fromordinal(today)
+    for weeks_ago in range(REPORT_WEEKS - 1, -1, -1):
+        year, week, _ = (current - timedelta(weeks=weeks_ago)).isocalendar()
+        lines.append("  {0}-W{1:02d} {2:>13}".format(year, week, weeks.get((year, week), 0)))
+
+    lines.extend(["", "Per project"] + (_top(projects, "+") or ["  none"]))
+    lines.extend(["", "Per context"] + (_top(contexts, "@") or ["  none"]))
+    return "\n".join(lines) + "\n"
+
+
+@instrument
+class TodoTxtStatisticsCommand(sublime_plugin.TextCommand):
+    """Report completed tasks per day, week, project and context from the archive"""
+
+    def run(self, edit):
+        view = self.view
+        if not view.file_name():
+            sublime.status_message("TodoTxt: Please save the file first")
+            return
+
+        directory = os.path.dirname(view.file_name())
+        sublime.status_message("TodoTxt: Computing statistics...")
+        sublime.set_timeout_async(lambda: self._compute(directory), 0)
+
+    @timed()
+    def _compute(self, directory):
+        report = format_report(get_statistics(directory).update())
+        sublime.set_timeout(lambda: self._show_report(report), 0)
+
+    def _show_report(self, report):
+        window = self.view.window()
+        if window is None:
+            return
+        report_view = window.new_file()
+        report_view.set_scratch(True)
+        report_view.set_name("TodoTxt Statistics")
+        report_view.run_command("append", {"characters": report})
+        report_view.set_read_only(True)
+
+    def is_enabled(self):
+        """Only enable in todo.txt files"""
+        return self.view.match_selector(0, "text.todo")
@@ -0,0 +1,151 @@
+import json
+import os
+import threading
+import time
+
+import sublime
+
+from .todotxt_tasks import count_tags
+
+CACHE_FILE = "tags.json"
+
+# Seconds between stat calls on the same sibling file
+STAT_INTERVAL = 10
+
+
+class SiblingTagCache(object):
+    """Tag counts of the todo files next to a view
+
+    Counts are gathered by a background thread and persisted in Sublime's
+    cache directory keyed by each file's size and mtime, so an unchanged
+    done.txt is never read again, not even after a restart. Entries of
+    files deleted or renamed since are dropped when the cache is saved.
+
+    refresh() checks the files on disk and is meant for the async thread,
+    tags() only reads the counts in memory and is cheap enough for every
+    completion request.
+    """
+
+    def __init__(self):
+        self._entries = None
+        self._checked = {}
+        self._scanning = set()
+        self._lock = threading.Lock()
+        # Serializes writes of the cache file, which happen outside _lock
+        self._save_lock = threading.Lock()
+
+    def _cache_file(self):
+        return os.path.join(sublime.cache_path(), "TodoTxt", CACHE_FILE)
+
+    def _load(self):
+        """Read the cache file once, outside the lock so tags() never waits for the disk"""
+        if self._entries is not None:
+            return
+        try:
+            with open(self._cache_file(), "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        with self._lock:
+            if self._entries is None:
+                self._entries = entries
+
+    def _save(self, entries):
+        cache_file = self._cache_file()
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                with open(cache_file + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(entries, f)
+                os.replace(cache_file + ".tmp", cache_file)
+            except OSError as e:
+                print("TodoTxt: Unable to save tag cache - {0}".format(str(e)))
+
+    def tags(self, paths, sigil):
+        """Return merged counts of one tag kind across paths, as last refreshed"""
+        merged = {}
+        with self._lock:
+            if self._entries is None:
+                return merged
+            for path in paths:
+                entry = self._entries.get(path)
+                if entry:
+                    for tag, count in entry[sigil].items():
+                        merged[tag] = merged.get(tag, 0) + count
+        return merged
+
+    def refresh(self, paths):
+        """Rescan in the background the files of paths whose cached entry is missing or stale
+
+        Each file is checked at most every STAT_INTERVAL seconds, or at the
+        next refresh once invalidated.
+        """
+        self._load()
+        now = time.time()
+        with self._lock:
+            entries = dict(self._entries)
+            due = [
+                path
+                for path in paths
+                if path not in self._scanning and now - self._checked.get(path, 0) >= STAT_INTERVAL
+            ]
+            for path in due:
+                self._checked[path] = now
+
+        stale = [path for path in due if not self._is_current(path, entries.get(path))]
+        if not stale:
+            return
+        with self._lock:
+            stale = [path for path in stale if path not in self._scanning]
+            self._scanning.update(stale)
+        if stale:
+            threading.Thread(target=self._scan, args=(stale,), daemon=True).start()
+
+    def invalidate(self, path):
+        """Check path at the next refresh, as it was just written"""
+        with self._lock:
+            self._checked.pop(path, None)
+
+    def _is_current(self, path, entry):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return entry is None
+        return entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    def _scan(self, paths):
+        results = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                with open(path, "r", encoding="utf-8", errors="replace") as f:
+                    counts = count_tags(f.read())
+            except OSError:
+                results[path] = None
+                continue
+            counts["size"] = stat.st_size
+            counts["mtime"] = stat.st_mtime
+            results[path] = counts
+
+        with self._lock:
+            for path, entry in results.items():
+                self._scanning.discard(path)
+                if entry is None:
+                    self._entries.pop(path, None)
+                else:
+                    self._entries[path] = entry
+            # Entries are replaced, never modified, so a shallow copy is a stable snapshot
+            entries = dict(self._entries)
+
+        missing = [path for path in entries if not os.path.exists(path)]
+        if missing:
+            with self._lock:
+                for path in missing:
+                    self._entries.pop(path, None)
+                    self._checked.pop(path, None)
+            for path in missing:
+                del entries[path]
+        self._save(entries)
+
+
+sibling_tags = SiblingTagCache()
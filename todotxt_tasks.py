@@ -0,0 +1,161 @@
+import re
+from datetime import date
+
+# Optional completion marker, completion date, priority and creation date
+TASK_HEADER_PATTERN = re.compile(
+    r"(\s*)(?:(x)\s+(?:(\d{4}-\d{2}-\d{2})\s+)?)?(?:\(([A-Z])\)\s+)?(?:(\d{4}-\d{2}-\d{2})\s+)?"
+)
+TOKEN_PATTERN = re.compile(r"\S+")
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}\b")
+META_KEY_PATTERN = re.compile(r"\w+$")
+TAG_PATTERN = re.compile(r"(?<!\S)([@+])(\S+)")
+
+# Parsed date strings are shared across every line of every file
+_date_ordinals = {}
+_DATE_CACHE_LIMIT = 20000
+
+_EMPTY = ()
+
+
+def date_ordinal(date_str):
+    """Convert a YYYY-MM-DD string to a date ordinal, or None if invalid"""
+    try:
+        return _date_ordinals[date_str]
+    except KeyError:
+        pass
+
+    try:
+        ordinal = date(int(date_str[0:4]), int(date_str[5:7]), int(date_str[8:10])).toordinal()
+    except ValueError:
+        ordinal = None
+
+    if len(_date_ordinals) < _DATE_CACHE_LIMIT:
+        _date_ordinals[date_str] = ordinal
+    return ordinal
+
+
+def format_date(ordinal):
+    """Convert a date ordinal back to a YYYY-MM-DD string"""
+    return date.fromordinal(ordinal).isoformat()
+
+
+def today_ordinal():
+    """Return today's date as an ordinal"""
+    return date.today().toordinal()
+
+
+class Task(object):
+    """A single todo.txt line, parsed once
+
+    Dates are stored as ordinals, spans are (start, end) offsets relative to
+    the beginning of the line.
+    """
+
+    __slots__ = (
+        "text",
+        "completed",
+        "completion_date",
+        "priority",
+        "creation_date",
+        "body_start",
+        "contexts",
+        "projects",
+        "meta",
+        "due",
+        "due_span",
+        "notes",
+    )
+
+    def __init__(self, text):
+        self.text = text
+        self.completed = False
+        self.completion_date = None
+        self.priority = None
+        self.creation_date = None
+        self.body_start = 0
+        self.contexts = _EMPTY
+        self.projects = _EMPTY
+        self.meta = _EMPTY
+        self.due = None
+        self.due_span = None
+        self.notes = _EMPTY
+
+    def get(self, key, default=None):
+        """Return the first value of a key:value metadata pair"""
+        for meta_key, value in self.meta:
+            if meta_key == key:
+                return value
+        return default
+
+    def __repr__(self):
+        return "Task({0!r})".format(self.text)
+
+
+def parse_task(line):
+    """Parse a line into a Task, or return None for blank lines"""
+    if not line or line.isspace():
+        return None
+
+    task = Task(line)
+
+    header = TASK_HEADER_PATTERN.match(line)
+    if header.group(2):
+        task.completed = True
+        if header.group(3):
+            task.completion_date = date_ordinal(header.group(3))
+    task.priority = header.group(4)
+    if header.group(5):
+        task.creation_date = date_ordinal(header.group(5))
+    task.body_start = header.end()
+
+    contexts = []
+    projects = []
+    meta = []
+    notes = []
+
+    for match in TOKEN_PATTERN.finditer(line, task.body_start):
+        token = match.group()
+        sigil = token[0]
+
+        if sigil == "@":
+            if len(token) > 1:
+                contexts.append(token[1:])
+            continue
+        if sigil == "+":
+            if len(token) > 1:
+                projects.append(token[1:])
+            continue
+
+        key, sep, value = token.partition(":")
+        if not sep or not value or value.startswith("//") or not META_KEY_PATTERN.match(key):
+            continue
+
+        meta.append((key, value))
+        if key == "due":
+            if task.due is None and DATE_PATTERN.match(value):
+                ordinal = date_ordinal(value[:10])
+                if ordinal is not None:
+                    task.due = ordinal
+                    task.due_span = (match.start(), match.start() + 14)
+        elif key == "note":
+            notes.append((match.start(), match.end(), value))
+
+    if contexts:
+        task.contexts = tuple(contexts)
+    if projects:
+        task.projects = tuple(projects)
+    if meta:
+        task.meta = tuple(meta)
+    if notes:
+        task.notes = tuple(notes)
+
+    return task
+
+
+def count_tags(text):
+    """Count contexts and projects in text without parsing whole tasks"""
+    counts = {"@": {}, "+": {}}
+    for sigil, tag in TAG_PATTERN.findall(text):
+        tags = counts[sigil]
+        tags[tag] = tags.get(tag, 0) + 1
+    return counts
@@ -0,0 +1,132 @@
+import os
+import threading
+from collections import OrderedDict
+
+import sublime
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, appends are then only serialized in-process
+    fcntl = None
+
+
+class AppendJob(object):
+    """A pending append to a file
+
+    prepare(offset, needs_newline) is called on the writer thread while the
+    file is locked and returns the bytes to append at offset. before_write()
+    runs once per batch after every job was prepared, on_done(error) is
+    called on the main thread once the data is on disk.
+    """
+
+    __slots__ = ("prepare", "before_write", "on_done")
+
+    def __init__(self, prepare, before_write=None, on_done=None):
+        self.prepare = prepare
+        self.before_write = before_write
+        self.on_done = on_done
+
+
+class AppendWriter(object):
+    """Background thread appending to files under an exclusive lock
+
+    Jobs queued for the same file while a write is in progress are
+    coalesced into a single write() and fsync(). Functions queued with
+    call() or when_idle() run on the same thread, so they never overlap a
+    write.
+    """
+
+    def __init__(self):
+        self._queue = OrderedDict()
+        self._idle = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def append(self, path, job):
+        with self._condition:
+            self._queue.setdefault(path, []).append(job)
+            self._start()
+
+    def call(self, fn):
+        """Run fn on the writer thread after everything queued so far"""
+        with self._condition:
+            self._queue[object()] = fn
+            self._start()
+
+    def when_idle(self, fn):
+        """Run fn on the writer thread once nothing else is queued"""
+        with self._condition:
+            self._idle.append(fn)
+            self._start()
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="TodoTxt writer", daemon=True)
+            self._thread.start()
+        self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._idle:
+                    self._condition.wait()
+                if self._queue:
+                    key, work = self._queue.popitem(last=False)
+                else:
+                    key, work = None, self._idle.pop(0)
+            if callable(work):
+                self._call(work)
+            else:
+                self._write(key, work)
+
+    def _call(self, fn):
+        try:
+            fn()
+        except Exception as e:
+            print("TodoTxt: Unable to complete a background write - {0}".format(str(e)))
+
+    def _write(self, path, jobs):
+        error = None
+        try:
+            with open(path, "a+b") as f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    # Decide on a separating newline under the lock, as another
+                    # process may have appended since the job was queued
+                    offset = f.seek(0, os.SEEK_END)
+                    newline = False
+                    if offset:
+                        f.seek(offset - 1)
+                        newline = f.read(1) not in (b"\n", b"\r")
+
+                    chunks = []
+                    for job in jobs:
+                        data = job.prepare(offset, newline)
+                        chunks.append(data)
+                        offset += len(data)
+                        newline = newline and not data
+
+                    hooks = []
+                    for job in jobs:
+                        if job.before_write is not None and job.before_write not in hooks:
+                            hooks.append(job.before_write)
+                    for hook in hooks:
+                        hook()
+
+                    f.write(b"".join(chunks))
+                    f.flush()
+                    os.fsync(f.fileno())
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        except Exception as e:
+            error = e
+
+        for job in jobs:
+            if job.on_done is not None:
+                sublime.set_timeout(lambda job=job: job.on_done(error), 0)
+
+
+writer = AppendWriter()